@@ -2,38 +2,132 @@ import time
 import webbrowser
 from flask import Flask
 from views import views
+import monitoring
 import subprocess
 import argparse
+import multiprocessing
+import os
+import platform
+import socket
+import threading
+import urllib.request
 
 app = Flask(__name__)
 app.register_blueprint(views, url_prefix="/views")
 
+@app.route("/metrics")
+def metrics():
+    # Prometheus text format, every production worker answers with its own numbers
+    return monitoring.REGISTRY.render(), 200, {'Content-Type': monitoring.CONTENT_TYPE}
+
 def get_args():
     parser = argparse.ArgumentParser()
     parser.add_argument("--debug", help="Enable Flask Debug", action="store_true")
+    parser.add_argument("--production", help="Serve with several worker processes instead of the Flask development server", action="store_true")
+    parser.add_argument("--workers", help="Worker processes in production mode", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--headless", help="Don't open a browser", action="store_true")
+    parser.add_argument("--trace-dir", help="Write a Chrome trace of every review to this directory")
+    parser.add_argument("--engine-hash", help="Hash table of every Stockfish process in MB", type=int)
+    parser.add_argument("--engine-threads", help="Search threads of every Stockfish process", type=int)
     return parser.parse_args()
 
+def is_headless():
+    if platform.system() in ['Windows', 'Darwin']:
+        return False
+    return not (os.environ.get('DISPLAY') or os.environ.get('WAYLAND_DISPLAY'))
+
+def wait_until_ready(url, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with urllib.request.urlopen(url, timeout=1) as response:
+                if response.status == 200:
+                    return True
+        except OSError:
+            time.sleep(0.1)
+    return False
+
+def serve_worker(fd, host, port):
+    from werkzeug.serving import make_server
+    import chess_review
+
+    # every worker gets its own running engines, started before it accepts requests
+    try:
+        chess_review.warm_up()
+    except OSError as error:
+        print(f'worker {os.getpid()}: could not start Stockfish ({error}), reviews will fail until it is installed')
+
+    server = make_server(host, port, app, threaded=True, fd=fd)
+    server.serve_forever()
+
+def serve(host, port, workers):
+    # the workers share one listening socket and the kernel spreads the connections between them
+    listener = socket.create_server((host, port), backlog=128)
+    listener.set_inheritable(True)
+
+    if 'fork' in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context('fork')
+        # the admission limits hold for all the workers together, not for each of them
+        import chess_review
+        chess_review.REVIEW_SCHEDULER.share(context)
+    else:
+        print('worker processes need fork, serving with a single process')
+        context = None
+        workers = 1
+
+    if context is None:
+        processes = []
+        threading.Thread(target=serve_worker, args=(listener.fileno(), host, port), daemon=True).start()
+    else:
+        processes = [context.Process(target=serve_worker, args=(listener.fileno(), host, port), daemon=True) for _ in range(workers)]
+        for process in processes:
+            process.start()
+
+    return listener, processes
+
 if __name__ == '__main__':
     py_args = get_args()
-    # Run the app in a separate process
-    cli_args = ["python", "-m", "flask", "run", "--port=8000"]
-    if py_args.debug:
-        cli_args.append("--debug")
+    url = f"http://{py_args.host}:{py_args.port}/views/"
+
+    # the forked workers see the module settings, the flask subprocess the environment
+    import chess_review
+    if py_args.trace_dir:
+        chess_review.TRACE_DIR = py_args.trace_dir
+        os.environ['GAMEREVIEW_TRACE_DIR'] = py_args.trace_dir
+    if py_args.engine_hash:
+        chess_review.ENGINE_HASH_MB = py_args.engine_hash
+        os.environ['GAMEREVIEW_ENGINE_HASH'] = str(py_args.engine_hash)
+    if py_args.engine_threads:
+        chess_review.ENGINE_THREADS = py_args.engine_threads
+        os.environ['GAMEREVIEW_ENGINE_THREADS'] = str(py_args.engine_threads)
+
+    if py_args.production:
+        listener, processes = serve(py_args.host, py_args.port, py_args.workers)
     else:
-        cli_args.append("--no-reload")
+        # Run the app in a separate process
+        cli_args = ["python", "-m", "flask", "run", f"--host={py_args.host}", f"--port={py_args.port}"]
+        if py_args.debug:
+            cli_args.append("--debug")
+        else:
+            cli_args.append("--no-reload")
 
-    process = subprocess.Popen(cli_args)
+        process = subprocess.Popen(cli_args)
+        processes = [process]
 
-    # Wait in case of unexpected lag
-    time.sleep(1)
+    if not wait_until_ready(url + "health"):
+        print(f"server did not answer on {url} yet")
 
     # Open the URL in the default web browser
-    webbrowser.open("http://127.0.0.1:8000/views/")
+    if not (py_args.headless or is_headless()):
+        webbrowser.open(url)
 
     try:
         # Wait for the user to press Ctrl+C
         while True:
             time.sleep(1)
     except KeyboardInterrupt:
-        # Stop the Flask server
-        process.terminate()
+        # Stop the server
+        for process in processes:
+            process.terminate()
@@ -0,0 +1,55 @@
+import argparse
+import os
+import random
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import chess_review
+
+
+def random_games(n_games, seed=0):
+    rng = random.Random(seed)
+    games = []
+    best_games = []
+    for _ in range(n_games):
+        scores = [rng.randint(-1000, 1000) for _ in range(rng.randint(20, 160))]
+        games.append(scores)
+        best_games.append([s + rng.randint(-300, 300) for s in scores])
+    return games, best_games
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description="Time per-game summaries against one summarise_games call")
+    parser.add_argument("--games", type=int, default=5000)
+    parser.add_argument("--seed", type=int, default=0)
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = get_args()
+    games, best_games = random_games(args.games, args.seed)
+
+    start = time.perf_counter()
+    per_game = []
+    for scores, best_scores in zip(games, best_games):
+        white_acc, black_acc = chess_review.calculate_accuracy(scores)
+        cpls = [abs(b - s) for b, s in zip(best_scores, scores)]
+        average_cpl_white = sum(cpls[0::2]) / len(cpls[0::2])
+        average_cpl_black = sum(cpls[1::2]) / len(cpls[1::2])
+        n_moves = len(scores) // 2
+        per_game.append((
+            white_acc, black_acc, average_cpl_white, average_cpl_black,
+            chess_review.estimate_elo(average_cpl_white, n_moves), chess_review.estimate_elo(average_cpl_black, n_moves)
+        ))
+    per_game_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    offsets = chess_review.get_game_offsets([len(scores) for scores in games])
+    batch = chess_review.summarise_games(np.concatenate(games), np.concatenate(best_games), offsets)
+    batch_time = time.perf_counter() - start
+
+    max_difference = np.abs(np.array(per_game) - np.stack(batch, axis=1)).max()
+    print(f'{args.games} games: per game {per_game_time:.3f}s, batch {batch_time:.3f}s, max difference {max_difference:.2e}')
@@ -0,0 +1,50 @@
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import chess_review
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description="Record the engine searches of a review, or replay them to time the python side without Stockfish")
+    parser.add_argument("mode", choices=["record", "replay"])
+    parser.add_argument("pgn", help="PGN file of the game to review")
+    parser.add_argument("cassette", help="Recorded searches, e.g. game.cassette.json.gz")
+    parser.add_argument("--limit-type", choices=["depth", "time"], default="depth")
+    parser.add_argument("--depth", type=int, default=12)
+    parser.add_argument("--time", type=float, default=0.25)
+    parser.add_argument("--repeat", type=int, default=3, help="Replays to time")
+    parser.add_argument("--output", help="Write the reviews as JSON, to compare two versions of the code")
+    parser.add_argument("--trace-dir", help="Write a Chrome trace of every review to this directory")
+    return parser.parse_args()
+
+
+def review(pgn_data, args):
+    chess_review.analyse_pgn.cache_clear()
+    chess_review.REVIEWED_GAMES.clear()
+    return [chess_review.pgn_game_review(pgn_data, roast, args.limit_type, args.time, args.depth) for roast in [False, True]]
+
+
+if __name__ == '__main__':
+    args = get_args()
+    chess_review.progress_bar = lambda iterable: iterable
+    chess_review.TRACE_DIR = args.trace_dir
+
+    with open(args.pgn) as pgn_file:
+        pgn_data = pgn_file.read()
+
+    timings = []
+    with chess_review.engine_cassette(args.cassette, args.mode) as cassette:
+        for _ in range(1 if args.mode == 'record' else args.repeat):
+            start = time.perf_counter()
+            reviews = review(pgn_data, args)
+            timings.append(time.perf_counter() - start)
+
+    print(f'{args.mode}: {len(cassette.searches)} searches, best of {len(timings)}: {min(timings):.3f}s')
+
+    if args.output is not None:
+        with open(args.output, 'w') as output_file:
+            json.dump(reviews, output_file, indent=1, default=str)
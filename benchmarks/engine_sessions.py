@@ -0,0 +1,64 @@
+import argparse
+import os
+import sys
+
+import chess
+import chess.engine
+import chess.pgn
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import chess_review
+
+
+def game_positions(pgn_path):
+    with open(pgn_path) as pgn_file:
+        game = chess.pgn.read_game(pgn_file)
+
+    board = game.board()
+    for move in game.mainline_moves():
+        yield board.copy(stack=False)
+        board.push(move)
+
+
+def search_game(pool, positions, limit, warm):
+    # warm: one game for every search, the hash carries over from ply to ply
+    # cold: every search is a new game, ucinewgame empties the hash before it
+    game = object()
+    depths = []
+    nodes = 0
+    seconds = 0.0
+    for board in positions:
+        info = pool.analyse(board, limit, game=game if warm else object())
+        depths.append(info.get('depth', 0))
+        nodes += info.get('nodes', 0)
+        seconds += info.get('time', 0.0)
+    return sum(depths) / len(depths), nodes / seconds if seconds > 0 else 0.0
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description="Compare the depth Stockfish reaches in the same time with the hash kept between the plies of a game or emptied before every ply")
+    parser.add_argument("pgn", help="PGN file of the game to search")
+    parser.add_argument("--time", type=float, default=0.1, help="Seconds per position")
+    parser.add_argument("--hash", type=int, default=chess_review.ENGINE_HASH_MB)
+    parser.add_argument("--threads", type=int, default=chess_review.ENGINE_THREADS)
+    parser.add_argument("--repeat", type=int, default=3)
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = get_args()
+    chess_review.ENGINE_HASH_MB = args.hash
+    chess_review.ENGINE_THREADS = args.threads
+
+    positions = list(game_positions(args.pgn))
+    limit = chess.engine.Limit(time=args.time)
+
+    # a single engine so every search of the warm run sees the hash of the one before
+    pool = chess_review.EnginePool(size=1)
+    try:
+        for _ in range(args.repeat):
+            for warm in [False, True]:
+                depth, nps = search_game(pool, positions, limit, warm)
+                print(f"{'warm' if warm else 'cold'}: {len(positions)} positions, {depth:.2f} average depth, {nps / 1000:.0f} knodes/s")
+    finally:
+        pool.close()
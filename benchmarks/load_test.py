@@ -0,0 +1,72 @@
+import argparse
+import random
+import time
+import urllib.parse
+import urllib.request
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import chess
+import chess.pgn
+
+
+def random_game(rng, plies):
+    # a different game for every request so the review cache never answers
+    game = chess.pgn.Game()
+    node = game
+    board = chess.Board()
+    for _ in range(plies):
+        moves = list(board.legal_moves)
+        if (len(moves) == 0) or board.is_game_over():
+            break
+        move = rng.choice(moves)
+        board.push(move)
+        node = node.add_variation(move)
+    return str(game)
+
+
+def post_review(url, pgn_data, depth):
+    form = urllib.parse.urlencode({
+        'pgn': pgn_data,
+        'limits': 'depth',
+        'time-limit': '0.1',
+        'depth-limit': str(depth),
+    }).encode()
+
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(url, data=form, timeout=600) as response:
+            response.read()
+            status = response.status
+    except urllib.error.HTTPError as error:
+        status = error.code
+    except OSError:
+        status = 'error'
+    return status, time.perf_counter() - start
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description="Send concurrent reviews of different random games to a running server")
+    parser.add_argument("--url", default="http://127.0.0.1:8000/views/analysis")
+    parser.add_argument("--requests", type=int, default=32)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--plies", type=int, default=30)
+    parser.add_argument("--depth", type=int, default=8)
+    parser.add_argument("--seed", type=int, default=0)
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = get_args()
+    rng = random.Random(args.seed)
+    games = [random_game(rng, args.plies) for _ in range(args.requests)]
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        results = list(executor.map(lambda pgn_data: post_review(args.url, pgn_data, args.depth), games))
+    elapsed = time.perf_counter() - start
+
+    latencies = sorted(latency for _, latency in results)
+    print(f'statuses:    {dict(Counter(status for status, _ in results))}')
+    print(f'throughput:  {len(results) / elapsed:.2f} reviews/s')
+    print(f'latency p50: {latencies[len(latencies) // 2]:.2f}s, max: {latencies[-1]:.2f}s')
@@ -0,0 +1,68 @@
+import argparse
+import os
+import sys
+import time
+from collections import Counter
+
+import chess
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import chess_review
+
+from verify_is_trapped import corpus_positions
+
+TIERS = ['finished', 'mate in 1', 'mate in 2', 'engine']
+
+
+def mate_questions(positions):
+    # the positions move_threatens_mate asks about: the side that just moved plays again
+    for board in positions:
+        if board.is_check():
+            continue
+        board.push(chess.Move.null())
+        yield board
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description="Count the mate questions each tier of find_mate answers on a corpus")
+    parser.add_argument("--pgn", help="PGN file to take positions from (random games when omitted)")
+    parser.add_argument("--games", type=int, default=200, help="Number of random games when no PGN is given")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--engine", action="store_true", help="Also run the engine tier (needs Stockfish)")
+    parser.add_argument("--depth", type=int, default=12, help="Engine depth limit for --engine")
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = get_args()
+    chess_review.STOCKFISH_CONFIG = {'depth': args.depth}
+
+    questions = 0
+    answers = Counter()
+    seconds = Counter()
+    mates = Counter()
+
+    for board in mate_questions(corpus_positions(args.pgn, args.games, args.seed)):
+        questions += 1
+
+        start = time.perf_counter()
+        tier, mate = chess_review.find_mate_natively(board)
+        native_seconds = time.perf_counter() - start
+
+        if tier is None:
+            tier = 'engine'
+            if args.engine:
+                start = time.perf_counter()
+                score = chess_review.analyse_position(board, mate=chess_review.MATE_SEARCH_MOVES)['score'].relative
+                seconds['engine'] += time.perf_counter() - start
+                mate = score if score.is_mate() else None
+        answers[tier] += 1
+        seconds['native'] += native_seconds
+        mates[tier] += (mate is not None) and (mate is not False)
+
+    print(f'mate questions:          {questions}')
+    for tier in TIERS:
+        print(f'{tier + ":":<25}{answers[tier]} ({100 * answers[tier] / max(questions, 1):.2f}%), {mates[tier]} mates')
+    print(f'native tiers:            {1000 * seconds["native"] / max(questions, 1):.3f} ms per question')
+    if args.engine:
+        print(f'engine tier:             {1000 * seconds["engine"] / max(answers["engine"], 1):.3f} ms per search')
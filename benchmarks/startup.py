@@ -0,0 +1,51 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# runs in a fresh interpreter so nothing is already imported
+PROBE = '''
+import json, resource, time
+start = time.perf_counter()
+import chess_review
+import_time = time.perf_counter() - start
+import_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+import chess
+board = chess.Board()
+board.push_san("e4")
+start = time.perf_counter()
+chess_review.lookup_opening(board)
+lookup_time = time.perf_counter() - start
+lookup_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+print(json.dumps([import_time, import_rss, lookup_time, lookup_rss]))
+'''
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description="Measure chess_review import time and memory")
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--cwd", default=REPO_DIR, help="Directory holding openings_master.csv / openings_index.bin")
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = get_args()
+
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join([REPO_DIR] + [p for p in [env.get('PYTHONPATH')] if p])
+
+    runs = []
+    for _ in range(args.runs):
+        output = subprocess.run([sys.executable, '-c', PROBE], cwd=args.cwd, env=env, capture_output=True, text=True, check=True).stdout
+        runs.append(json.loads(output))
+
+    import_times, import_rss, lookup_times, lookup_rss = zip(*runs)
+    index = 'prebuilt index' if os.path.exists(os.path.join(args.cwd, 'openings_index.bin')) else 'index built from CSV'
+    print(f'import chess_review: median {1000 * statistics.median(import_times):.0f} ms, max RSS {max(import_rss) / 1024:.1f} MB')
+    print(f'first opening lookup ({index}): median {1000 * statistics.median(lookup_times):.1f} ms, max RSS {max(lookup_rss) / 1024:.1f} MB')
@@ -0,0 +1,75 @@
+import argparse
+import os
+import random
+import sys
+import time
+
+import chess
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import chess_review
+
+
+def random_endgames(table_names, n_positions, seed=0):
+    # random legal positions for the material of the given tables, KQvK style names
+    rng = random.Random(seed)
+    table_names = sorted(table_names)
+
+    while n_positions > 0:
+        white, black = rng.choice(table_names).split('v')
+        board = chess.Board(None)
+        board.turn = rng.choice(chess.COLORS)
+
+        for color, pieces in [(chess.WHITE, white), (chess.BLACK, black)]:
+            for symbol in pieces:
+                piece_type = chess.Piece.from_symbol(symbol).piece_type
+                squares = [s for s in chess.SQUARES if board.piece_at(s) is None]
+                if piece_type == chess.PAWN:
+                    squares = [s for s in squares if chess.square_rank(s) not in [0, 7]]
+                board.set_piece_at(rng.choice(squares), chess.Piece(piece_type, color))
+
+        if board.is_valid() and not board.is_game_over():
+            n_positions -= 1
+            yield board
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description="Check that tablebase best moves keep the tablebase result and time the probes")
+    parser.add_argument("syzygy", help="Directory with Syzygy .rtbw/.rtbz files")
+    parser.add_argument("--positions", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=0)
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = get_args()
+    chess_review.SYZYGY_PATH = args.syzygy
+
+    tablebase = chess_review.get_tablebase()
+    if tablebase is None:
+        sys.exit(f'no tables found in {args.syzygy}')
+
+    checked = 0
+    wrong = []
+    elapsed = 0
+
+    for board in random_endgames(tablebase.wdl, args.positions, args.seed):
+        start = time.perf_counter()
+        info = chess_review.analyse_position(board)
+        elapsed += time.perf_counter() - start
+
+        wdl, _ = chess_review.probe_tablebase(board)
+        board.push(info['pv'][0])
+        result = 2 if board.is_checkmate() else -chess_review.probe_tablebase(board)[0]
+        board.pop()
+
+        checked += 1
+        if result != wdl:
+            wrong.append((board.fen(), info['pv'][0].uci(), wdl, result))
+
+    print(f'tables:                  {len(tablebase.wdl)} (up to {chess_review.get_tablebase_max_pieces(tablebase)} pieces)')
+    print(f'positions:               {checked}')
+    print(f'best move loses result:  {len(wrong)}')
+    print(f'analyse_position:        {1000 * elapsed / max(checked, 1):.3f} ms per position')
+    for fen, move, wdl, result in wrong[:10]:
+        print(f'  {fen} {move}: {wdl} -> {result}')
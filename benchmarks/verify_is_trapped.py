@@ -0,0 +1,213 @@
+import argparse
+import os
+import random
+import sys
+import time
+
+import chess
+import chess.pgn
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import chess_review
+
+
+def corpus_positions(pgn_path=None, n_games=200, seed=0):
+    if pgn_path is not None:
+        with open(pgn_path) as pgn_file:
+            while True:
+                game = chess.pgn.read_game(pgn_file)
+                if game is None:
+                    break
+                board = game.board()
+                for move in game.mainline_moves():
+                    board.push(move)
+                    yield board.copy(stack=False)
+        return
+
+    rng = random.Random(seed)
+    for _ in range(n_games):
+        board = chess.Board()
+        for _ in range(rng.randint(10, 100)):
+            moves = list(board.legal_moves)
+            if len(moves) == 0:
+                break
+            board.push(rng.choice(moves))
+            yield board.copy(stack=False)
+
+
+# the square-by-square check is_trapped replaced, kept here to compare against
+def is_trapped_legacy(board: chess.Board, square, by):
+
+    if str(board.piece_at(square)).lower() == 'k':
+        return False
+
+    attackers = board.attackers(by, square)
+
+    capturable_by_lower = False
+
+    for attacking_square in attackers:
+        if board.piece_at(attacking_square).color != board.piece_at(square).color:
+            if board.piece_type_at(attacking_square) < board.piece_type_at(square):
+                capturable_by_lower = True
+    
+    if not capturable_by_lower:
+        return False
+
+    can_be_saved = True
+
+    movable_squares = board.attacks(square)
+
+    for move_to_square in movable_squares:
+
+        if board.piece_at(move_to_square) is None:
+
+            defending_squares = board.attackers(by, move_to_square)
+            
+            if len(defending_squares) == 0:
+                can_be_saved = True
+                
+                return False
+
+            for defending_square in defending_squares:
+
+                if board.piece_at(defending_square).color != board.piece_at(square).color:
+
+                    if board.piece_type_at(defending_square) < board.piece_type_at(square):
+                        if not board.is_pinned(by, defending_square):
+                            can_be_saved = False   
+                        else:
+                            can_be_saved = True
+        
+                    elif board.piece_type_at(defending_square) == board.piece_type_at(square):
+                        if not board.is_pinned(by, defending_square):
+                            defenders = chess_review.is_defended(board, defending_square, by_color=not by, return_list_of_defenders=True)
+                            if len(defenders) <= 1: # if the trapped piece is the only defender
+                                can_be_saved = False
+
+                    else:
+                        can_be_saved = True 
+
+        elif (board.piece_at(move_to_square).color != board.piece_at(square).color) and (board.piece_type_at(move_to_square) <= board.piece_type_at(square)):
+
+            defending_squares = board.attackers(by, move_to_square)
+            
+            if len(defending_squares) == 0:
+                can_be_saved = True
+                
+                return False
+
+            for defending_square in defending_squares:
+
+                if board.piece_at(defending_square).color != board.piece_at(square).color:
+
+                    if board.piece_type_at(defending_square) < board.piece_type_at(square):
+                        if not board.is_pinned(by, defending_square):
+                            can_be_saved = False   
+                        else:
+                            can_be_saved = True
+        
+                    elif board.piece_type_at(defending_square) == board.piece_type_at(square):
+                        if not board.is_pinned(by, defending_square):
+                            defenders = chess_review.is_defended(board, defending_square, by_color=not by, return_list_of_defenders=True)
+                            if len(defenders) <= 1: # if the trapped piece is the only defender
+                                can_be_saved = False
+
+                    else:
+                        can_be_saved = True 
+
+    if not can_be_saved:
+        return True
+    else:
+        return False
+
+
+# The legacy check decides with whatever it saw last: a later escape square overwrites the verdict
+# of an earlier one, and a later attacker of a square overwrites the verdict of an earlier one.
+# This is the same set of rules with every escape square and every attacker counted, which is
+# what is_trapped computes from the safe-square masks.
+def is_escape_square_safe(board: chess.Board, square, escape_square, by):
+    piece_type = board.piece_type_at(square)
+    for attacking_square in board.attackers(by, escape_square):
+        if board.is_pinned(by, attacking_square):
+            continue
+        attacking_type = board.piece_type_at(attacking_square)
+        if attacking_type < piece_type:
+            return False
+        # the trapped piece is the only defender of an equal attacker
+        if (attacking_type == piece_type) and (len(chess_review.is_defended(board, attacking_square, by_color=not by, return_list_of_defenders=True)) <= 1):
+            return False
+    return True
+
+def is_trapped_reference(board: chess.Board, square, by):
+    piece = board.piece_at(square)
+    if (piece is None) or (piece.piece_type == chess.KING) or (piece.color == by):
+        return False
+    if not chess_review.is_attacked_by_lower_piece(board, square, by):
+        return False
+
+    escape_squares = []
+    for escape_square in board.attacks(square):
+        other = board.piece_at(escape_square)
+        if (other is None) or ((other.color != piece.color) and (other.piece_type <= piece.piece_type)):
+            escape_squares.append(escape_square)
+
+    if (len(escape_squares) == 0) or any(len(board.attackers(by, s)) == 0 for s in escape_squares):
+        return False
+    return not any(is_escape_square_safe(board, square, s, by) for s in escape_squares)
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description="Compare the safe-square is_trapped against the legacy square-by-square version and against the same rules without its overwritten verdicts")
+    parser.add_argument("--pgn", help="PGN file to take positions from (random games when omitted)")
+    parser.add_argument("--games", type=int, default=200, help="Number of random games when no PGN is given")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--show", type=int, default=10, help="Number of disagreements to print")
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = get_args()
+
+    checked = 0
+    trapped = 0
+    disagreements = {True: [], False: []}
+    unexplained = []
+    mask_time = 0
+    legacy_time = 0
+
+    for board in corpus_positions(args.pgn, args.games, args.seed):
+        for by in chess.COLORS:
+            squares = list(chess.scan_forward(board.occupied_co[not by]))
+
+            start = time.perf_counter()
+            safe_masks = None
+            mask_results = []
+            for square in squares:
+                if chess_review.is_attacked_by_lower_piece(board, square, by):
+                    if safe_masks is None:
+                        safe_masks = chess_review.get_safe_square_masks(board, by)
+                    mask_results.append(chess_review.is_trapped(board, square, by, safe_masks))
+                else:
+                    mask_results.append(False)
+            mask_time += time.perf_counter() - start
+
+            start = time.perf_counter()
+            legacy_results = [is_trapped_legacy(board, s, by) for s in squares]
+            legacy_time += time.perf_counter() - start
+
+            for square, mask_result, legacy_result in zip(squares, mask_results, legacy_results):
+                checked += 1
+                trapped += legacy_result
+                if mask_result != is_trapped_reference(board, square, by):
+                    unexplained.append((board.fen(), chess.square_name(square), legacy_result, mask_result))
+                if mask_result != legacy_result:
+                    disagreements[legacy_result].append((board.fen(), chess.square_name(square), legacy_result, mask_result))
+
+    print(f'checked {checked} pieces, {trapped} trapped according to the legacy check')
+    print(f'no longer trapped: {len(disagreements[True])} (an earlier escape square is safe, a later one overwrote it)')
+    print(f'newly trapped: {len(disagreements[False])} (a later attacker of an unsafe escape square overwrote it)')
+    print(f'disagreements with the order-free rules: {len(unexplained)}')
+    print(f'safe masks: {mask_time:.2f}s, legacy: {legacy_time:.2f}s')
+
+    for fen, square, legacy_result, mask_result in (disagreements[True] + disagreements[False] + unexplained)[:args.show]:
+        print(f'{fen} {square}: legacy={legacy_result} masks={mask_result}')
@@ -1,26 +1,100 @@
-import chess.engine  
-from IPython.display import clear_output
+import chess
+import chess.pgn
+import chess.polyglot
 import time
-import pandas as pd
 import re
-import chess.pgn
 from collections import Counter # for calculating captured pieces
+from collections import OrderedDict
 import math
-import numpy as np
 import io
-from tqdm import tqdm
+import os
 import platform
-from functools import lru_cache
+import atexit
+import gzip
+import hashlib
+import json
+import threading
+import contextvars
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from contextlib import contextmanager, nullcontext
+from functools import lru_cache, partial
+from itertools import accumulate
+import monitoring
+import opening_index
+import pipeline
+import tracing
+
+# pandas, tqdm and chess.engine are imported where they are used and numpy through get_numpy() to keep imports fast
 
 stockfish_path = "stockfish"
 if "windows" in platform.system().lower():
     stockfish_path += ".exe"
 
 STOCKFISH_CONFIG = {"time": 0.25}
+ENGINE_POOL_SIZE = 2 # Stockfish processes kept running for the searches
+ENGINE_HASH_MB = int(os.environ.get('GAMEREVIEW_ENGINE_HASH', 64)) # transposition table of every engine, kept between the plies of a game
+ENGINE_THREADS = int(os.environ.get('GAMEREVIEW_ENGINE_THREADS', 1)) # search threads of every engine
+PREFETCH_PLIES = 4 # positions analysed ahead of the ply being reviewed
+BUDGET_ENGINE_SHARE = 0.8 # of the time budget of a review given to the searches, the rest is for python-chess
+MIN_SEARCH_SECONDS = 0.01 # shortest search of a budget review, kept aside for every position still to come
+REVIEWED_GAMES_SIZE = 32 # analysed games kept so that edited versions of them only analyse the plies that changed
+MAX_RUNNING_REVIEWS = 2 # games analysed at once by the whole server, the others wait for engine capacity
+MAX_QUEUED_REVIEWS = 16 # games waiting beyond that are refused, per worker process
+SHARED_POLL_SECONDS = 0.05 # how often a waiting review looks for games that ended in another worker
+REVIEW_CLASSES = { # lower priority goes first, max_running caps the games of the class analysed at once
+    'interactive': {'priority': 0, 'max_running': 2},
+    'batch': {'priority': 1, 'max_running': 1},
+}
+
+TRACE_DIR = os.environ.get('GAMEREVIEW_TRACE_DIR') # a Chrome trace of every review is written there when set
+
+# exported on /metrics, the numbers already kept elsewhere are registered at the end of the module
+REVIEW_SECONDS = monitoring.REGISTRY.histogram('gamereview_review_stage_seconds', 'Seconds one review spends in each stage', ('stage',))
+REVIEW_SEARCHES = monitoring.REGISTRY.histogram('gamereview_review_engine_searches', 'Positions searched to analyse one game', buckets=monitoring.COUNT_BUCKETS)
+SEARCHES = monitoring.REGISTRY.counter('gamereview_searches', 'Positions searched, by what answered', ('source',))
+GAMES_REVIEWED = monitoring.REGISTRY.counter('gamereview_games_reviewed', 'Reviews rendered, by mode', ('mode',))
 
-openings_df = pd.read_csv("openings_master.csv")
+@contextmanager
+def review_stage(name):
+    # timed for /metrics and, when the review is traced, a span of the trace
+    with REVIEW_SECONDS.time(name), tracing.span(name, 'stage'):
+        yield
+
+def review_trace(review_key, roast):
+    if TRACE_DIR is None:
+        return tracing.NO_SPAN
+    mode = 'roast' if roast else 'review'
+    return tracing.tracing(os.path.join(TRACE_DIR, f'{review_key[:16]}-{mode}-{time.time_ns()}.trace.json'))
+
+SYZYGY_PATH = None # directory with Syzygy .rtbw/.rtbz files, endgames within the tables skip the engine
+TABLEBASE_WIN_SCORE = 1000 # centipawns for a tablebase win, less the distance to zeroing the 50-move counter
+
+POLYGLOT_BOOK = None # Polyglot .bin opening book, book moves are reviewed without the engine
+
+OPENINGS_CSV = "openings_master.csv"
+OPENINGS_INDEX = "openings_index.bin" # built with `python opening_index.py`
 # only 2 openings have more than 12 moves
 
+@lru_cache(maxsize=1)
+def get_openings_df():
+    import pandas as pd
+    return pd.read_csv(OPENINGS_CSV)
+
+def __getattr__(name):
+    # openings_df used to be read at import, keep it available as a lazy module attribute
+    if name == 'openings_df':
+        return get_openings_df()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+@lru_cache(maxsize=1)
+def get_numpy():
+    import numpy
+    return numpy
+
+def progress_bar(iterable):
+    from tqdm import tqdm
+    return tqdm(iterable)
+
 def search_opening(dataframe, pgn):
 
     # Check if the search_string is in column 'A'
@@ -32,6 +106,34 @@ def search_opening(dataframe, pgn):
     else:
         return None
 
+@lru_cache(maxsize=1)
+def get_opening_index():
+    # memory-mapped so forked workers share it, falls back to building it in memory from the CSV
+    if os.path.exists(OPENINGS_INDEX):
+        return opening_index.load_opening_index(OPENINGS_INDEX)
+
+    return opening_index.OpeningIndex(opening_index.build_opening_index(opening_index.read_openings_csv(OPENINGS_CSV)))
+
+@lru_cache(maxsize=1)
+def get_opening_book():
+    if (POLYGLOT_BOOK is None) or (not os.path.isfile(POLYGLOT_BOOK)):
+        return None
+    return chess.polyglot.open_reader(POLYGLOT_BOOK)
+
+def get_book_moves(board: chess.Board):
+    # book moves for the position, most played first
+    book = get_opening_book()
+    if book is None:
+        return []
+    entries = sorted(book.find_all(board), key=lambda entry: entry.weight, reverse=True)
+    return [entry.move for entry in entries]
+
+def lookup_opening(board: chess.Board):
+    return get_opening_index().lookup(board)
+
+def is_book_position(board: chess.Board):
+    return get_opening_index().is_book_position(board)
+
 
 def check_for_defended_pieces(board):
     for hanging_square in chess.SQUARES:
@@ -265,9 +367,543 @@ def move_blocks_check(board: chess.Board, move):
     else:
         return False
 
+@lru_cache(maxsize=1)
+def get_tablebase():
+    if (SYZYGY_PATH is None) or (not os.path.isdir(SYZYGY_PATH)):
+        return None
+
+    import chess.syzygy
+    tablebase = chess.syzygy.open_tablebase(SYZYGY_PATH)
+    if len(tablebase.wdl) == 0:
+        tablebase.close()
+        return None
+
+    return tablebase
+
+def get_tablebase_max_pieces(tablebase):
+    return max(len(table_name) - 1 for table_name in tablebase.wdl) # KQvK is 3 pieces
+
+def probe_tablebase(board: chess.Board):
+    # (wdl, dtz) for the side to move, None when there is no table for the position
+    tablebase = get_tablebase()
+    if tablebase is None:
+        return None
+
+    if board.castling_rights or (chess.popcount(board.occupied) > get_tablebase_max_pieces(tablebase)):
+        return None
+
+    try:
+        return tablebase.probe_wdl(board), tablebase.probe_dtz(board)
+    except KeyError: # MissingTableError
+        return None
+
+def get_tablebase_score(wdl, dtz):
+    # cursed wins and blessed losses are draws under the 50-move rule
+    if wdl == 2:
+        return TABLEBASE_WIN_SCORE - min(abs(dtz), 100)
+    elif wdl == -2:
+        return -TABLEBASE_WIN_SCORE + min(abs(dtz), 100)
+    return 0
+
+def analyse_tablebase_position(board: chess.Board):
+    # the same result as an engine search, answered by the tablebase
+    from chess.engine import Cp, Mate, PovScore
+
+    probe = probe_tablebase(board)
+    if probe is None:
+        return None
+
+    if board.is_checkmate():
+        return {'score': PovScore(Mate(0), board.turn), 'pv': []}
+
+    best_move = None
+    best_key = None
+    for move in board.legal_moves:
+        board.push(move)
+        if board.is_checkmate():
+            key = (3, 0)
+        else:
+            reply_probe = probe_tablebase(board)
+            if reply_probe is None:
+                return None
+            wdl, dtz = reply_probe
+            # the opponent's worst result, reached as fast as possible when winning and as slow as possible when losing
+            key = (-wdl, -abs(dtz) if wdl < 0 else abs(dtz))
+        board.pop()
+
+        if (best_key is None) or (key > best_key):
+            best_move, best_key = move, key
+
+    return {'score': PovScore(Cp(get_tablebase_score(*probe)), board.turn), 'pv': [best_move] if best_move is not None else []}
+
+class ReviewCancelled(Exception):
+    pass
+
+class Cancellation:
+    # set by the client going away or asking to stop, reviews check it between plies and
+    # running engine searches are stopped through the callbacks
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.event = threading.Event()
+        self.callbacks = []
+        self.reason = None
+
+    def cancel(self, reason='cancelled'):
+        with self.lock:
+            if self.event.is_set():
+                return
+            self.reason = reason
+            self.event.set()
+            callbacks, self.callbacks = self.callbacks, []
+        for callback in callbacks:
+            callback()
+
+    def is_cancelled(self):
+        return self.event.is_set()
+
+    def check(self):
+        if self.event.is_set():
+            raise ReviewCancelled(self.reason)
+
+    def on_cancel(self, callback):
+        # callback runs at once when already cancelled, returns a function that unregisters it
+        with self.lock:
+            if not self.event.is_set():
+                self.callbacks.append(callback)
+                return partial(self.remove_callback, callback)
+        callback()
+        return lambda: None
+
+    def remove_callback(self, callback):
+        with self.lock:
+            if callback in self.callbacks:
+                self.callbacks.remove(callback)
+
+ACTIVE_CANCELLATION = contextvars.ContextVar('ACTIVE_CANCELLATION', default=None)
+CANCELLATION_STATS = Counter() # 'reviews', 'searches stopped', 'searches skipped' and 'engine seconds saved' by cancellations
+
+def check_cancelled():
+    cancellation = ACTIVE_CANCELLATION.get()
+    if cancellation is not None:
+        cancellation.check()
+
+class EnginePool:
+    # Stockfish processes kept alive between searches, each one used by a single thread at a time.
+    # A search goes to an idle engine that last searched the same game when there is one, its hash
+    # table still holds the plies before, engines only get ucinewgame when they change games.
+
+    def __init__(self, size=ENGINE_POOL_SIZE):
+        self.size = size
+        self.started = 0
+        self.idle = [] # most recently released last
+        self.games = dict() # id of an engine -> the game it last searched
+        self.condition = threading.Condition()
+        self.lock = threading.Lock()
+        self.searches = 0
+        self.search_seconds = 0.0
+        self.stats = Counter() # 'same game' and 'other game' searches
+
+    def start_engine(self):
+        import chess.engine
+
+        engine = chess.engine.SimpleEngine.popen_uci(stockfish_path)
+        # the same for every review: they size the memory and cores of the server, and setting Hash
+        # again empties the table that the engine keeps from ply to ply
+        options = {'Hash': ENGINE_HASH_MB, 'Threads': ENGINE_THREADS}
+        engine.configure({name: value for name, value in options.items() if name in engine.options})
+        return engine
+
+    def acquire(self, game=None):
+        with self.condition:
+            while (len(self.idle) == 0) and (self.started >= self.size):
+                self.condition.wait()
+
+            if len(self.idle) == 0:
+                self.started += 1
+            else:
+                same_game = [engine for engine in self.idle if (game is not None) and (self.games.get(id(engine)) is game)]
+                engine = same_game[-1] if len(same_game) > 0 else self.idle[-1]
+                self.idle.remove(engine)
+                return engine
+
+        try:
+            return self.start_engine()
+        except Exception:
+            with self.condition:
+                self.started -= 1
+                self.condition.notify()
+            raise
+
+    def release(self, engine):
+        with self.condition:
+            self.idle.append(engine)
+            self.condition.notify()
+
+    def discard(self, engine):
+        with self.condition:
+            self.started -= 1
+            self.games.pop(id(engine), None)
+            self.condition.notify()
+        try:
+            engine.close()
+        except Exception:
+            pass
+
+    def get_average_search_seconds(self):
+        with self.lock:
+            return self.search_seconds / self.searches if self.searches > 0 else 0.0
+
+    def analyse(self, board, limit, cancellation=None, game=None):
+        engine = self.acquire(game)
+        with self.condition:
+            same_game = (game is not None) and (self.games.get(id(engine)) is game)
+            self.games[id(engine)] = game
+            self.stats['same game' if same_game else 'other game'] += 1
+
+        start = time.perf_counter()
+        stopped = False
+        try:
+            # python-chess sends ucinewgame when the game differs from the last search of the engine
+            with engine.analysis(board, limit, game=game) as analysis:
+                remove_callback = cancellation.on_cancel(analysis.stop) if cancellation is not None else None
+                try:
+                    analysis.wait()
+                    info = analysis.info
+                finally:
+                    if remove_callback is not None:
+                        remove_callback()
+                stopped = (cancellation is not None) and cancellation.is_cancelled()
+        except Exception:
+            # a crashed or confused engine is replaced on the next search
+            self.discard(engine)
+            raise
+        self.release(engine)
+        seconds = time.perf_counter() - start
+
+        if stopped:
+            # the search was cut short, what is left of it is the engine time saved
+            CANCELLATION_STATS['searches stopped'] += 1
+            CANCELLATION_STATS['engine seconds saved'] += max(0.0, self.get_average_search_seconds() - seconds)
+            raise ReviewCancelled(cancellation.reason)
+
+        with self.lock:
+            self.searches += 1
+            self.search_seconds += seconds
+        return info
+
+    def close(self):
+        with self.condition:
+            engines, self.idle = self.idle, []
+        for engine in engines:
+            self.discard(engine)
+
+@lru_cache(maxsize=1)
+def get_engine_pool():
+    pool = EnginePool(ENGINE_POOL_SIZE)
+    atexit.register(pool.close)
+    return pool
+
+def warm_up():
+    # starts the engines and loads the opening index before the first review comes in
+    get_opening_index()
+
+    pool = get_engine_pool()
+    engines = []
+    try:
+        for _ in range(pool.size):
+            engines.append(pool.acquire())
+    finally:
+        for engine in engines:
+            pool.release(engine)
+
+def run_search(board, mate, limit, game=None):
+    # tablebases give no distance to mate, so mate questions stay with the engine,
+    # game is any object standing for the game of the position, engines keep their hash within it
+    if (mate is None) and (get_tablebase() is not None):
+        info = analyse_tablebase_position(board.copy(stack=False))
+        if info is not None:
+            SEARCHES.inc('tablebase')
+            return info
+
+    import chess.engine
+
+    SEARCHES.inc('engine')
+    return get_engine_pool().analyse(board, chess.engine.Limit(mate=mate, **limit), ACTIVE_CANCELLATION.get(), game)
+
+class EngineCassette:
+    # every search made while recording, saved to a gzipped JSON file and served back when replaying
+    # so the python side can be timed and compared without Stockfish, one line per search:
+    #   "<fen>|<mate>|<limit>": "cp 34 e2e4 e7e5" or "mate -3 g1h1 d8h4"
+
+    def __init__(self, path, mode='replay'):
+        if mode not in ['record', 'replay']:
+            raise ValueError(f'cassette mode must be record or replay, not {mode!r}')
+
+        self.path = path
+        self.mode = mode
+        self.searches = dict()
+        self.lock = threading.Lock()
+
+        if mode == 'replay':
+            with gzip.open(path, 'rt', encoding='utf-8') as cassette_file:
+                self.searches = json.load(cassette_file)
+
+    def key(self, board, mate, limit):
+        return f"{board.fen()}|{mate}|{','.join(f'{name}={value}' for name, value in sorted(limit.items()))}"
+
+    def record(self, board, mate, limit, info):
+        score = info['score'].relative
+        if score.is_mate():
+            recorded = ['mate', str(score.mate())]
+        else:
+            recorded = ['cp', str(score.score())]
+        recorded += [move.uci() for move in info.get('pv', [])]
+
+        with self.lock:
+            self.searches[self.key(board, mate, limit)] = ' '.join(recorded)
+
+    def play(self, board, mate, limit):
+        from chess.engine import Cp, Mate, PovScore
+
+        key = self.key(board, mate, limit)
+        if key not in self.searches:
+            raise LookupError(f'search not recorded in {self.path}: {key}')
+
+        kind, value, *pv = self.searches[key].split(' ')
+        score = Mate(int(value)) if kind == 'mate' else Cp(int(value))
+        return {'score': PovScore(score, board.turn), 'pv': [chess.Move.from_uci(move) for move in pv]}
+
+    def save(self):
+        with self.lock:
+            with gzip.open(self.path, 'wt', encoding='utf-8') as cassette_file:
+                json.dump(self.searches, cassette_file, indent=0, sort_keys=True)
+
+ACTIVE_CASSETTE = contextvars.ContextVar('ACTIVE_CASSETTE', default=None)
+
+@contextmanager
+def engine_cassette(path, mode='replay'):
+    # with engine_cassette('game.json.gz', 'record'): pgn_game_review(...)
+    cassette = EngineCassette(path, mode)
+    token = ACTIVE_CASSETTE.set(cassette)
+    try:
+        yield cassette
+    finally:
+        ACTIVE_CASSETTE.reset(token)
+        if mode == 'record':
+            cassette.save()
+
+def search_position(board, mate=None, limit=None, game=None, review_limit=None):
+    # review_limit is the limit the review asked for when the search limit was worked out from it,
+    # the cassette files the search under it so that a replay finds it whatever time it was given
+    check_cancelled()
+
+    if limit is None:
+        limit = STOCKFISH_CONFIG
+    if review_limit is None:
+        review_limit = limit
+
+    cassette = ACTIVE_CASSETTE.get()
+    if (cassette is not None) and (cassette.mode == 'replay'):
+        SEARCHES.inc('cassette')
+        with tracing.span('search', 'engine', fen=board.fen, mate=mate, limit=limit, source='cassette'):
+            return cassette.play(board, mate, review_limit)
+
+    with tracing.span('search', 'engine', fen=board.fen, mate=mate, limit=limit):
+        info = run_search(board, mate, limit, game)
+
+    if cassette is not None:
+        cassette.record(board, mate, review_limit, info)
+
+    return info
+
+def get_sharpness(board: chess.Board):
+    # how much a longer search is worth in a position, from python-chess alone: checks, captures
+    # and hanging pieces make it sharp, a single legal move or a finished game need little
+    if board.legal_moves.count() <= 1:
+        return 0.25
+
+    _, captures = count_moves_and_captures(board)
+    hanging = sum(1 for square in chess.scan_forward(board.occupied_co[board.turn] & ~board.kings) if is_hanging(board, square))
+
+    return 1 + board.is_check() + 0.25 * min(captures, 4) + 0.5 * min(hanging, 2)
+
+class SearchBudget:
+    # shares the engine time of a review out between its searches, a search gets the part of the
+    # time left until the deadline that its position weighs among the positions of the rest of the
+    # game, so running late shortens the searches that follow and the review keeps to the deadline
+
+    def __init__(self, uci_moves, deadline, workers=ENGINE_POOL_SIZE, first_ply=0):
+        self.deadline = deadline
+        self.workers = workers
+        self.searches_per_ply = get_searches_per_ply()
+        self.lock = threading.Lock()
+
+        # book moves and the plies before first_ply are not searched,
+        # positions reached outside the game weigh as much as a quiet one
+        self.plies = dict()
+        self.weights = dict()
+        board = chess.Board()
+        weights = []
+        for move in uci_moves + [None]:
+            self.plies.setdefault(board.fen(), len(weights))
+            if (len(weights) >= first_ply) and ((move is None) or (move not in get_book_moves(board))):
+                self.weights[board.fen()] = get_sharpness(board)
+            weights.append(self.weights.get(board.fen(), 0.0))
+            if move is not None:
+                board.push(move)
+
+        # weight and number of the searched positions from every ply to the end
+        self.weight_left = list(accumulate(reversed(weights)))[::-1]
+        self.positions_left = list(accumulate(weight > 0 for weight in reversed(weights)))[::-1]
+        self.ply = 0
+
+    def get_limit(self, board):
+        key = board.fen()
+        weight = self.weights.get(key, 1.0)
+        with self.lock:
+            self.ply = max(self.ply, self.plies.get(key, self.ply))
+            planned = self.weight_left[self.ply] * self.searches_per_ply
+            # the shortest search of every position still to come is kept aside, so that even the
+            # last searches end by the deadline
+            reserved = MIN_SEARCH_SECONDS * self.positions_left[self.ply] * self.searches_per_ply / self.workers
+            left = max(0.0, self.deadline - time.monotonic() - reserved)
+        seconds = left * self.workers * weight / max(planned, weight)
+        # a single search can't use the time of the other engines
+        return {'time': max(MIN_SEARCH_SECONDS, min(seconds, left))}
+
+class Prefetcher:
+    # analyses the upcoming positions of a game on idle engines while the current ply is reviewed,
+    # every search made during the review is kept so a position is only searched once
+
+    def __init__(self, uci_moves, lookahead=PREFETCH_PLIES, workers=ENGINE_POOL_SIZE, limit=None, budget=None, searches=None):
+        self.moves = list(uci_moves)
+        self.positions = [chess.Board()]
+        for move in uci_moves:
+            position = self.positions[-1].copy(stack=False)
+            position.push(move)
+            self.positions.append(position)
+
+        self.lookahead = lookahead
+        self.limit = dict(limit if limit is not None else STOCKFISH_CONFIG)
+        self.budget = budget
+        self.game = object() # the engines keep their hash between the searches of the game
+        self.futures = dict()
+        self.searches = 0
+
+        # searches made for an earlier review of the game
+        for key, info in (searches or dict()).items():
+            self.futures[key] = Future()
+            self.futures[key].set_result(info)
+        self.submitted_until = 0
+        self.closed = False
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='prefetch')
+        # searches started from the callbacks of other searches still belong to the review
+        self.context = contextvars.copy_context()
+
+    def submit(self, board, mate=None):
+        key = (board.fen(), mate)
+        with self.lock:
+            if self.closed or (key in self.futures):
+                return None
+            future = self.executor.submit(self.context.copy().run, self.search, board, mate)
+            self.futures[key] = future
+        return future
+
+    def search(self, board, mate=None):
+        check_cancelled()
+        with self.lock:
+            self.searches += 1
+        if self.budget is not None:
+            return search_position(board, mate, self.budget.get_limit(board), self.game, self.limit)
+        return search_position(board, mate, self.limit, self.game)
+
+    def submit_best_child(self, board, future):
+        # the position after the best move is searched by the CPL and by the review of the best move
+        if future.cancelled() or (future.exception() is not None):
+            return
+        pv = future.result().get('pv')
+        if pv:
+            child = board.copy(stack=False)
+            child.push(pv[0])
+            self.submit(child)
+
+    def advance(self, ply):
+        # the same searches as search_move_positions: for every move out of the book the position
+        # before it, the one after it and the one after the best move, book moves need none
+        end = min(ply + self.lookahead + 1, len(self.moves))
+        for i in range(max(ply, self.submitted_until), end):
+            if self.moves[i] in get_book_moves(self.positions[i]):
+                continue
+            future = self.submit(self.positions[i])
+            if future is not None:
+                future.add_done_callback(partial(self.submit_best_child, self.positions[i]))
+            self.submit(self.positions[i + 1])
+        self.submitted_until = max(self.submitted_until, end)
+
+    def analyse(self, board, mate=None):
+        # a position asked for by several threads at once is only searched by the first one
+        key = (board.fen(), mate)
+        with self.lock:
+            future = self.futures.get(key)
+            search_here = (future is None) or future.cancelled()
+            if search_here:
+                future = Future()
+                self.futures[key] = future
+            PREFETCH_STATS['miss' if search_here else 'hit'] += 1
+
+        if search_here:
+            try:
+                future.set_result(self.search(board, mate))
+            except BaseException as error:
+                future.set_exception(error)
+
+        return future.result()
+
+    def has_search(self, board, mate=None):
+        # made or running, asking for it will not start another search
+        with self.lock:
+            future = self.futures.get((board.fen(), mate))
+            return (future is not None) and not future.cancelled()
+
+    def get_searches(self):
+        # every finished search, keyed like searches
+        with self.lock:
+            futures = list(self.futures.items())
+        return {key: future.result() for key, future in futures if future.done() and not future.cancelled() and (future.exception() is None)}
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+ACTIVE_PREFETCHER = contextvars.ContextVar('ACTIVE_PREFETCHER', default=None)
+PREFETCH_STATS = Counter() # searches the review asked for that were already made or running ('hit') or not ('miss')
+
+@contextmanager
+def prefetching(uci_moves, limit=None, budget=None, searches=None):
+    prefetcher = Prefetcher(uci_moves, limit=limit, budget=budget, searches=searches)
+    token = ACTIVE_PREFETCHER.set(prefetcher)
+    try:
+        yield prefetcher
+    finally:
+        ACTIVE_PREFETCHER.reset(token)
+        prefetcher.close()
+
+def prefetch_from(ply):
+    prefetcher = ACTIVE_PREFETCHER.get()
+    if prefetcher is not None:
+        prefetcher.advance(ply)
+
+def analyse_position(board, mate=None):
+    prefetcher = ACTIVE_PREFETCHER.get()
+    if prefetcher is not None:
+        return prefetcher.analyse(board, mate)
+    return search_position(board, mate)
+
 def evaluate(board, return_mate_n=False):
-    with chess.engine.SimpleEngine.popen_uci(stockfish_path) as engine:
-        info = engine.analyse(board, chess.engine.Limit(**STOCKFISH_CONFIG))
+    info = analyse_position(board)
 
     possible_mate_score = str(info['score'].relative)
     if '#' in possible_mate_score:
@@ -309,8 +945,7 @@ def evaluate(board, return_mate_n=False):
         return score
 
 def evaluate_relative(board):
-    with chess.engine.SimpleEngine.popen_uci(stockfish_path) as engine:
-        info = engine.analyse(board, chess.engine.Limit(**STOCKFISH_CONFIG))
+    info = analyse_position(board)
 
     possible_mate_score = str(info['score'].relative)
     if '#' in possible_mate_score:
@@ -324,38 +959,98 @@ def evaluate_relative(board):
     return score
 
 
-def has_mate_in_n(board):
-    with chess.engine.SimpleEngine.popen_uci(stockfish_path) as engine:
-        info = engine.analyse(board, chess.engine.Limit(**STOCKFISH_CONFIG))
+# Mate questions are answered by the cheapest tier that can settle them:
+#   native   python-chess alone: a finished game, mate in 1 or mate in 2 by checks
+#   cached   a search of the position the review already made or started, no new search
+#   engine   a search that stops as soon as it proves a mate in MATE_SEARCH_MOVES, otherwise it runs
+#            to the review's limit like any other search so longer mates are still found
+MATE_SEARCH_MOVES = 5
+MATE_SEARCHES = Counter() # mate questions by the tier that answered them
 
-        if '#' in str(info['score'].relative):
-            return True
-        else:
-            return False
+def find_mate_in_one(board: chess.Board):
+    for move in board.legal_moves:
+        if board.gives_check(move):
+            board.push(move)
+            is_mate = board.is_checkmate()
+            board.pop()
+            if is_mate:
+                return move
+    return None
+
+def find_mate_in_two_by_checks(board: chess.Board):
+    for move in board.legal_moves:
+        if not board.gives_check(move):
+            continue
+
+        board.push(move)
+        replies = list(board.legal_moves)
+        mates = True
+        for reply in replies:
+            board.push(reply)
+            mates = find_mate_in_one(board) is not None
+            board.pop()
+            if not mates:
+                break
+        board.pop()
+
+        if mates and (len(replies) > 0):
+            return move
+    return None
+
+def find_mate_natively(board: chess.Board):
+    # returns the tier that settled the question and the mate score relative to the side to move,
+    # None when nobody can be mated, or None and False when python-chess alone cannot tell
+    from chess.engine import Mate
+
+    board = board.copy(stack=False)
+
+    if board.is_checkmate():
+        return 'finished', Mate(0)
+    if board.is_stalemate() or board.is_insufficient_material():
+        return 'finished', None
+    if find_mate_in_one(board) is not None:
+        return 'mate in 1', Mate(1)
+    if find_mate_in_two_by_checks(board) is not None:
+        return 'mate in 2', Mate(2)
+
+    return None, False
+
+def find_mate(board: chess.Board):
+    # returns the mate score relative to the side to move or None
+    tier, mate = find_mate_natively(board)
+
+    if tier is None:
+        # the general search answers as well as the mate search when the review already has it
+        prefetcher = ACTIVE_PREFETCHER.get()
+        mate_moves = None if (prefetcher is not None) and prefetcher.has_search(board) else MATE_SEARCH_MOVES
+        cached = (mate_moves is None) or ((prefetcher is not None) and prefetcher.has_search(board, mate_moves))
+        tier = 'cached' if cached else 'engine'
+
+        score = analyse_position(board, mate=mate_moves)['score'].relative
+        mate = score if score.is_mate() else None
+
+    MATE_SEARCHES[tier] += 1
+    return mate
+
+def has_mate_in_n(board):
+    return find_mate(board) is not None
 
 def move_allows_mate(board: chess.Board, move, return_winning_player=False):
     #move = board.parse_san(move)
     position_after_move = board.copy()
     position_after_move.push(move)
 
-    with chess.engine.SimpleEngine.popen_uci(stockfish_path) as engine:
-        info = engine.analyse(position_after_move, chess.engine.Limit(**STOCKFISH_CONFIG))
-
-    score = str(info['score'].relative)
+    mate = find_mate(position_after_move)
 
     if return_winning_player:
-        if '#' not in score:
+        if mate is None:
             return None
+        elif mate.mate() > 0:
+            return not board.turn
         else:
-            if '+' in score:
-                return not board.turn
-            elif '-' in score:
-                return board.turn
+            return board.turn
 
-    if '#' not in score:
-        return False
-    else:
-        return True
+    return mate is not None
 
 def calculate_points_gained_by_move(board: chess.Board, move, **kwargs):
     previous_score = evaluate(board)
@@ -364,12 +1059,12 @@ def calculate_points_gained_by_move(board: chess.Board, move, **kwargs):
     position_after_move.push(move)
 
     current_score, n = evaluate(position_after_move, return_mate_n=True)
-    
-    #points_gained = calculate_points_gained(position_after_move, previous_score)
 
-    #print(previous_score, current_score)
+    return get_points_gained(board.turn, previous_score, current_score, n)
 
-    if board.turn == True:
+def get_points_gained(turn, previous_score, current_score, n):
+
+    if turn == True:
 
         if (previous_score != 10000) and (current_score == 10000):
             return f'mates {n}'
@@ -405,6 +1100,10 @@ def classify_move(board: chess.Board, move):
 
     points_gained = calculate_points_gained_by_move(board, move)
 
+    return classify_points_gained(points_gained)
+
+def classify_points_gained(points_gained):
+
     if type(points_gained) == str:
         # quite redundant put im putting it for clarity
         if 'mates' in points_gained: 
@@ -497,8 +1196,7 @@ def check_for_threats(board: chess.Board, moves_ahead=2, take_turns=False, by_op
     opponent_color = not board.turn
     
     if take_turns:
-        with chess.engine.SimpleEngine.popen_uci(stockfish_path) as engine:
-            info = engine.analyse(board, chess.engine.Limit(**STOCKFISH_CONFIG))
+        info = analyse_position(board)
 
         threat_moves = info['pv'][:moves_ahead]
 
@@ -511,8 +1209,7 @@ def check_for_threats(board: chess.Board, moves_ahead=2, take_turns=False, by_op
                 experiment_board.turn = opponent_color
             else:
                 experiment_board.turn = not opponent_color
-            with chess.engine.SimpleEngine.popen_uci(stockfish_path) as engine:
-                info = engine.analyse(experiment_board, chess.engine.Limit(**STOCKFISH_CONFIG))
+            info = analyse_position(experiment_board)
             
             best_move = info['pv'][0]
             threat_moves.append(best_move)
@@ -596,101 +1293,98 @@ def move_is_discovered_check_and_attacks(board: chess.Board, move, return_attack
     else:
         return False
 
-def is_trapped(board: chess.Board, square, by):
+def get_safe_square_masks(board: chess.Board, by):
+    # attacked: every square `by` attacks
+    # safe[piece_type]: squares where a piece of that type is not lost to a lower value (or an
+    # equal value, barely defended) unpinned piece of `by`
+    pinned = 0
+    king_square = board.king(by)
+    if king_square is not None:
+        lines_to_king = chess.BB_RANK_ATTACKS[king_square][0] | chess.BB_FILE_ATTACKS[king_square][0] | chess.BB_DIAG_ATTACKS[king_square][0]
+        for square in chess.scan_forward(board.occupied_co[by] & lines_to_king):
+            if board.is_pinned(by, square):
+                pinned |= chess.BB_SQUARES[square]
+
+    if by == chess.WHITE:
+        pawn_attacks = lambda pawns: chess.shift_up_left(pawns) | chess.shift_up_right(pawns)
+    else:
+        pawn_attacks = lambda pawns: chess.shift_down_left(pawns) | chess.shift_down_right(pawns)
 
-    if str(board.piece_at(square)).lower() == 'k':
-        return False
+    pawns = board.pawns & board.occupied_co[by]
+    attacked = pawn_attacks(pawns)
+    attacks_by_type = [0] * 7
+    equal_threats = [0] * 7
+    attacks_by_type[chess.PAWN] = pawn_attacks(pawns & ~pinned)
 
-    attackers = board.attackers(by, square)
+    for attacking_square in chess.scan_forward(board.occupied_co[by] & ~board.pawns):
+        attacks = board.attacks_mask(attacking_square)
+        attacked |= attacks
 
-    capturable_by_lower = False
+        if pinned & chess.BB_SQUARES[attacking_square]:
+            continue
 
-    for attacking_square in attackers:
-        if board.piece_at(attacking_square).color != board.piece_at(square).color:
-            if board.piece_type_at(attacking_square) < board.piece_type_at(square):
-                capturable_by_lower = True
-    
-    if not capturable_by_lower:
-        return False
+        piece_type = board.piece_type_at(attacking_square)
+        attacks_by_type[piece_type] |= attacks
+        if (piece_type != chess.KING) and (chess.popcount(board.attackers_mask(not by, attacking_square)) <= 1):
+            equal_threats[piece_type] |= attacks
 
-    can_be_saved = True
+    safe = [chess.BB_ALL] * 7
+    lower_attacks = 0
+    for piece_type in chess.PIECE_TYPES:
+        safe[piece_type] = ~(lower_attacks | equal_threats[piece_type]) & chess.BB_ALL
+        lower_attacks |= attacks_by_type[piece_type]
 
-    movable_squares = board.attacks(square)
+    return attacked, safe
 
-    for move_to_square in movable_squares:
+def is_attacked_by_lower_piece(board: chess.Board, square, by):
+    piece_type = board.piece_type_at(square)
 
-        if board.piece_at(move_to_square) is None:
+    lower_pieces = 0
+    for lower_type in range(chess.PAWN, piece_type):
+        lower_pieces |= board.pieces_mask(lower_type, by)
 
-            defending_squares = board.attackers(by, move_to_square)
-            
-            if len(defending_squares) == 0:
-                can_be_saved = True
-                
-                return False
-
-            for defending_square in defending_squares:
-
-                if board.piece_at(defending_square).color != board.piece_at(square).color:
-
-                    if board.piece_type_at(defending_square) < board.piece_type_at(square):
-                        if not board.is_pinned(by, defending_square):
-                            can_be_saved = False   
-                        else:
-                            can_be_saved = True
-        
-                    elif board.piece_type_at(defending_square) == board.piece_type_at(square):
-                        if not board.is_pinned(by, defending_square):
-                            defenders = is_defended(board, defending_square, by_color=not by, return_list_of_defenders=True)
-                            if len(defenders) <= 1: # if the trapped piece is the only defender
-                                can_be_saved = False
+    return (board.attackers_mask(by, square) & lower_pieces) != 0
 
-                    else:
-                        can_be_saved = True 
+def is_trapped(board: chess.Board, square, by, safe_masks=None):
 
-        elif (board.piece_at(move_to_square).color != board.piece_at(square).color) and (board.piece_type_at(move_to_square) <= board.piece_type_at(square)):
+    piece = board.piece_at(square)
 
-            defending_squares = board.attackers(by, move_to_square)
-            
-            if len(defending_squares) == 0:
-                can_be_saved = True
-                
-                return False
+    if (piece is None) or (piece.piece_type == chess.KING) or (piece.color == by):
+        return False
 
-            for defending_square in defending_squares:
+    if not is_attacked_by_lower_piece(board, square, by):
+        return False
 
-                if board.piece_at(defending_square).color != board.piece_at(square).color:
+    if safe_masks is None:
+        safe_masks = get_safe_square_masks(board, by)
+    attacked, safe = safe_masks
 
-                    if board.piece_type_at(defending_square) < board.piece_type_at(square):
-                        if not board.is_pinned(by, defending_square):
-                            can_be_saved = False   
-                        else:
-                            can_be_saved = True
-        
-                    elif board.piece_type_at(defending_square) == board.piece_type_at(square):
-                        if not board.is_pinned(by, defending_square):
-                            defenders = is_defended(board, defending_square, by_color=not by, return_list_of_defenders=True)
-                            if len(defenders) <= 1: # if the trapped piece is the only defender
-                                can_be_saved = False
+    higher_pieces = 0
+    for piece_type in range(piece.piece_type + 1, chess.KING + 1):
+        higher_pieces |= board.pieces_mask(piece_type, by)
 
-                    else:
-                        can_be_saved = True 
+    escape_squares = board.attacks_mask(square) & ~board.occupied_co[piece.color] & ~higher_pieces
 
-    if not can_be_saved:
-        return True
-    else:
+    if (escape_squares == 0) or (escape_squares & ~attacked):
         return False
 
+    return not (escape_squares & safe[piece.piece_type])
+
 def move_traps_opponents_piece(board: chess.Board, move, return_trapped_squares=False):
-    position_after_move = board.copy()
+    position_after_move = board.copy(stack=False)
     position_after_move.push(move)
 
     trapped_squares = []
+    safe_masks = None
 
     for attacked_square in position_after_move.attacks(move.to_square):
         if position_after_move.piece_at(attacked_square) is not None:
             if position_after_move.piece_at(attacked_square).color != position_after_move.piece_at(move.to_square):
-                if is_trapped(position_after_move, attacked_square, by=board.turn):
-                    trapped_squares.append(attacked_square)
+                if is_attacked_by_lower_piece(position_after_move, attacked_square, by=board.turn):
+                    if safe_masks is None: # shared by every piece the move attacks
+                        safe_masks = get_safe_square_masks(position_after_move, board.turn)
+                    if is_trapped(position_after_move, attacked_square, by=board.turn, safe_masks=safe_masks):
+                        trapped_squares.append(attacked_square)
 
     if return_trapped_squares:
         return trapped_squares
@@ -841,6 +1535,7 @@ def moves_rook_to_open_file(board: chess.Board, move):
     return False
 
 def is_an_opening(game: str, return_name_and_desc=True):
+    openings_df = get_openings_df()
     opening = openings_df[openings_df['Moves'] == game]
     
     if return_name_and_desc:
@@ -855,13 +1550,10 @@ def is_an_opening(game: str, return_name_and_desc=True):
             return True
 
 
+ENDGAME_PIECE_TYPES = [chess.KNIGHT, chess.BISHOP, chess.ROOK, chess.QUEEN]
+
 def is_endgame(board: chess.Board):
-    major_pieces = 0
-    fen = board.fen()
-    for p in fen.split(' ')[0]:
-        if p.lower() in ['r', 'b', 'n', 'q']:
-            
-            major_pieces += 1
+    major_pieces = chess.popcount(board.knights | board.bishops | board.rooks | board.queens)
 
     if major_pieces < 6:
         return True
@@ -1001,15 +1693,9 @@ def move_threatens_mate(board: chess.Board, move):
 
     experiment_board.push(chess.Move.null())
 
-    with chess.engine.SimpleEngine.popen_uci(stockfish_path) as engine:
-        info = engine.analyse(experiment_board, chess.engine.Limit(**STOCKFISH_CONFIG))
-
-    score = str(info['score'].relative)
+    mate = find_mate(experiment_board)
 
-    if ('#' in score) and ('+' in score):
-        return True
-    else:
-        return False
+    return (mate is not None) and (mate.mate() > 0)
 
 def is_capturable_by_lower_piece(board: chess.Board, square, capturable_by):
 
@@ -1038,16 +1724,23 @@ def check_for_capturable_pieces_by_lower(board: chess.Board):
 
     return capturable_squares
 
+def get_forced_move(board: chess.Board):
+    # the only legal move, None when there is a choice
+    forced_move = None
+    for move in board.legal_moves:
+        if forced_move is not None:
+            return None
+        forced_move = move
+    return forced_move
+
 def get_best_move(board: chess.Board):
-    with chess.engine.SimpleEngine.popen_uci(stockfish_path) as engine:
-        info = engine.analyse(board, chess.engine.Limit(**STOCKFISH_CONFIG))
+    info = analyse_position(board)
 
     best_move = info['pv'][0]
     return best_move
 
 def get_best_sequence(board: chess.Board):
-    with chess.engine.SimpleEngine.popen_uci(stockfish_path) as engine:
-        info = engine.analyse(board, chess.engine.Limit(**STOCKFISH_CONFIG))
+    info = analyse_position(board)
 
     best_move = info['pv']
     return best_move
@@ -1071,8 +1764,7 @@ def get_lost_pieces(board: chess.Board):
     lost_black_pieces = list((counter_default_black - counter_black).elements())
 
 def mate_in_n_for(board):
-    with chess.engine.SimpleEngine.popen_uci(stockfish_path) as engine:
-        info = engine.analyse(board, chess.engine.Limit(**STOCKFISH_CONFIG))
+    info = analyse_position(board)
     score = str(info['score'].relative)
 
     print(score)
@@ -1088,17 +1780,33 @@ def mate_in_n_for(board):
         losing_side = 'Black' if (board.turn == True) else 'White'
         return f'{losing_side} gets checkmated in {n}. '
 
-def compute_cpl(moves: list):
-    cpls_white = []
-    cpls_black = []
-    scores = []
+def compute_cpl(moves: list, prefix=None):
+    # prefix is (scores, cpls_white, cpls_black) of the first plies when they are already known
+    scores, cpls_white, cpls_black = [list(values) for values in prefix] if prefix is not None else ([], [], [])
 
     board = chess.Board()
+    for move in moves[:len(scores)]:
+        board.push(move)
+
+    for e, move in enumerate(progress_bar(moves[len(scores):]), start=len(scores)):
+
+        check_cancelled()
+        prefetch_from(e)
 
-    for e, move in (enumerate(tqdm(moves))):
+        if move in get_book_moves(board):
+            # book moves lose nothing, the evaluation stays where it was
+            scores.append(scores[-1] if len(scores) > 0 else 0)
+            if e%2 == 0:
+                cpls_white.append(0)
+            else:
+                cpls_black.append(0)
+            board.push(move)
+            continue
 
         comp_board = board.copy()
-        best_move = get_best_move(comp_board)
+        best_move = get_forced_move(comp_board)
+        if best_move is None:
+            best_move = get_best_move(comp_board)
         comp_board.push(best_move)
         score_best = evaluate(comp_board)
         if score_best == 10000:
@@ -1107,11 +1815,14 @@ def compute_cpl(moves: list):
             score_best = -1000
 
         board.push(move)
-        score_player = evaluate(board)
-        if score_player == 10000:
-            score_player = 1000
-        elif score_player == -10000:
-            score_player = -1000
+        if move == best_move: # forced moves always end up here
+            score_player = score_best
+        else:
+            score_player = evaluate(board)
+            if score_player == 10000:
+                score_player = 1000
+            elif score_player == -10000:
+                score_player = -1000
 
 
         scores.append(score_player)
@@ -1127,57 +1838,124 @@ def compute_cpl(moves: list):
     return scores, cpls_white, cpls_black, average_cpl_white, average_cpl_black
 
 def estimate_elo(acpl, n_moves):
-    if acpl > 500:
-        return 100
-    
-    e = 2.71828
-    estimate = 3000 * (e ** (-0.01*acpl)) * ((n_moves/50)**0.5)
-    return math.ceil(estimate / 100) * 100
+    return int(batch_estimate_elo([acpl], [n_moves])[0])
 
 def calculate_accuracy(eval_scores):
+    white_accuracies, black_accuracies = batch_accuracy(eval_scores, [0, len(eval_scores)])
+    return white_accuracies[0], black_accuracies[0]
 
-    eval_scores = [0] + eval_scores
-    def calculate_win_percentage(cp_eval, color):
-        if color == 'w':
-            return 50 + 50 * (2 / (1 + np.exp(-0.00368208 * cp_eval)) - 1)
-        elif color == 'b':
-            return 50 + 50 * (2 / (1 + np.exp(0.00368208 * cp_eval)) - 1)
-        
-    white_win_percentages = [calculate_win_percentage(s, 'w') for s in eval_scores]
-    black_win_percentages = [100-p for p in white_win_percentages]
+def get_game_offsets(lengths):
+    np = get_numpy()
+
+    return np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)
+
+def get_ply_indices(offsets):
+    # game index and ply-in-game of every entry of a flat (ragged) score array
+    np = get_numpy()
+
+    lengths = np.diff(offsets)
+    game = np.repeat(np.arange(len(lengths)), lengths)
+    ply = np.arange(offsets[-1]) - offsets[game]
+    return game, ply
+
+def mean_by_game(values, game, n_games):
+    np = get_numpy()
+
+    totals = np.bincount(game, weights=values, minlength=n_games)
+    counts = np.bincount(game, minlength=n_games)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return totals / counts
+
+def batch_accuracy(scores, offsets):
+    # scores: every game's eval_scores concatenated, offsets: start of each game plus the total length
+    np = get_numpy()
+
+    scores = np.asarray(scores, dtype=np.float64)
+    offsets = np.asarray(offsets, dtype=np.int64)
+    n_games = len(offsets) - 1
+    game, ply = get_ply_indices(offsets)
+
+    # the eval before every move, 0 before the first one
+    previous_scores = np.zeros_like(scores)
+    previous_scores[1:] = scores[:-1]
+    previous_scores[ply == 0] = 0
+
+    white_win_before = 50 + 50 * (2 / (1 + np.exp(-0.00368208 * previous_scores)) - 1)
+    white_win_after = 50 + 50 * (2 / (1 + np.exp(-0.00368208 * scores)) - 1)
+
+    white_move = ply % 2 == 0
+    win_delta = np.where(
+        white_move,
+        white_win_before - white_win_after,
+        (100 - white_win_before) - (100 - white_win_after)
+    )
 
     # Accuracy% = 103.1668 * exp(-0.04354 * (winPercentBefore - winPercentAfter)) - 3.1669
-    white_accuracies = []
-    black_accuracies = []
-    for i in range(len(white_win_percentages)-1):
-        #100.03072339664806 * exp(-0.10082980372791278 * x) + -0.030767264030683358
-        if i%2 == 0:
-            win_delta = white_win_percentages[i] - white_win_percentages[i+1]
-            if win_delta <= 0:
-                white_accuracies.append(100)
-            else:
-                accuracy = 100.0307234 * np.exp(-0.1008298 * (win_delta)) - 0.03076726
-                white_accuracies.append(accuracy)
-        else:
-            win_delta = black_win_percentages[i] - black_win_percentages[i+1]
-            if win_delta <= 0:
-                black_accuracies.append(100)
-            else:
-                accuracy = 100.0307234 * np.exp(-0.1008298 * (win_delta)) - 0.03076726
-                black_accuracies.append(accuracy)
+    accuracies = np.where(win_delta <= 0, 100, 100.0307234 * np.exp(-0.1008298 * np.maximum(win_delta, 0)) - 0.03076726)
+
+    white_accuracy = mean_by_game(accuracies[white_move], game[white_move], n_games)
+    black_accuracy = mean_by_game(accuracies[~white_move], game[~white_move], n_games)
+
+    return white_accuracy, black_accuracy
+
+def batch_cpl(scores, best_scores, offsets):
+    np = get_numpy()
+
+    scores = np.asarray(scores, dtype=np.float64)
+    best_scores = np.asarray(best_scores, dtype=np.float64)
+    offsets = np.asarray(offsets, dtype=np.int64)
+    n_games = len(offsets) - 1
+    game, ply = get_ply_indices(offsets)
+
+    cpls = np.abs(best_scores - scores)
+    white_move = ply % 2 == 0
+
+    average_cpl_white = mean_by_game(cpls[white_move], game[white_move], n_games)
+    average_cpl_black = mean_by_game(cpls[~white_move], game[~white_move], n_games)
 
-    return np.mean(white_accuracies), np.mean(black_accuracies)
+    return average_cpl_white, average_cpl_black
+
+def batch_estimate_elo(acpl, n_moves):
+    np = get_numpy()
+
+    acpl = np.asarray(acpl, dtype=np.float64)
+    n_moves = np.asarray(n_moves, dtype=np.float64)
+
+    e = 2.71828
+    estimate = 3000 * np.power(e, -0.01 * acpl) * np.power(n_moves / 50, 0.5)
+    return np.where(acpl > 500, 100, np.ceil(estimate / 100) * 100)
+
+def summarise_games(scores, best_scores, offsets):
+    # per game white/black accuracy, average CPL and Elo estimate for a batch of reviewed games
+    np = get_numpy()
+
+    offsets = np.asarray(offsets, dtype=np.int64)
+    n_moves = np.diff(offsets) // 2
+
+    white_acc, black_acc = batch_accuracy(scores, offsets)
+    average_cpl_white, average_cpl_black = batch_cpl(scores, best_scores, offsets)
+    white_elo_est = batch_estimate_elo(average_cpl_white, n_moves)
+    black_elo_est = batch_estimate_elo(average_cpl_black, n_moves)
+
+    return white_acc, black_acc, average_cpl_white, average_cpl_black, white_elo_est, black_elo_est
+
+def summarise_padded_games(scores, best_scores, lengths):
+    # same as summarise_games for (games x max plies) arrays padded past each game's length
+    np = get_numpy()
+
+    scores = np.asarray(scores)
+    best_scores = np.asarray(best_scores)
+    lengths = np.asarray(lengths, dtype=np.int64)
+    in_game = np.arange(scores.shape[1]) < lengths[:, None]
+
+    return summarise_games(scores[in_game], best_scores[in_game], get_game_offsets(lengths))
 
 def calculate_material(board: chess.Board):
     white_material = 0
     black_material = 0
-    for square in chess.SQUARES:
-        piece = board.piece_at(square)
-        if piece is not None:
-            if piece.color == True:
-                white_material += piece.piece_type
-            else:
-                black_material += piece.piece_type
+    for piece_type in chess.PIECE_TYPES:
+        white_material += piece_type * chess.popcount(board.pieces_mask(piece_type, chess.WHITE))
+        black_material += piece_type * chess.popcount(board.pieces_mask(piece_type, chess.BLACK))
 
     return white_material, black_material
 
@@ -1268,531 +2046,916 @@ def calculate_metrics(fens):
 
     return devs, mobs, tens, conts
 
-piece_dict = {
-    'k': 'King',
-    'n': 'Knight',
-    'q': 'Queen',
-    'r': 'Rook',
-    'p': 'Pawn',
-    'b': 'Bishop'
-}
+METRIC_FEATURES = [
+    'white_dev', 'black_dev',
+    'white_mob', 'black_mob',
+    'white_ten', 'black_ten',
+    'white_cont', 'black_cont',
+    'white_material', 'black_material',
+    'endgame'
+]
+
+DEVELOPMENT_HOME_SQUARES = [
+    (chess.ROOK, chess.BB_A1 | chess.BB_H1, chess.BB_A8 | chess.BB_H8),
+    (chess.KNIGHT, chess.BB_B1 | chess.BB_G1, chess.BB_B8 | chess.BB_G8),
+    (chess.BISHOP, chess.BB_C1 | chess.BB_F1, chess.BB_C8 | chess.BB_F8),
+    (chess.QUEEN, chess.BB_D1, chess.BB_D8),
+]
+
+def count_moves_and_captures(board: chess.Board):
+    # non-pawn legal moves (mobility) and legal captures (tension) of the side to move
+    mobility = 0
+    tension = 0
+    pawns = board.pawns
+    them = board.occupied_co[not board.turn]
+
+    for move in board.generate_legal_moves():
+        if not (chess.BB_SQUARES[move.from_square] & pawns):
+            mobility += 1
+            if chess.BB_SQUARES[move.to_square] & them:
+                tension += 1
+        elif (chess.BB_SQUARES[move.to_square] & them) or (move.to_square == board.ep_square):
+            tension += 1
+
+    return mobility, tension
+
+def get_activity_features(board: chess.Board):
+    player_mobility, player_tension = count_moves_and_captures(board)
+    board.push(chess.Move.null())  # Make a null move to switch turns
+    opponent_mobility, opponent_tension = count_moves_and_captures(board)
+    board.pop()  # Undo the null move
 
-def review_move(board: chess.Board, move, previous_review: str, check_if_opening=False):
-    def format_item_list(items):
-        if len(items) == 0:
-            return ""
+    if board.turn == chess.WHITE:
+        white_mob, black_mob, white_ten, black_ten = player_mobility, opponent_mobility, player_tension, opponent_tension
+    else:
+        white_mob, black_mob, white_ten, black_ten = opponent_mobility, player_mobility, opponent_tension, player_tension
 
-        if len(items) == 1:
-            return items[0]
+    white_cont = 0
+    black_cont = 0
+    for square in chess.scan_forward(board.occupied_co[chess.WHITE]):
+        white_cont += chess.popcount(board.attacks_mask(square))
+    for square in chess.scan_forward(board.occupied_co[chess.BLACK]):
+        black_cont += chess.popcount(board.attacks_mask(square))
 
-        formatted_items = ", ".join(items[:-1]) + ", and " + items[-1]
-        return formatted_items
+    return white_mob, black_mob, white_ten, black_ten, white_cont, black_cont
 
-    position_after_move = board.copy()
-    position_after_move.push(move)
-    
-    review = ''
+def get_position_features(board: chess.Board, features=None):
+    np = get_numpy()
 
-    best_move = get_best_move(board)
+    if features is None:
+        features = np.zeros(len(METRIC_FEATURES), dtype=np.int32)
 
-    if check_if_opening:
-        opening = search_opening(openings_df, get_board_pgn(position_after_move))
-        if opening is not None:
-            review = f'This is a book move. The opening is called {opening}. '
-            return 'book', review, best_move, board.san(best_move)
-    
-    move_classication = classify_move(board, move)
+    white = board.occupied_co[chess.WHITE]
+    black = board.occupied_co[chess.BLACK]
 
-    if move_classication in ['excellent', 'good']:
+    white_dev = 0
+    black_dev = 0
+    for piece_type, white_home, black_home in DEVELOPMENT_HOME_SQUARES:
+        pieces = board.pieces_mask(piece_type, chess.WHITE) | board.pieces_mask(piece_type, chess.BLACK)
+        white_dev += chess.popcount(white_home & ~(pieces & white))
+        black_dev += chess.popcount(black_home & ~(pieces & black))
 
-        if move == best_move:
-            move_classication = "best"
-            
-        review += f'{board.san(move)} is {move_classication}. '
-        
-        trade = False
+    white_material, black_material = calculate_material(board)
 
-        if is_possible_trade(board, move) and not move_is_discovered_check(board, move):
-            if board.is_capture(move):
-                review += 'This is a trade. '
-            else:
-                review += 'This offers a trade. '
-            trade = True
+    features[0:2] = white_dev, black_dev
+    features[2:8] = get_activity_features(board)
+    features[8:10] = white_material, black_material
+    features[10] = is_endgame(board)
 
-        defended_pieces = move_defends_hanging_piece(board, move, return_list_defended=True)
-        defended_squares = [chess.square_name(s) for s in defended_pieces]
-        defended_pieces = [piece_dict[str(board.piece_at(s)).lower()] for s in defended_pieces]
+    return features
 
-        if 'King' in defended_pieces:
-            ki = defended_pieces.index('King')
-            del defended_pieces[ki]
-            del defended_squares[ki]
+def compute_game_metrics(moves: list):
+    # one row per ply, columns as in METRIC_FEATURES, for the position after each move
+    np = get_numpy()
 
-        if (len(defended_pieces) > 0) and (trade == False):
-            
-            review += f'This defends a {format_item_list(defended_pieces)} on {format_item_list(defended_squares)}. '
+    metrics = np.zeros((len(moves), len(METRIC_FEATURES)), dtype=np.int32)
 
-        possible_forked_squares = move_creates_fork(board, move, return_forked_squares=True)
-        if len(possible_forked_squares) >= 2:
-            forked_pieces = [piece_dict[str(board.piece_at(s)).lower()] for s in possible_forked_squares]
-            review += f'This creates a fork on {format_item_list(forked_pieces)}. '
-        else:
-            possible_attakced_piece = move_attacks_piece(board, move, return_attacked_piece=True)
-            if possible_attakced_piece is not False:
-                review += f'This attacks the {piece_dict[str(possible_attakced_piece).lower()]}. '
+    board = chess.Board()
+    for ply, move in enumerate(moves):
+        board.push(move)
+        get_position_features(board, metrics[ply])
 
+    return metrics
 
-        if move_blocks_check(board, move):
-            review += f'This blocks a check to the king with a piece. '
+def replay_moves(moves):
+    # parse_pgn and compute_game_metrics in a single replay: material, piece counts, development
+    # and the endgame flag are updated from each move's moved and captured piece
+    np = get_numpy()
 
-        developing = is_developing_move(board, move)
-        if developing is not False:
-            review += f'This develops a {piece_dict[developing.lower()]}. '
-        
-        if is_fianchetto(board, move):
-            review += 'This fianchettos the bishop by putting it on a powerful diagonal. '
+    board = chess.Board()
 
-        if move_pins_opponent(board, move):
-            review += 'This pins a piece of the opponent to their king. '
+    san_moves = []
+    uci_moves = []
+    fens = []
+    metrics = np.zeros((len(moves), len(METRIC_FEATURES)), dtype=np.int32)
+
+    # indexed by color (chess.BLACK == 0, chess.WHITE == 1) and piece type
+    piece_counts = [[0] + [chess.popcount(board.pieces_mask(piece_type, color)) for piece_type in chess.PIECE_TYPES] for color in [chess.BLACK, chess.WHITE]]
+    material = [sum(piece_type * piece_counts[color][piece_type] for piece_type in chess.PIECE_TYPES) for color in [chess.BLACK, chess.WHITE]]
+    minor_and_major_pieces = sum(piece_counts[color][piece_type] for color in chess.COLORS for piece_type in ENDGAME_PIECE_TYPES)
+
+    home_pieces = {}
+    for piece_type, white_home, black_home in DEVELOPMENT_HOME_SQUARES:
+        for square in chess.scan_forward(white_home):
+            home_pieces[square] = chess.Piece(piece_type, chess.WHITE)
+        for square in chess.scan_forward(black_home):
+            home_pieces[square] = chess.Piece(piece_type, chess.BLACK)
+    developed = {square: board.piece_at(square) != piece for square, piece in home_pieces.items()}
+    development = [sum(developed[s] for s, p in home_pieces.items() if p.color == color) for color in [chess.BLACK, chess.WHITE]]
+
+    for ply, move in enumerate(moves):
+        mover = board.turn
+        touched_squares = [move.from_square, move.to_square]
+
+        if board.is_en_passant(move):
+            captured_type = chess.PAWN
+        else:
+            captured_type = board.piece_type_at(move.to_square)
 
-        if moves_rook_to_open_file(board, move):
-            review += "By placing the rook on an open file, it controls important columns. "
+        if board.is_castling(move):
+            touched_squares += [chess.A1, chess.H1] if mover == chess.WHITE else [chess.A8, chess.H8]
+            captured_type = None # the king "captures" its own rook in chess960 notation
 
-        if is_endgame(board):
-            if move_moves_king_off_backrank(board, move):
-                review += "By moving the king off the back rank, the risk of back rank mate threats is reduced and improve the king's safety. "
+        if captured_type is not None:
+            piece_counts[not mover][captured_type] -= 1
+            material[not mover] -= captured_type
+            if captured_type in ENDGAME_PIECE_TYPES:
+                minor_and_major_pieces -= 1
 
-        if move_wins_tempo(board, move):
-            review += 'This move gains a tempo. '
+        if move.promotion is not None:
+            piece_counts[mover][chess.PAWN] -= 1
+            piece_counts[mover][move.promotion] += 1
+            material[mover] += move.promotion - chess.PAWN
+            minor_and_major_pieces += 1
 
-        if 'trade' not in previous_review:
+        san_moves.append(board.san(move))
+        board.push(move)
+        uci_moves.append(move)
+        fens.append(board.fen())
 
-            if move_captures_higher_piece(board, move):
-                review += f'This captures a higher value piece. '
+        for square in touched_squares:
+            if square in home_pieces:
+                now_developed = board.piece_at(square) != home_pieces[square]
+                if now_developed != developed[square]:
+                    developed[square] = now_developed
+                    development[home_pieces[square].color] += 1 if now_developed else -1
 
-            if 'higher value piece' not in previous_review:
-                if move_captures_free_piece(board, move):
-                    review += f'This captures a free {piece_dict[str(board.piece_at(move.to_square)).lower()]}. '
+        metrics[ply, 0:2] = development[chess.WHITE], development[chess.BLACK]
+        metrics[ply, 2:8] = get_activity_features(board)
+        metrics[ply, 8:10] = material[chess.WHITE], material[chess.BLACK]
+        metrics[ply, 10] = minor_and_major_pieces < 6
 
-        attacked_squares_with_check = move_is_discovered_check_and_attacks(board, move, return_attacked_squares=True)
-        if len(attacked_squares_with_check) > 0:
-            attacked_pieces_with_check = [board.piece_at(s) for s in attacked_squares_with_check]
-            attacked_pieces_with_check = [piece_dict[str(p).lower()] for p in attacked_pieces_with_check]
-            review += f'This creates a discovered check whilst attacking a {format_item_list(attacked_pieces_with_check)}. '
+    return uci_moves, san_moves, fens, metrics
 
-        trapped_squares = move_traps_opponents_piece(board, move, return_trapped_squares=True)
-        if len(trapped_squares) > 0:
-            trapped_pieces = [board.piece_at(s) for s in trapped_squares]
-            trapped_pieces = [piece_dict[str(p).lower()] for p in trapped_pieces]
-            review += f'This traps a {format_item_list(trapped_pieces)}. '
+def split_game_metrics(metrics):
+    devs = metrics[:, 0:2].tolist()
+    mobs = metrics[:, 2:4].tolist()
+    tens = metrics[:, 4:6].tolist()
+    conts = metrics[:, 6:8].tolist()
 
-        if is_possible_sacrifice(board, move):
-            #if move_classication != 'good':
-            move_classication = 'brilliant'
-            review = review.replace('best', 'brilliant')
-            review = review.replace('good', 'brilliant')
-            review = review.replace('excellent', 'brilliant')
-            review += f'This sacrifices the {piece_dict[str(board.piece_at(move.from_square)).lower()]}. '
+    return devs, mobs, tens, conts
 
-        if move_threatens_mate(board, move):
-            review += 'This creates a checkmate threat. '
+piece_dict = {
+    'k': 'King',
+    'n': 'Knight',
+    'q': 'Queen',
+    'r': 'Rook',
+    'p': 'Pawn',
+    'b': 'Bishop'
+}
 
+def format_item_list(items):
+    if len(items) == 0:
+        return ""
+
+    if len(items) == 1:
+        return items[0]
+
+    formatted_items = ", ".join(items[:-1]) + ", and " + items[-1]
+    return formatted_items
+
+def piece_names(board: chess.Board, squares):
+    return format_item_list([piece_dict[str(board.piece_at(s)).lower()] for s in squares])
+
+# Reviews are built in two steps: review rules turn lazily computed move features into facts,
+# then a phrase table renders the facts as text (REVIEW_PHRASES or ROAST_PHRASES).
+
+MOVE_FEATURES = dict()
+REVIEW_RULES = []
+
+def move_feature(function):
+    # registers feature_<name> as the feature <name>
+    MOVE_FEATURES[function.__name__[len('feature_'):]] = function
+    return function
+
+def review_rule(branch):
+    # registers rule_<name> for the moves of one branch, rules run and are rendered in the order they are defined
+    def register(function):
+        REVIEW_RULES.append((function.__name__[len('rule_'):], branch, function))
+        return function
+    return register
+
+class MoveFeatures:
+    # the features of one move, computed on first use and memoized
+
+    def __init__(self, board: chess.Board, move, previous_review=None, check_if_opening=False, evaluations=None):
+        self.board = board
+        self.move = move
+        self.previous_review = previous_review if previous_review is not None else ''
+        self.check_if_opening = check_if_opening
+        # evaluations shared with the other moves of the game, the position after a move
+        # is the position before the next one
+        self.evaluations = evaluations if evaluations is not None else dict()
+        self.values = dict()
+
+    def __getitem__(self, name):
+        if name not in self.values:
+            function = MOVE_FEATURES[name]
+            with tracing.span(name, 'feature'):
+                self.values[name] = function(self)
+        return self.values[name]
+
+    def evaluate(self, board: chess.Board):
+        key = board.fen()
+        if key not in self.evaluations:
+            self.evaluations[key] = evaluate(board, return_mate_n=True)
+        return self.evaluations[key]
+
+@move_feature
+def feature_position_after_move(f):
+    position_after_move = f.board.copy()
+    position_after_move.push(f.move)
+    return position_after_move
+
+@move_feature
+def feature_san(f):
+    return f.board.san(f.move)
+
+@move_feature
+def feature_side(f):
+    return 'White' if f.board.turn else 'Black'
+
+@move_feature
+def feature_forced_move(f):
+    return get_forced_move(f.board)
+
+@move_feature
+def feature_book_moves(f):
+    return get_book_moves(f.board)
+
+@move_feature
+def feature_is_book_move(f):
+    return f.move in f['book_moves']
+
+@move_feature
+def feature_best_move(f):
+    if f['forced_move'] is not None:
+        return f['forced_move']
+    if f['is_book_move']:
+        return f['book_moves'][0]
+    return get_best_move(f.board)
+
+@move_feature
+def feature_best_san(f):
+    return f.board.san(f['best_move'])
+
+@move_feature
+def feature_is_best(f):
+    return f.move == f['best_move']
+
+@move_feature
+def feature_opening(f):
+    if not f.check_if_opening:
+        return None
+    return lookup_opening(f['position_after_move'])
 
-    elif move_classication in ['inaccuracy', 'mistake', 'blunder']:
+@move_feature
+def feature_eval_before(f):
+    return f.evaluate(f.board)[0]
 
-        review += f'{board.san(move)} is {move_classication}. '
+@move_feature
+def feature_eval_after(f):
+    return f.evaluate(f['position_after_move'])
 
-        possible_hanging_squares = []
-        if ('creates a fork' not in previous_review) or (not board.is_check()) or ('trade' not in previous_review) or ('lower value' not in previous_review):
-            possible_hanging_squares = move_hangs_piece(board, move, return_hanging_squares=True)
+@move_feature
+def feature_points_gained(f):
+    current_score, n = f['eval_after']
+    return get_points_gained(f.board.turn, f['eval_before'], current_score, n)
 
-            if is_possible_trade(board, move):
-                if move.to_square in possible_hanging_squares:
-                    del possible_hanging_squares[possible_hanging_squares.index(move.to_square)]
+@move_feature
+def feature_classification(f):
+    return classify_points_gained(f['points_gained'])
 
-            possible_hanging_squares = [s for s in possible_hanging_squares if position_after_move.piece_at(s).color == board.turn]
-            if len(possible_hanging_squares) > 0:
-                hanging_squares = [chess.square_name(s) for s in possible_hanging_squares]
-                hanging_pieces = [piece_dict[str(position_after_move.piece_at(s)).lower()] for s in possible_hanging_squares]
-                review += f'This move leaves {format_item_list(hanging_pieces)} hanging on {format_item_list(hanging_squares)}. '
+@move_feature
+def feature_branch(f):
+    classification = f['classification']
 
-        capturable_pieces_by_lower = check_for_capturable_pieces_by_lower(position_after_move)
-        capturable_pieces_by_lower = [s for s in capturable_pieces_by_lower if s not in possible_hanging_squares]
+    if f['forced_move'] is not None:
+        return 'forced'
+    elif classification in ['excellent', 'good']:
+        return 'good'
+    elif classification in ['inaccuracy', 'mistake', 'blunder']:
+        return 'bad'
+    elif 'continues gets mated' in classification:
+        return 'continues gets mated'
+    elif 'gets mated' in classification:
+        return 'gets mated'
+    elif 'lost mate' in classification:
+        return 'lost mate'
+    elif 'mates' in classification:
+        return 'mates'
+
+@move_feature
+def feature_possible_trade(f):
+    return is_possible_trade(f.board, f.move)
+
+@move_feature
+def feature_trade(f):
+    return f['possible_trade'] and not move_is_discovered_check(f.board, f.move)
+
+@move_feature
+def feature_forked_squares(f):
+    return move_creates_fork(f.board, f.move, return_forked_squares=True)
+
+@move_feature
+def feature_attacked_piece(f):
+    return move_attacks_piece(f.board, f.move, return_attacked_piece=True)
+
+@move_feature
+def feature_wins_tempo(f):
+    # move_wins_tempo, reusing the evaluations made for the classification
+    if f['attacked_piece'] is False:
+        return False
+    return (type(f['points_gained']) != str) and (f['points_gained'] > 0)
 
-        if (len(capturable_pieces_by_lower) > 0) and (not position_after_move.is_check())  and (not is_possible_trade(board, move)):
-            capturable_pieces_by_lower = [piece_dict[str(position_after_move.piece_at(s)).lower()] for s in capturable_pieces_by_lower]
-            review += f'A {format_item_list(capturable_pieces_by_lower)} can be captured by a lower value piece. '
+@move_feature
+def feature_hanging_squares(f):
+    board = f.board
+    previous_review = f.previous_review
+    position_after_move = f['position_after_move']
 
-        possible_forking_moves = move_allows_fork(board, move, return_forking_moves=True)
-        
-        if get_best_move(position_after_move) in possible_forking_moves:
-            review += 'This move leaves pieces vulnerable to a fork. '
-
-        missed_forks = move_misses_fork(board, move, return_forking_moves=True)
-        if (best_move in missed_forks) and (move != best_move):
-            review += f'There was a missed fork with {board.san(best_move)}. '
-
-        missed_pins = move_misses_pin(board, move, return_pin_move=True)
-        if (best_move in missed_pins) and (move != best_move):
-            review += f"There was a missed pin in the previous move with {board.san(best_move)}. "
-
-        missed_free_captures = move_misses_free_piece(board, move, return_free_captures=True)
-        if len(missed_free_captures) > 0:
-            if (best_move in missed_free_captures) and (move != best_move):
-                review += f"An opportunity to take a {piece_dict[str(board.piece_at(best_move.to_square)).lower()]} was lost. "
-
-        lets_opponent_play_move = get_best_move(position_after_move)
-
-        if move_threatens_mate(board, best_move):
-            review += 'This misses an opportunity to create a checkmate threat. '
-
-        missed_attacked_piece = move_attacks_piece(board, best_move, return_attacked_piece=True)
-        if missed_attacked_piece is not False:
-            review += f'A chance to attack a {piece_dict[str(missed_attacked_piece).lower()]} with {board.san(best_move)} was missed. '
-
-        if move_attacks_piece(position_after_move, lets_opponent_play_move):
-            review += f'This permits the opponent to attack a piece. '
-
-        attacked_squares_with_check = move_is_discovered_check_and_attacks(position_after_move, lets_opponent_play_move, return_attacked_squares=True)
-        if len(attacked_squares_with_check) > 0:
-            attacked_pieces_with_check = [position_after_move.piece_at(s) for s in attacked_squares_with_check]
-            attacked_pieces_with_check = [piece_dict[str(p).lower()] for p in attacked_pieces_with_check]
-            review += f'This lets the opponent win a {format_item_list(attacked_pieces_with_check)} from a discovered check. '
-
-        missed_attacked_squares_with_check = move_is_discovered_check_and_attacks(board, best_move, return_attacked_squares=True)
-        if len(missed_attacked_squares_with_check) > 0:
-            missed_attacked_pieces_with_check = [board.piece_at(s) for s in missed_attacked_squares_with_check]
-            missed_attacked_pieces_with_check = [piece_dict[str(p).lower()] for p in missed_attacked_pieces_with_check]
-            review += f'This looses a chance to attack a {format_item_list(missed_attacked_pieces_with_check)} from a discovered check. '
-
-        if not (len(attacked_squares_with_check) > 0):
-            trapped_squares = move_traps_opponents_piece(position_after_move, lets_opponent_play_move, return_trapped_squares=True)
-            if len(trapped_squares) > 0:
-                trapped_pieces = [position_after_move.piece_at(s) for s in trapped_squares]
-                trapped_pieces = [piece_dict[str(p).lower()] for p in trapped_pieces]
-                review += f'This allows a {format_item_list(trapped_pieces)} to be trapped. '
-
-        missed_trapped_squares = move_traps_opponents_piece(board, best_move, return_trapped_squares=True)
-        if len(missed_trapped_squares) > 0:
-            missed_trapped_pieces = [board.piece_at(s) for s in missed_trapped_squares]
-            missed_trapped_pieces = [piece_dict[str(p).lower()] for p in missed_trapped_pieces]
-            review += f'This looses a chance to trap a {format_item_list(missed_trapped_pieces)}. '
-
-        if move_wins_tempo(position_after_move, lets_opponent_play_move):
-            review += f'The opponent can win a tempo. '
-
-        review += f"The opponent can play {position_after_move.san(lets_opponent_play_move)}. "
-
-    elif 'continues gets mated' in move_classication:
-        losing_side = 'White' if board.turn else 'Black'
-        review += f"{board.san(move)} is good, but {losing_side} will still get checkmated. {losing_side} gets mated in {move_classication[-1]}."
-        if move == best_move:
-            move_classication = "best"
-        else:
-            move_classication = 'good'
+    if ('creates a fork' not in previous_review) or (not board.is_check()) or ('trade' not in previous_review) or ('lower value' not in previous_review):
+        possible_hanging_squares = move_hangs_piece(board, f.move, return_hanging_squares=True)
 
-    elif 'gets mated' in move_classication:
-        lets_opponent_play_move = get_best_move(position_after_move)
+        if f['possible_trade']:
+            if f.move.to_square in possible_hanging_squares:
+                del possible_hanging_squares[possible_hanging_squares.index(f.move.to_square)]
 
-        losing_side = 'White' if board.turn else 'Black'
-        review += f'The opponent can play {position_after_move.san(lets_opponent_play_move)}. '
-        review += f"{board.san(move)} is a blunder and allows checkmate. {losing_side} gets mated in {move_classication[-1]}."
+        return [s for s in possible_hanging_squares if position_after_move.piece_at(s).color == board.turn]
 
-        move_classication = 'blunder'
-    
-    elif 'lost mate' in move_classication:
-        lets_opponent_play_move = get_best_move(position_after_move)
-        review += f"This loses the checkmate sequence. The opponent can play {position_after_move.san(lets_opponent_play_move)}. "
-        move_classication = 'blunder'
-
-    elif 'mates' in move_classication:
-        n = previous_review[-2] # ex. "White gets mated in 6." we need the number 6
-        if n.isdigit(): # means that player is continuing checkmate sequence
-
-            if int(move_classication[-1]) <= int(n): # means player is one move less away from mating
-                winning_side = 'White' if board.turn else 'Black'
-                if int(move_classication[-1]) == 0:
-                    review += f"Checkmate!"
-                else:
-                    review += f"{board.san(move)} continues the checkmate sequence. {winning_side} gets mated in {move_classication[-1]}."
-            
-            else:
-                winning_side = 'White' if board.turn else 'Black'
-                review += f"{board.san(move)} is good, but there was a faster way to checkmate. {winning_side} gets mated in {move_classication[-1]}."
-                move_classication = 'good'
+    return []
 
-            if move == best_move:
-                move_classication = "best"
+@move_feature
+def feature_opponent_best_move(f):
+    return get_best_move(f['position_after_move'])
 
+@move_feature
+def feature_opponent_san(f):
+    return f['position_after_move'].san(f['opponent_best_move'])
 
-    return move_classication, review, best_move, board.san(best_move)
+@move_feature
+def feature_opponent_discovered_check_squares(f):
+    return move_is_discovered_check_and_attacks(f['position_after_move'], f['opponent_best_move'], return_attacked_squares=True)
 
-def roast_move(board: chess.Board, move, previous_review: str, check_if_opening=False):
-    def format_item_list(items):
-        if len(items) == 0:
-            return ""
+@move_feature
+def feature_opponent_wins_tempo(f):
+    # move_wins_tempo for the opponent's best reply, the position after the move is already evaluated
+    position_after_move = f['position_after_move']
+    opponent_move = f['opponent_best_move']
 
-        if len(items) == 1:
-            return items[0]
+    if not move_attacks_piece(position_after_move, opponent_move):
+        return False
 
-        formatted_items = ", ".join(items[:-1]) + ", and " + items[-1]
-        return formatted_items
+    position_after_reply = position_after_move.copy()
+    position_after_reply.push(opponent_move)
+    current_score, n = f.evaluate(position_after_reply)
+
+    points_gained = get_points_gained(position_after_move.turn, f['eval_after'][0], current_score, n)
+    return (type(points_gained) != str) and (points_gained > 0)
+
+@move_feature
+def feature_mate_sequence_n(f):
+    n = f.previous_review[-2:-1] # ex. "White gets mated in 6." we need the number 6
+    if n.isdigit(): # means that player is continuing checkmate sequence
+        return int(n)
+    return None
+
+
+@review_rule('good')
+def rule_verdict(f):
+    return {'san': f['san'], 'classification': 'best' if f['is_best'] else f['classification']}
+
+@review_rule('good')
+def rule_trade(f):
+    if f['trade'] and f.board.is_capture(f.move):
+        return {}
+
+@review_rule('good')
+def rule_offers_trade(f):
+    if f['trade'] and not f.board.is_capture(f.move):
+        return {}
+
+@review_rule('good')
+def rule_defends(f):
+    defended_squares = move_defends_hanging_piece(f.board, f.move, return_list_defended=True)
+    defended_pieces = [piece_dict[str(f.board.piece_at(s)).lower()] for s in defended_squares]
+    defended_squares = [chess.square_name(s) for s in defended_squares]
+
+    if 'King' in defended_pieces:
+        ki = defended_pieces.index('King')
+        del defended_pieces[ki]
+        del defended_squares[ki]
+
+    if (len(defended_pieces) > 0) and (f['trade'] == False):
+        return {'pieces': format_item_list(defended_pieces), 'squares': format_item_list(defended_squares)}
+
+@review_rule('good')
+def rule_fork(f):
+    if len(f['forked_squares']) >= 2:
+        return {'pieces': piece_names(f.board, f['forked_squares'])}
+
+@review_rule('good')
+def rule_attacks(f):
+    if (len(f['forked_squares']) < 2) and (f['attacked_piece'] is not False):
+        return {'piece': piece_dict[str(f['attacked_piece']).lower()]}
+
+@review_rule('good')
+def rule_blocks_check(f):
+    if move_blocks_check(f.board, f.move):
+        return {}
+
+@review_rule('good')
+def rule_develops(f):
+    developing = is_developing_move(f.board, f.move)
+    if developing is not False:
+        return {'piece': piece_dict[developing.lower()]}
+
+@review_rule('good')
+def rule_fianchetto(f):
+    if is_fianchetto(f.board, f.move):
+        return {}
+
+@review_rule('good')
+def rule_pin(f):
+    if move_pins_opponent(f.board, f.move):
+        return {}
+
+@review_rule('good')
+def rule_open_file(f):
+    if moves_rook_to_open_file(f.board, f.move):
+        return {}
+
+@review_rule('good')
+def rule_king_off_backrank(f):
+    if is_endgame(f.board) and move_moves_king_off_backrank(f.board, f.move):
+        return {}
+
+@review_rule('good')
+def rule_tempo(f):
+    if f['wins_tempo']:
+        return {}
+
+@review_rule('good')
+def rule_captures_higher(f):
+    if ('trade' not in f.previous_review) and move_captures_higher_piece(f.board, f.move):
+        return {}
+
+@review_rule('good')
+def rule_captures_free(f):
+    if ('trade' not in f.previous_review) and ('higher value piece' not in f.previous_review):
+        if move_captures_free_piece(f.board, f.move):
+            return {'piece': piece_dict[str(f.board.piece_at(f.move.to_square)).lower()]}
+
+@review_rule('good')
+def rule_discovered_check(f):
+    attacked_squares_with_check = move_is_discovered_check_and_attacks(f.board, f.move, return_attacked_squares=True)
+    if len(attacked_squares_with_check) > 0:
+        return {'pieces': piece_names(f.board, attacked_squares_with_check)}
+
+@review_rule('good')
+def rule_traps(f):
+    trapped_squares = move_traps_opponents_piece(f.board, f.move, return_trapped_squares=True)
+    if len(trapped_squares) > 0:
+        return {'pieces': piece_names(f.board, trapped_squares)}
+
+@review_rule('good')
+def rule_sacrifice(f):
+    if is_possible_sacrifice(f.board, f.move):
+        return {'piece': piece_dict[str(f.board.piece_at(f.move.from_square)).lower()]}
+
+@review_rule('good')
+def rule_threatens_mate(f):
+    if move_threatens_mate(f.board, f.move):
+        return {}
+
+
+@review_rule('bad')
+def rule_bad_verdict(f):
+    return {'san': f['san'], 'classification': f['classification']}
+
+@review_rule('bad')
+def rule_hanging(f):
+    if len(f['hanging_squares']) > 0:
+        return {
+            'pieces': piece_names(f['position_after_move'], f['hanging_squares']),
+            'squares': format_item_list([chess.square_name(s) for s in f['hanging_squares']])
+        }
+
+@review_rule('bad')
+def rule_capturable_by_lower(f):
+    position_after_move = f['position_after_move']
+    capturable_pieces_by_lower = check_for_capturable_pieces_by_lower(position_after_move)
+    capturable_pieces_by_lower = [s for s in capturable_pieces_by_lower if s not in f['hanging_squares']]
+
+    if (len(capturable_pieces_by_lower) > 0) and (not position_after_move.is_check()) and (not f['possible_trade']):
+        return {'pieces': piece_names(position_after_move, capturable_pieces_by_lower)}
+
+@review_rule('bad')
+def rule_allows_fork(f):
+    # the opponent's best reply is one of the forking moves move_allows_fork would list
+    if move_creates_fork(f['position_after_move'], f['opponent_best_move']):
+        return {}
+
+@review_rule('bad')
+def rule_missed_fork(f):
+    if (not f['is_best']) and move_creates_fork(f.board, f['best_move']):
+        return {'best_san': f['best_san']}
+
+@review_rule('bad')
+def rule_missed_pin(f):
+    if (not f['is_best']) and move_pins_opponent(f.board, f['best_move']):
+        return {'best_san': f['best_san']}
+
+@review_rule('bad')
+def rule_missed_free_piece(f):
+    if (not f['is_best']) and move_captures_free_piece(f.board, f['best_move']):
+        return {'piece': piece_dict[str(f.board.piece_at(f['best_move'].to_square)).lower()]}
+
+@review_rule('bad')
+def rule_missed_mate_threat(f):
+    if move_threatens_mate(f.board, f['best_move']):
+        return {}
+
+@review_rule('bad')
+def rule_missed_attack(f):
+    missed_attacked_piece = move_attacks_piece(f.board, f['best_move'], return_attacked_piece=True)
+    if missed_attacked_piece is not False:
+        return {'piece': piece_dict[str(missed_attacked_piece).lower()], 'best_san': f['best_san']}
+
+@review_rule('bad')
+def rule_allows_attack(f):
+    if move_attacks_piece(f['position_after_move'], f['opponent_best_move']):
+        return {}
+
+@review_rule('bad')
+def rule_allows_discovered_check(f):
+    if len(f['opponent_discovered_check_squares']) > 0:
+        return {'pieces': piece_names(f['position_after_move'], f['opponent_discovered_check_squares'])}
+
+@review_rule('bad')
+def rule_missed_discovered_check(f):
+    missed_attacked_squares_with_check = move_is_discovered_check_and_attacks(f.board, f['best_move'], return_attacked_squares=True)
+    if len(missed_attacked_squares_with_check) > 0:
+        return {'pieces': piece_names(f.board, missed_attacked_squares_with_check)}
+
+@review_rule('bad')
+def rule_allows_trap(f):
+    if len(f['opponent_discovered_check_squares']) == 0:
+        trapped_squares = move_traps_opponents_piece(f['position_after_move'], f['opponent_best_move'], return_trapped_squares=True)
+        if len(trapped_squares) > 0:
+            return {'pieces': piece_names(f['position_after_move'], trapped_squares)}
+
+@review_rule('bad')
+def rule_missed_trap(f):
+    missed_trapped_squares = move_traps_opponents_piece(f.board, f['best_move'], return_trapped_squares=True)
+    if len(missed_trapped_squares) > 0:
+        return {'pieces': piece_names(f.board, missed_trapped_squares)}
+
+@review_rule('bad')
+def rule_allows_tempo(f):
+    if f['opponent_wins_tempo']:
+        return {}
+
+@review_rule('bad')
+def rule_opponent_move(f):
+    return {'opponent_san': f['opponent_san']}
+
+
+@review_rule('continues gets mated')
+def rule_still_mated(f):
+    return {'san': f['san'], 'side': f['side'], 'n': f['classification'][-1]}
+
+@review_rule('gets mated')
+def rule_mated_opponent_move(f):
+    return {'opponent_san': f['opponent_san']}
+
+@review_rule('gets mated')
+def rule_allows_mate(f):
+    return {'san': f['san'], 'side': f['side'], 'n': f['classification'][-1]}
+
+@review_rule('lost mate')
+def rule_lost_mate(f):
+    return {'opponent_san': f['opponent_san']}
+
+@review_rule('mates')
+def rule_checkmate(f):
+    n = f['mate_sequence_n']
+    if (n is not None) and (int(f['classification'][-1]) <= n) and (int(f['classification'][-1]) == 0):
+        return {}
+
+@review_rule('mates')
+def rule_continues_mate(f):
+    n = f['mate_sequence_n']
+    if (n is not None) and (int(f['classification'][-1]) <= n) and (int(f['classification'][-1]) != 0):
+        return {'san': f['san'], 'side': f['side'], 'n': f['classification'][-1]}
+
+@review_rule('mates')
+def rule_faster_mate(f):
+    n = f['mate_sequence_n']
+    if (n is not None) and (int(f['classification'][-1]) > n):
+        return {'san': f['san'], 'side': f['side'], 'n': f['classification'][-1]}
+
+@review_rule('forced')
+def rule_forced(f):
+    return {'san': f['san']}
+
+@review_rule('forced')
+def rule_forced_checkmate(f):
+    if f['classification'] == 'mates 0':
+        return {}
+
+@review_rule('forced')
+def rule_forced_mated(f):
+    # keeps the mate count at the end of the review for the checkmate sequence
+    if 'gets mated' in f['classification']:
+        return {'side': f['side'], 'n': f['classification'][-1]}
+
+
+REVIEW_PHRASES = {
+    'book': 'This is a book move. The opening is called {opening}. ',
+    'book_move': 'This is a book move. ',
+    'verdict': '{san} is {classification}. ',
+    'trade': 'This is a trade. ',
+    'offers_trade': 'This offers a trade. ',
+    'defends': 'This defends a {pieces} on {squares}. ',
+    'fork': 'This creates a fork on {pieces}. ',
+    'attacks': 'This attacks the {piece}. ',
+    'blocks_check': 'This blocks a check to the king with a piece. ',
+    'develops': 'This develops a {piece}. ',
+    'fianchetto': 'This fianchettos the bishop by putting it on a powerful diagonal. ',
+    'pin': 'This pins a piece of the opponent to their king. ',
+    'open_file': "By placing the rook on an open file, it controls important columns. ",
+    'king_off_backrank': "By moving the king off the back rank, the risk of back rank mate threats is reduced and improve the king's safety. ",
+    'tempo': 'This move gains a tempo. ',
+    'captures_higher': 'This captures a higher value piece. ',
+    'captures_free': 'This captures a free {piece}. ',
+    'discovered_check': 'This creates a discovered check whilst attacking a {pieces}. ',
+    'traps': 'This traps a {pieces}. ',
+    'sacrifice': 'This sacrifices the {piece}. ',
+    'threatens_mate': 'This creates a checkmate threat. ',
+
+    'bad_verdict': '{san} is {classification}. ',
+    'hanging': 'This move leaves {pieces} hanging on {squares}. ',
+    'capturable_by_lower': 'A {pieces} can be captured by a lower value piece. ',
+    'allows_fork': 'This move leaves pieces vulnerable to a fork. ',
+    'missed_fork': 'There was a missed fork with {best_san}. ',
+    'missed_pin': "There was a missed pin in the previous move with {best_san}. ",
+    'missed_free_piece': "An opportunity to take a {piece} was lost. ",
+    'missed_mate_threat': 'This misses an opportunity to create a checkmate threat. ',
+    'missed_attack': 'A chance to attack a {piece} with {best_san} was missed. ',
+    'allows_attack': 'This permits the opponent to attack a piece. ',
+    'allows_discovered_check': 'This lets the opponent win a {pieces} from a discovered check. ',
+    'missed_discovered_check': 'This looses a chance to attack a {pieces} from a discovered check. ',
+    'allows_trap': 'This allows a {pieces} to be trapped. ',
+    'missed_trap': 'This looses a chance to trap a {pieces}. ',
+    'allows_tempo': 'The opponent can win a tempo. ',
+    'opponent_move': "The opponent can play {opponent_san}. ",
+
+    'still_mated': "{san} is good, but {side} will still get checkmated. {side} gets mated in {n}.",
+    'mated_opponent_move': 'The opponent can play {opponent_san}. ',
+    'allows_mate': "{san} is a blunder and allows checkmate. {side} gets mated in {n}.",
+    'lost_mate': "This loses the checkmate sequence. The opponent can play {opponent_san}. ",
+    'checkmate': "Checkmate!",
+    'continues_mate': "{san} continues the checkmate sequence. {side} gets mated in {n}.",
+    'faster_mate': "{san} is good, but there was a faster way to checkmate. {side} gets mated in {n}.",
+
+    'forced': "{san} is forced, it is the only legal move. ",
+    'forced_checkmate': "Checkmate!",
+    'forced_mated': "{side} gets mated in {n}.",
+}
 
-    position_after_move = board.copy()
-    position_after_move.push(move)
-    
+ROAST_PHRASES = dict(
+    REVIEW_PHRASES,
+    hanging='This IS SO STUPID. {pieces} is fucking hanging on {squares}. ',
+    capturable_by_lower='A lower value is piece just STARING at {pieces}. How the fuck can you let that happen? ',
+    allows_fork='Forky forky forky YOU CAN GET FORKED YOU DUMBASS! ',
+    missed_fork='Are you blind? You could have forked with {best_san}. Smh. ',
+    missed_pin="Just another missed pin with {best_san} because of stupidity. ",
+    missed_free_piece="Can this get any more annoying? You could have taken a {piece}. ",
+    missed_mate_threat="Is this person trying to lose? They could've threatened a fucking forced checkmate. ",
+    missed_attack='This missed attacking {piece} with {best_san} because they were too pussy. ',
+    allows_attack="You're just asking the opponent to attack one of your pieces. ",
+    allows_discovered_check='This dumbass looses a {pieces} from a discovered check. ',
+    missed_discovered_check='Understandable that a moron would lose a chance to attack a {pieces} from a discovered check. ',
+    allows_trap="That's so hilarious! A {pieces} can get trapped. ",
+    missed_trap="Why did you let a {pieces} escape?? You could've trapped them you dumb fuck. ",
+    allows_tempo='Sigh. You just let the opponent win a tempo. ',
+    allows_mate="{san} is a blunder. You tryna sacrifice the game? {side} gets mated in {n}.",
+    lost_mate="You were winning! Why did you do that? I guess that's expected for a someone with a small brain to lose a checkmate sequence. The opponent can play {opponent_san}. ",
+)
+
+def get_final_classification(f, facts):
+    branch = f['branch']
+
+    if branch == 'forced':
+        return 'best'
+    elif branch == 'good':
+        if 'sacrifice' in facts:
+            return 'brilliant'
+        return 'best' if f['is_best'] else f['classification']
+    elif branch == 'continues gets mated':
+        return 'best' if f['is_best'] else 'good'
+    elif branch in ['gets mated', 'lost mate']:
+        return 'blunder'
+    elif (branch == 'mates') and (f['mate_sequence_n'] is not None):
+        if f['is_best']:
+            return 'best'
+        if 'faster_mate' in facts:
+            return 'good'
+
+    return f['classification']
+
+def analyse_move(board: chess.Board, move, previous_review: str, check_if_opening=False, evaluations=None):
+    # returns the classification, the facts to render in order and the best move
+    features = MoveFeatures(board, move, previous_review, check_if_opening, evaluations)
+
+    best_move = features['best_move']
+
+    if features['opening'] is not None:
+        return 'book', [('book', {'opening': features['opening']})], best_move
+    elif features['is_book_move']:
+        return 'book', [('book_move', {})], best_move
+
+    branch = features['branch']
+
+    # every rule of the branch adds its own fact, so all of them run
+    found = dict()
+    facts = []
+    for name, rule_branch, function in REVIEW_RULES:
+        if rule_branch != branch:
+            continue
+        with tracing.span(name, 'rule'):
+            data = function(features)
+        if data is not None:
+            found[name] = data
+            facts.append((name, data))
+
+    return get_final_classification(features, found), facts, best_move
+
+def render_review(facts, phrases=REVIEW_PHRASES):
     review = ''
+    for name, data in facts:
+        if name == 'sacrifice':
+            # a sacrifice upgrades the verdict that is already written
+            review = review.replace('best', 'brilliant')
+            review = review.replace('good', 'brilliant')
+            review = review.replace('excellent', 'brilliant')
+        review += phrases[name].format(**data)
+    return review
 
-    best_move = get_best_move(board)
-
-    if check_if_opening:
-        opening = search_opening(openings_df, get_board_pgn(position_after_move))
-        if opening is not None:
-            review = f'This is a book move. The opening is called {opening}. '
-            return 'book', review, best_move, board.san(best_move)
-    
-    move_classication = classify_move(board, move)
-
-    if move_classication in ['excellent', 'good']:
-
-        if move == best_move:
-            move_classication = "best"
-            
-        review += f'{board.san(move)} is {move_classication}. '
-        
-        trade = False
-
-        if is_possible_trade(board, move) and not move_is_discovered_check(board, move):
-            if board.is_capture(move):
-                review += 'This is a trade. '
-            else:
-                review += 'This offers a trade. '
-            trade = True
-
-        defended_pieces = move_defends_hanging_piece(board, move, return_list_defended=True)
-        defended_squares = [chess.square_name(s) for s in defended_pieces]
-        defended_pieces = [piece_dict[str(board.piece_at(s)).lower()] for s in defended_pieces]
-
-        if 'King' in defended_pieces:
-            ki = defended_pieces.index('King')
-            del defended_pieces[ki]
-            del defended_squares[ki]
+def review_move(board: chess.Board, move, previous_review: str, check_if_opening=False):
+    move_classication, facts, best_move = analyse_move(board, move, previous_review, check_if_opening)
+    return move_classication, render_review(facts, REVIEW_PHRASES), best_move, board.san(best_move)
 
-        if (len(defended_pieces) > 0) and (trade == False):
-            
-            review += f'This defends a {format_item_list(defended_pieces)} on {format_item_list(defended_squares)}. '
+def roast_move(board: chess.Board, move, previous_review: str, check_if_opening=False):
+    move_classication, facts, best_move = analyse_move(board, move, previous_review, check_if_opening)
+    return move_classication, render_review(facts, ROAST_PHRASES), best_move, board.san(best_move)
 
-        possible_forked_squares = move_creates_fork(board, move, return_forked_squares=True)
-        if len(possible_forked_squares) >= 2:
-            forked_pieces = [piece_dict[str(board.piece_at(s)).lower()] for s in possible_forked_squares]
-            review += f'This creates a fork on {format_item_list(forked_pieces)}. '
-        else:
-            possible_attakced_piece = move_attacks_piece(board, move, return_attacked_piece=True)
-            if possible_attakced_piece is not False:
-                review += f'This attacks the {piece_dict[str(possible_attakced_piece).lower()]}. '
 
+def get_board_pgn(board: chess.Board):
+    game = chess.pgn.Game()
+    node = game
 
-        if move_blocks_check(board, move):
-            review += f'This blocks a check to the king with a piece. '
+    # Replay all moves.
+    for move in board.move_stack:
+        node = node.add_variation(move)
 
-        developing = is_developing_move(board, move)
-        if developing is not False:
-            review += f'This develops a {piece_dict[developing.lower()]}. '
-        
-        if is_fianchetto(board, move):
-            review += 'This fianchettos the bishop by putting it on a powerful diagonal. '
+    # Add game result.
 
-        if move_pins_opponent(board, move):
-            review += 'This pins a piece of the opponent to their king. '
+    return str(game.mainline_moves())
 
-        if moves_rook_to_open_file(board, move):
-            review += "By placing the rook on an open file, it controls important columns. "
+def move_detector(previous_review=None, in_book=True):
+    # reviews the moves of a game one after another, each review depends on the one before it,
+    # a game reviewed from the middle starts with the review of the move before and whether it was still in book
 
-        if is_endgame(board):
-            if move_moves_king_off_backrank(board, move):
-                review += "By moving the king off the back rank, the risk of back rank mate threats is reduced and improve the king's safety. "
+    evaluations = dict()
 
-        if move_wins_tempo(board, move):
-            review += 'This move gains a tempo. '
+    # only 2 openings have more than 12 moves, but rather than stopping at a fixed ply
+    # keep looking up openings until the game reaches a position that no opening passes through
 
-        if 'trade' not in previous_review:
+    def detect_move(board: chess.Board, move):
+        nonlocal previous_review, in_book
 
-            if move_captures_higher_piece(board, move):
-                review += f'This captures a higher value piece. '
+        check_if_opening = in_book
 
-            if 'higher value piece' not in previous_review:
-                if move_captures_free_piece(board, move):
-                    review += f'This captures a free {piece_dict[str(board.piece_at(move.to_square)).lower()]}. '
+        with tracing.span(lambda: f'ply {board.ply() + 1}', 'ply', move=move.uci):
+            classification, facts, uci_best_move = analyse_move(board, move, previous_review, check_if_opening, evaluations)
+            if classification not in ['book', 'best']:
+                with tracing.span('best move', 'ply', move=uci_best_move.uci):
+                    _, best_facts, _ = analyse_move(board, uci_best_move, previous_review, check_if_opening, evaluations)
+            else:
+                best_facts = None
 
-        attacked_squares_with_check = move_is_discovered_check_and_attacks(board, move, return_attacked_squares=True)
-        if len(attacked_squares_with_check) > 0:
-            attacked_pieces_with_check = [board.piece_at(s) for s in attacked_squares_with_check]
-            attacked_pieces_with_check = [piece_dict[str(p).lower()] for p in attacked_pieces_with_check]
-            review += f'This creates a discovered check whilst attacking a {format_item_list(attacked_pieces_with_check)}. '
+        # the rules only look for wording that the roast phrases share with the normal ones,
+        # so the normal review can stand in for either mode
+        previous_review = render_review(facts, REVIEW_PHRASES)
 
-        trapped_squares = move_traps_opponents_piece(board, move, return_trapped_squares=True)
-        if len(trapped_squares) > 0:
-            trapped_pieces = [board.piece_at(s) for s in trapped_squares]
-            trapped_pieces = [piece_dict[str(p).lower()] for p in trapped_pieces]
-            review += f'This traps a {format_item_list(trapped_pieces)}. '
+        if in_book:
+            position_after_move = board.copy()
+            position_after_move.push(move)
+            in_book = is_book_position(position_after_move)
 
-        if is_possible_sacrifice(board, move):
-            #if move_classication != 'good':
-            move_classication = 'brilliant'
-            review = review.replace('best', 'brilliant')
-            review = review.replace('good', 'brilliant')
-            review = review.replace('excellent', 'brilliant')
-            review += f'This sacrifices the {piece_dict[str(board.piece_at(move.from_square)).lower()]}. '
+        return classification, facts, best_facts, uci_best_move, board.san(uci_best_move)
 
-        if move_threatens_mate(board, move):
-            review += 'This creates a checkmate threat. '
+    return detect_move
 
+def render_move_analysis(classification, facts, best_facts, uci_best_move, san_best_move):
+    # the normal and the roast review of a move, switching modes only picks the other one
+    best_review = render_review(best_facts, REVIEW_PHRASES) if best_facts is not None else ''
+    reviews = {roast: (render_review(facts, ROAST_PHRASES if roast else REVIEW_PHRASES), best_review) for roast in [False, True]}
+    return classification, facts, best_facts, uci_best_move, san_best_move, reviews
 
-    elif move_classication in ['inaccuracy', 'mistake', 'blunder']:
+def analyse_game(uci_moves):
+    # the facts and reviews of every move and of its best move
 
-        review += f'{board.san(move)} is {move_classication}. '
+    board = chess.Board()
+    detect_move = move_detector()
 
-        possible_hanging_squares = []
-        if ('creates a fork' not in previous_review) or (not board.is_check()) or ('trade' not in previous_review) or ('lower value' not in previous_review):
-            possible_hanging_squares = move_hangs_piece(board, move, return_hanging_squares=True)
+    move_analyses = []
 
-            if is_possible_trade(board, move):
-                if move.to_square in possible_hanging_squares:
-                    del possible_hanging_squares[possible_hanging_squares.index(move.to_square)]
+    for i, move in enumerate(progress_bar(uci_moves)):
 
-            possible_hanging_squares = [s for s in possible_hanging_squares if position_after_move.piece_at(s).color == board.turn]
-            if len(possible_hanging_squares) > 0:
-                hanging_squares = [chess.square_name(s) for s in possible_hanging_squares]
-                hanging_pieces = [piece_dict[str(position_after_move.piece_at(s)).lower()] for s in possible_hanging_squares]
-                review += f'This IS SO STUPID. {format_item_list(hanging_pieces)} is fucking hanging on {format_item_list(hanging_squares)}. '
+        check_cancelled()
+        prefetch_from(i)
 
-        capturable_pieces_by_lower = check_for_capturable_pieces_by_lower(position_after_move)
-        capturable_pieces_by_lower = [s for s in capturable_pieces_by_lower if s not in possible_hanging_squares]
+        move_analyses.append(render_move_analysis(*detect_move(board, move)))
 
-        if (len(capturable_pieces_by_lower) > 0) and (not position_after_move.is_check()) and (not is_possible_trade(board, move)):
-            capturable_pieces_by_lower = [piece_dict[str(position_after_move.piece_at(s)).lower()] for s in capturable_pieces_by_lower]
-            review += f'A lower value is piece just STARING at {format_item_list(capturable_pieces_by_lower)}. How the fuck can you let that happen? '
+        board.push(move)
 
-        possible_forking_moves = move_allows_fork(board, move, return_forking_moves=True)
-        
-        if get_best_move(position_after_move) in possible_forking_moves:
-            review += 'Forky forky forky YOU CAN GET FORKED YOU DUMBASS! '
-
-        missed_forks = move_misses_fork(board, move, return_forking_moves=True)
-        if (best_move in missed_forks) and (move != best_move):
-            review += f'Are you blind? You could have forked with {board.san(best_move)}. Smh. '
-
-        missed_pins = move_misses_pin(board, move, return_pin_move=True)
-        if (best_move in missed_pins) and (move != best_move):
-            review += f"Just another missed pin with {board.san(best_move)} because of stupidity. "
-
-        missed_free_captures = move_misses_free_piece(board, move, return_free_captures=True)
-        if len(missed_free_captures) > 0:
-            if (best_move in missed_free_captures) and (move != best_move):
-                review += f"Can this get any more annoying? You could have taken a {piece_dict[str(board.piece_at(best_move.to_square)).lower()]}. "
-
-        lets_opponent_play_move = get_best_move(position_after_move)
-
-        if move_threatens_mate(board, best_move):
-            review += "Is this person trying to lose? They could've threatened a fucking forced checkmate. "
-
-        missed_attacked_piece = move_attacks_piece(board, best_move, return_attacked_piece=True)
-        if missed_attacked_piece is not False:
-            review += f'This missed attacking {piece_dict[str(missed_attacked_piece).lower()]} with {board.san(best_move)} because they were too pussy. '
-
-        if move_attacks_piece(position_after_move, lets_opponent_play_move):
-            review += f"You're just asking the opponent to attack one of your pieces. "
-
-        attacked_squares_with_check = move_is_discovered_check_and_attacks(position_after_move, lets_opponent_play_move, return_attacked_squares=True)
-        if len(attacked_squares_with_check) > 0:
-            attacked_pieces_with_check = [position_after_move.piece_at(s) for s in attacked_squares_with_check]
-            attacked_pieces_with_check = [piece_dict[str(p).lower()] for p in attacked_pieces_with_check]
-            review += f'This dumbass looses a {format_item_list(attacked_pieces_with_check)} from a discovered check. '
-
-        missed_attacked_squares_with_check = move_is_discovered_check_and_attacks(board, best_move, return_attacked_squares=True)
-        if len(missed_attacked_squares_with_check) > 0:
-            missed_attacked_pieces_with_check = [board.piece_at(s) for s in missed_attacked_squares_with_check]
-            missed_attacked_pieces_with_check = [piece_dict[str(p).lower()] for p in missed_attacked_pieces_with_check]
-            review += f'Understandable that a moron would lose a chance to attack a {format_item_list(missed_attacked_pieces_with_check)} from a discovered check. '
-
-        if not (len(attacked_squares_with_check) > 0):
-            trapped_squares = move_traps_opponents_piece(position_after_move, lets_opponent_play_move, return_trapped_squares=True)
-            if len(trapped_squares) > 0:
-                trapped_pieces = [position_after_move.piece_at(s) for s in trapped_squares]
-                trapped_pieces = [piece_dict[str(p).lower()] for p in trapped_pieces]
-                review += f"That's so hilarious! A {format_item_list(trapped_pieces)} can get trapped. "
-
-        missed_trapped_squares = move_traps_opponents_piece(board, best_move, return_trapped_squares=True)
-        if len(missed_trapped_squares) > 0:
-            missed_trapped_pieces = [board.piece_at(s) for s in missed_trapped_squares]
-            missed_trapped_pieces = [piece_dict[str(p).lower()] for p in missed_trapped_pieces]
-            review += f"Why did you let a {format_item_list(missed_trapped_pieces)} escape?? You could've trapped them you dumb fuck. "
-
-        if move_wins_tempo(position_after_move, lets_opponent_play_move):
-            review += f'Sigh. You just let the opponent win a tempo. '
-
-        review += f"The opponent can play {position_after_move.san(lets_opponent_play_move)}. "
-
-    elif 'continues gets mated' in move_classication:
-        losing_side = 'White' if board.turn else 'Black'
-        review += f"{board.san(move)} is good, but {losing_side} will still get checkmated. {losing_side} gets mated in {move_classication[-1]}."
-        if move == best_move:
-            move_classication = "best"
-        else:
-            move_classication = 'good'
+    return move_analyses
 
-    elif 'gets mated' in move_classication:
-        lets_opponent_play_move = get_best_move(position_after_move)
+REVIEW_PIPELINE_STATS = dict() # pipeline.StageStats of every review stage, shared by all reviews
 
-        losing_side = 'White' if board.turn else 'Black'
-        review += f'The opponent can play {position_after_move.san(lets_opponent_play_move)}. '
-        review += f"{board.san(move)} is a blunder. You tryna sacrifice the game? {losing_side} gets mated in {move_classication[-1]}."
+def search_move_positions(item):
+    # the searches the detection of a move will ask for, made by several engines ahead of it
+    board, move = item
 
-        move_classication = 'blunder'
-    
-    elif 'lost mate' in move_classication:
-        lets_opponent_play_move = get_best_move(position_after_move)
-        review += f"You were winning! Why did you do that? I guess that's expected for a someone with a small brain to lose a checkmate sequence. The opponent can play {position_after_move.san(lets_opponent_play_move)}. "
-        move_classication = 'blunder'
-
-    elif 'mates' in move_classication:
-        n = previous_review[-2] # ex. "White gets mated in 6." we need the number 6
-        if n.isdigit(): # means that player is continuing checkmate sequence
-
-            if int(move_classication[-1]) <= int(n): # means player is one move less away from mating
-                winning_side = 'White' if board.turn else 'Black'
-                if int(move_classication[-1]) == 0:
-                    review += f"Checkmate!"
-                else:
-                    review += f"{board.san(move)} continues the checkmate sequence. {winning_side} gets mated in {move_classication[-1]}."
-            
-            else:
-                winning_side = 'White' if board.turn else 'Black'
-                review += f"{board.san(move)} is good, but there was a faster way to checkmate. {winning_side} gets mated in {move_classication[-1]}."
-                move_classication = 'good'
+    if move not in get_book_moves(board):
+        with tracing.span(lambda: f'ply {board.ply() + 1}', 'search ahead', move=move.uci):
+            info = analyse_position(board)
 
-            if move == best_move:
-                move_classication = "best"
+            position_after_move = board.copy(stack=False)
+            position_after_move.push(move)
+            analyse_position(position_after_move)
 
-    
-    return move_classication, review, best_move, board.san(best_move)
+            if info.get('pv'):
+                position_after_best_move = board.copy(stack=False)
+                position_after_best_move.push(info['pv'][0])
+                analyse_position(position_after_best_move)
 
+    return item
 
-def get_board_pgn(board: chess.Board):
-    game = chess.pgn.Game()
-    node = game
+def review_pipeline(prefix_moves=(), prefix_analyses=()):
+    # replay -> analyse -> detect -> render, searches run on ENGINE_POOL_SIZE engines while the
+    # python-chess detectors work through the moves in order, the moves after prefix_moves when
+    # the analyses of those are already known
+    board = chess.Board()
+    in_book = True
+    for move in prefix_moves:
+        board.push(move)
+        in_book = in_book and is_book_position(board)
 
-    # Replay all moves.
-    for move in board.move_stack:
-        node = node.add_variation(move)
+    def replay_move(move):
+        check_cancelled()
+        position = board.copy()
+        board.push(move)
+        return position, move
 
-    # Add game result.
+    previous_review = render_review(prefix_analyses[-1][1], REVIEW_PHRASES) if len(prefix_analyses) > 0 else None
+    detect_move = move_detector(previous_review, in_book)
 
-    return str(game.mainline_moves())
+    return pipeline.Pipeline([
+        pipeline.Stage('replay', replay_move, ordered=True, queue_size=PREFETCH_PLIES),
+        pipeline.Stage('analyse', search_move_positions, workers=ENGINE_POOL_SIZE, queue_size=PREFETCH_PLIES),
+        pipeline.Stage('detect', lambda item: detect_move(*item), ordered=True, queue_size=PREFETCH_PLIES),
+        pipeline.Stage('render', lambda analysis: render_move_analysis(*analysis), queue_size=PREFETCH_PLIES),
+    ], REVIEW_PIPELINE_STATS)
 
-def review_game(uci_moves, roast=False, verbose=False):
+def get_review_pipeline_stats():
+    # queue depth and throughput of every review stage
+    return {name: stats.snapshot() for name, stats in REVIEW_PIPELINE_STATS.items()}
 
-    board = chess.Board()
+def render_game_review(uci_moves, move_analyses, roast=False, verbose=False):
 
     san_best_moves = []
     uci_best_moves = []
@@ -1802,27 +2965,8 @@ def review_game(uci_moves, roast=False, verbose=False):
     review_list = []
     best_review_list = []
 
-
-    for i, move in enumerate(tqdm(uci_moves)):
-
-        if i < 11:
-            check_if_opening = True
-        else:
-            check_if_opening = False
-
-        if len(review_list) == 0:
-            previous_review = None
-        else:
-            previous_review = review_list[-1]
-
-        if roast:
-            classification, review, uci_best_move, san_best_move = roast_move(board, move, previous_review, check_if_opening)
-        else:
-            classification, review, uci_best_move, san_best_move = review_move(board, move, previous_review, check_if_opening)
-        if classification not in ['book', 'best']:
-            _, best_review, _, _ = review_move(board, uci_best_move, previous_review, check_if_opening)
-        else:
-            best_review = ''
+    for move, (classification, _, _, uci_best_move, san_best_move, reviews) in zip(uci_moves, move_analyses):
+        review, best_review = reviews[roast]
 
         classification_list.append(classification)
         review_list.append(review)
@@ -1838,10 +2982,17 @@ def review_game(uci_moves, roast=False, verbose=False):
             print(' | ', end='')
             print(best_review)
             print('')
-        board.push(move)
 
     return review_list, best_review_list, classification_list, uci_best_moves, san_best_moves
 
+def review_game(uci_moves, roast=False, verbose=False):
+    with review_stage('total'):
+        move_analyses = analyse_game(uci_moves)
+        with review_stage('render'):
+            review = render_game_review(uci_moves, move_analyses, roast, verbose)
+    GAMES_REVIEWED.inc('roast' if roast else 'review')
+    return review
+
 def seperate_squares_in_move_list(uci_moves: list):
     seperated_squares = []
 
@@ -1851,26 +3002,394 @@ def seperate_squares_in_move_list(uci_moves: list):
 
     return seperated_squares
 
-@lru_cache(maxsize=128)
-def pgn_game_review(pgn_data: str, roast: bool, limit_type: str, time_limit: float, depth_limit: int):
-    global STOCKFISH_CONFIG
-    
+REVIEW_FORMAT_VERSION = 1 # part of every review key, bump it when the reviews change for the same game
+
+def get_review_limit(limit_type: str, time_limit: float, depth_limit: int):
+    # with the budget limit time_limit is the time of the whole review, not of every search
     if limit_type == "time":
-        STOCKFISH_CONFIG = {'time': float(time_limit)}
+        return {'time': float(time_limit)}
+    elif limit_type == "budget":
+        if float(time_limit) <= 0:
+            raise ValueError('the time budget must be positive')
+        return {'budget': float(time_limit)}
+    else:
+        return {'depth': int(depth_limit)}
+
+def normalize_review_request(pgn_data: str, roast: bool, limit_type: str, time_limit: float, depth_limit: int):
+    # only what changes the review, the same game with other headers, comments or spacing is the same request
+    game = chess.pgn.read_game(io.StringIO(pgn_data))
+    if (game is None) or (len(game.errors) > 0):
+        raise ValueError('could not read the PGN')
+
+    moves = [move.uci() for move in game.mainline_moves()]
+    if len(moves) == 0:
+        raise ValueError('the game has no moves')
+
+    return {'moves': moves, 'limit': get_review_limit(limit_type, time_limit, depth_limit), 'roast': bool(roast)}
+
+def get_review_key(normalized_request):
+    data = json.dumps([REVIEW_FORMAT_VERSION, normalized_request], sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(data.encode()).hexdigest()
+
+class ReviewQueueFull(Exception):
+
+    def __init__(self, retry_after):
+        super().__init__(f'too many reviews waiting, retry in {retry_after}s')
+        self.retry_after = retry_after
+
+class SharedCounts:
+    # running games by class in shared memory, seen by every worker process forked after it is made
+
+    def __init__(self, names, context):
+        self.names = list(names)
+        self.counts = context.Array('i', len(self.names))
+        self.lock = self.counts.get_lock()
+
+    def __getitem__(self, name):
+        return self.counts[self.names.index(name)]
+
+    def __setitem__(self, name, value):
+        self.counts[self.names.index(name)] = value
+
+    def values(self):
+        return self.counts[:]
+
+class ReviewScheduler:
+    # admits games to the engines: at most max_running at once and per class, the rest wait in a
+    # bounded queue where the highest priority class that has room goes first, a full queue is
+    # refused straight away with an estimate of when to retry
+
+    def __init__(self, classes=REVIEW_CLASSES, max_running=MAX_RUNNING_REVIEWS, max_queued=MAX_QUEUED_REVIEWS):
+        self.classes = classes
+        self.max_running = max_running
+        self.max_queued = max_queued
+        self.condition = threading.Condition()
+        self.running = Counter()
+        self.running_lock = nullcontext() # the condition is enough while the counts are not shared
+        self.poll_seconds = None
+        self.waiting = []
+        self.tickets = 0
+        self.average_seconds = 30.0
+        self.stats = Counter() # 'admitted' and 'rejected' per class
+
+    def has_room(self, review_class):
+        return (sum(self.running.values()) < self.max_running) and (self.running[review_class] < self.classes[review_class]['max_running'])
+
+    def is_next(self, ticket):
+        for other in self.waiting:
+            if other == ticket:
+                return True
+            if self.has_room(other[2]):
+                return False
+        return False
+
+    def share(self, context):
+        # called before the worker processes are forked: the running games are counted in shared
+        # memory so max_running and the class limits hold for the whole server, the queue stays per
+        # worker and a waiting review checks every poll_seconds for games ended in another worker
+        self.running = SharedCounts(self.classes, context)
+        self.running_lock = self.running.lock
+        self.poll_seconds = SHARED_POLL_SECONDS
+
+    def start(self, review_class, ticket):
+        # takes a running slot for the ticket when it is next and there is room
+        with self.running_lock:
+            if self.has_room(review_class) and self.is_next(ticket):
+                self.running[review_class] += 1
+                return True
+        return False
+
+    def wake(self):
+        with self.condition:
+            self.condition.notify_all()
+
+    def get_retry_after(self):
+        return max(1, round(self.average_seconds * (len(self.waiting) + 1) / self.max_running))
+
+    @contextmanager
+    def admit(self, review_class='interactive'):
+        if review_class not in self.classes:
+            raise ValueError(f'unknown review class {review_class!r}')
+
+        # a review cancelled while it waits leaves the queue
+        cancellation = ACTIVE_CANCELLATION.get()
+        remove_callback = cancellation.on_cancel(self.wake) if cancellation is not None else None
+
+        try:
+            with self.condition:
+                if (len(self.waiting) >= self.max_queued) and not self.has_room(review_class):
+                    self.stats[f'rejected {review_class}'] += 1
+                    raise ReviewQueueFull(self.get_retry_after())
+
+                self.tickets += 1
+                ticket = (self.classes[review_class]['priority'], self.tickets, review_class)
+                self.waiting.append(ticket)
+                self.waiting.sort()
+
+                queued = time.perf_counter()
+                with tracing.span('queue', 'stage', review_class=review_class):
+                    while not self.start(review_class, ticket):
+                        if (cancellation is not None) and cancellation.is_cancelled():
+                            self.waiting.remove(ticket)
+                            self.stats[f'cancelled {review_class}'] += 1
+                            self.condition.notify_all()
+                            raise ReviewCancelled(cancellation.reason)
+                        self.condition.wait(self.poll_seconds)
+
+                self.waiting.remove(ticket)
+                self.stats[f'admitted {review_class}'] += 1
+        finally:
+            # also when the queue is full or the review is cancelled
+            if remove_callback is not None:
+                remove_callback()
+
+        start = time.perf_counter()
+        REVIEW_SECONDS.observe(start - queued, 'queue')
+        try:
+            yield
+        finally:
+            with self.condition:
+                with self.running_lock:
+                    self.running[review_class] -= 1
+                self.average_seconds = 0.8 * self.average_seconds + 0.2 * (time.perf_counter() - start)
+                self.condition.notify_all()
+
+REVIEW_SCHEDULER = ReviewScheduler()
+REVIEW_CLASS = contextvars.ContextVar('REVIEW_CLASS', default='interactive')
+REVIEW_SEARCH_STATS = Counter() # 'plies' and 'searches' of the finished analyses
+
+def get_searches_per_ply():
+    if REVIEW_SEARCH_STATS['plies'] == 0:
+        return 3 # the position before the move, after it and after the best move
+    return REVIEW_SEARCH_STATS['searches'] / REVIEW_SEARCH_STATS['plies']
+
+def record_cancelled_review(plies, searches):
+    # the rest of the game would have needed as many searches per ply as the finished analyses
+    CANCELLATION_STATS['reviews'] += 1
+    skipped = max(0, round(plies * get_searches_per_ply()) - searches)
+    CANCELLATION_STATS['searches skipped'] += skipped
+    CANCELLATION_STATS['engine seconds saved'] += skipped * get_engine_pool().get_average_search_seconds()
+
+@lru_cache(maxsize=128)
+def analyse_pgn(uci_moves: tuple, limit_items: tuple):
+    # everything that needs the engine, shared by the normal and the roast review of a game,
+    # cached on the normalized request so other headers or '5' for 5 still find the analysis
+    with REVIEW_SCHEDULER.admit(REVIEW_CLASS.get()), review_stage('analysis'):
+        return analyse_admitted_pgn(list(uci_moves), dict(limit_items))
+
+class ReviewedGames:
+    # the per-ply results of the last analysed games: move analyses with their facts and reviews,
+    # scores and CPLs, and every search made, the moves of a game only depend on the plies before them
+
+    def __init__(self, size=REVIEWED_GAMES_SIZE):
+        self.size = size
+        self.lock = threading.Lock()
+        self.games = OrderedDict() # (limit, moves) -> results, least recently used first
+        self.stats = Counter() # 'reused' and 'analysed' plies
+
+    def find(self, limit_key, uci_moves):
+        # the number of first plies shared with the earlier game that has the most of them, and its results
+        best, best_results = 0, None
+        with self.lock:
+            for (game_limit_key, moves), results in self.games.items():
+                if game_limit_key != limit_key:
+                    continue
+                shared = 0
+                for move, other in zip(uci_moves, moves):
+                    if move != other:
+                        break
+                    shared += 1
+                if shared > best:
+                    best, best_results = shared, results
+        return best, best_results
+
+    def add(self, limit_key, uci_moves, results, reused=0):
+        key = (limit_key, tuple(uci_moves))
+        with self.lock:
+            self.games[key] = results
+            self.games.move_to_end(key)
+            while len(self.games) > self.size:
+                self.games.popitem(last=False)
+            self.stats['reused'] += reused
+            self.stats['analysed'] += len(uci_moves) - reused
+
+    def clear(self):
+        with self.lock:
+            self.games.clear()
+
+REVIEWED_GAMES = ReviewedGames()
+
+def analyse_admitted_pgn(uci_moves: list, limit: dict):
+    start = time.monotonic()
+
+    uci_moves, san_moves, fens, metrics = replay_moves([chess.Move.from_uci(move) for move in uci_moves])
+
+    # an edited game only analyses the plies from the first move that differs from an earlier game
+    limit_key = json.dumps(limit, sort_keys=True)
+    reused, earlier = REVIEWED_GAMES.find(limit_key, uci_moves)
+    if earlier is not None:
+        prefix_analyses = earlier['move_analyses'][:reused]
+        prefix_cpl = (earlier['scores'][:reused], earlier['cpls_white'][:(reused + 1) // 2], earlier['cpls_black'][:reused // 2])
+        searches = earlier['searches']
     else:
-        STOCKFISH_CONFIG = {'depth': int(depth_limit)}
+        prefix_analyses, prefix_cpl, searches = [], None, None
+
+    budget = None
+    if 'budget' in limit:
+        budget = SearchBudget(uci_moves, start + limit['budget'] * BUDGET_ENGINE_SHARE, first_ply=reused)
+
+    # the limit is handed over as games analysed at the same time may have other limits
+    try:
+        with prefetching(uci_moves, dict(limit), budget, searches) as prefetcher:
+            with review_stage('moves'):
+                move_analyses = prefix_analyses + review_pipeline(uci_moves[:reused], prefix_analyses).run(progress_bar(uci_moves[reused:]))
+            # every position the CPL needs has been searched by the review
+            with review_stage('cpl'):
+                scores, cpls_white, cpls_black, average_cpl_white, average_cpl_black = compute_cpl(uci_moves, prefix_cpl)
+    except ReviewCancelled:
+        record_cancelled_review(len(uci_moves) - reused, prefetcher.searches)
+        raise
+    REVIEW_SEARCHES.observe(prefetcher.searches)
+    REVIEW_SEARCH_STATS['plies'] += len(uci_moves) - reused
+    REVIEW_SEARCH_STATS['searches'] += prefetcher.searches
+
+    REVIEWED_GAMES.add(limit_key, uci_moves, {
+        'move_analyses': move_analyses,
+        'scores': scores,
+        'cpls_white': cpls_white,
+        'cpls_black': cpls_black,
+        'searches': prefetcher.get_searches(),
+    }, reused)
 
-    uci_moves, san_moves, fens = parse_pgn(pgn_data)
-    scores, cpls_white, cpls_black, average_cpl_white, average_cpl_black = compute_cpl(uci_moves)
     n_moves = len(scores)//2
     white_elo_est, black_elo_est = estimate_elo(average_cpl_white, n_moves), estimate_elo(average_cpl_black, n_moves)
     white_acc, black_acc = calculate_accuracy(scores)
-    devs, mobs, tens, conts = calculate_metrics(fens)
+    devs, mobs, tens, conts = split_game_metrics(metrics)
 
-    review_list, best_review_list, classification_list, uci_best_moves, san_best_moves = review_game(uci_moves, roast)
+    return (
+                uci_moves,
+                san_moves,
+                fens,
+                scores,
+                move_analyses,
+                devs,
+                tens,
+                mobs,
+                conts,
+                white_acc,
+                black_acc,
+                white_elo_est,
+                black_elo_est,
+                average_cpl_white,
+                average_cpl_black
+            )
+
+class SingleFlight:
+    # concurrent calls with the same key wait for the first one and all get its result,
+    # the call is only cancelled once every caller waiting for it has been cancelled
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = dict()
+        self.stats = Counter() # 'computed' calls and 'coalesced' calls that waited for one
+
+    def do(self, key, function, *args, cancellation=None):
+        with self.lock:
+            flight = self.calls.get(key)
+            leader = (flight is None) or flight['cancellation'].is_cancelled()
+            if leader:
+                flight = {'future': Future(), 'cancellation': Cancellation(), 'callers': 0}
+                self.calls[key] = flight
+                self.stats['computed'] += 1
+            else:
+                self.stats['coalesced'] += 1
+            flight['callers'] += 1
+
+        future = flight['future']
+        given_up = Future()
+        remove_callback = None
+        if cancellation is not None:
+            remove_callback = cancellation.on_cancel(partial(self.leave, flight, cancellation, given_up))
+
+        if leader:
+            token = ACTIVE_CANCELLATION.set(flight['cancellation'])
+            try:
+                future.set_result(function(*args))
+            except BaseException as error:
+                future.set_exception(error)
+            finally:
+                ACTIVE_CANCELLATION.reset(token)
+                with self.lock:
+                    if self.calls.get(key) is flight:
+                        del self.calls[key]
+        else:
+            wait([future, given_up], return_when=FIRST_COMPLETED)
+
+        if remove_callback is not None:
+            remove_callback()
+        if not future.done():
+            raise ReviewCancelled(cancellation.reason)
+        return future.result()
+
+    def leave(self, flight, cancellation, given_up):
+        with self.lock:
+            flight['callers'] -= 1
+            abandoned = flight['callers'] == 0
+        given_up.set_result(None)
+        if abandoned:
+            flight['cancellation'].cancel(cancellation.reason)
+
+REVIEW_FLIGHTS = SingleFlight()
+
+RUNNING_REVIEWS = dict() # review id chosen by the client -> Cancellation of its running review
+RUNNING_REVIEWS_LOCK = threading.Lock()
+
+@contextmanager
+def cancellable_review(review_id=None):
+    # with cancellable_review('abc') as cancellation: pgn_game_review(..., cancellation=cancellation)
+    cancellation = Cancellation()
+    if review_id is not None:
+        with RUNNING_REVIEWS_LOCK:
+            RUNNING_REVIEWS[review_id] = cancellation
+    try:
+        yield cancellation
+    finally:
+        if review_id is not None:
+            with RUNNING_REVIEWS_LOCK:
+                if RUNNING_REVIEWS.get(review_id) is cancellation:
+                    del RUNNING_REVIEWS[review_id]
+
+def cancel_review(review_id, reason='cancelled by the client'):
+    with RUNNING_REVIEWS_LOCK:
+        cancellation = RUNNING_REVIEWS.get(review_id)
+    if cancellation is None:
+        return False
+    cancellation.cancel(reason)
+    return True
+
+def pgn_game_review(pgn_data: str, roast: bool, limit_type: str, time_limit: float, depth_limit: int, review_class='interactive', cancellation=None):
+    # switching between the normal and the roast review only renders the cached analysis again,
+    # identical games analysed at the same time are only analysed once whatever their mode
+    # raises ReviewQueueFull when too many games are waiting for the engines and ReviewCancelled
+    # when the cancellation is set before the review is done
+    REVIEW_CLASS.set(review_class)
+    analysis_request = normalize_review_request(pgn_data, False, limit_type, time_limit, depth_limit)
+    review_key = get_review_key(analysis_request)
+
+    with review_trace(review_key, roast), review_stage('total'):
+        (
+            uci_moves, san_moves, fens, scores, move_analyses,
+            devs, tens, mobs, conts,
+            white_acc, black_acc, white_elo_est, black_elo_est, average_cpl_white, average_cpl_black
+        ) = REVIEW_FLIGHTS.do(review_key, analyse_pgn, tuple(analysis_request['moves']), tuple(sorted(analysis_request['limit'].items())), cancellation=cancellation)
+
+        with review_stage('render'):
+            review_list, best_review_list, classification_list, uci_best_moves, san_best_moves = render_game_review(uci_moves, move_analyses, roast)
 
     uci_best_moves = seperate_squares_in_move_list(uci_best_moves)
 
+    GAMES_REVIEWED.inc('roast' if roast else 'review')
+
     return (
                 san_moves, 
                 fens, 
@@ -1891,3 +3410,54 @@ def pgn_game_review(pgn_data: str, roast: bool, limit_type: str, time_limit: flo
                 average_cpl_white,
                 average_cpl_black
             )
+
+def get_engine_counts():
+    pool = get_engine_pool()
+    with pool.condition:
+        idle = len(pool.idle)
+        return {('busy',): pool.started - idle, ('idle',): idle}
+
+def get_cache_counts():
+    analysis = analyse_pgn.cache_info()
+    return {
+        ('analysis', 'hit'): analysis.hits,
+        ('analysis', 'miss'): analysis.misses,
+        ('flight', 'hit'): REVIEW_FLIGHTS.stats['coalesced'],
+        ('flight', 'miss'): REVIEW_FLIGHTS.stats['computed'],
+        ('search', 'hit'): PREFETCH_STATS['hit'],
+        ('search', 'miss'): PREFETCH_STATS['miss'],
+    }
+
+def get_queue_counts():
+    counts = dict()
+    with REVIEW_SCHEDULER.condition:
+        waiting = Counter(review_class for _, _, review_class in REVIEW_SCHEDULER.waiting)
+        for review_class in REVIEW_SCHEDULER.classes:
+            counts[(review_class, 'running')] = REVIEW_SCHEDULER.running[review_class]
+            counts[(review_class, 'waiting')] = waiting[review_class]
+    return counts
+
+def get_admission_counts():
+    # the scheduler counts 'admitted interactive', 'rejected batch', 'cancelled batch'...
+    counts = dict()
+    for key, count in REVIEW_SCHEDULER.stats.items():
+        result, review_class = key.split(' ')
+        counts[(review_class, result)] = count
+    return counts
+
+def get_pipeline_counts(field):
+    return {(name,): snapshot[field] for name, snapshot in get_review_pipeline_stats().items()}
+
+monitoring.REGISTRY.observe('gamereview_engines', 'gauge', 'Stockfish processes searching or waiting for a search', ('state',), get_engine_counts)
+monitoring.REGISTRY.observe('gamereview_cache_requests', 'counter', 'Lookups of the analysed games, of the analyses in flight and of the searches of a game', ('cache', 'result'), get_cache_counts)
+monitoring.REGISTRY.observe('gamereview_reviews', 'gauge', 'Games being analysed or waiting for the engines', ('class', 'state'), get_queue_counts)
+monitoring.REGISTRY.observe('gamereview_admissions', 'counter', 'Games admitted to the engines, refused or cancelled while waiting', ('class', 'result'), get_admission_counts)
+monitoring.REGISTRY.observe('gamereview_engine_searches', 'counter', 'Engine searches, by whether the engine last searched the same game', ('game',), lambda: {(key.split(' ')[0],): count for key, count in get_engine_pool().stats.items()})
+monitoring.REGISTRY.observe('gamereview_analysed_plies', 'counter', 'Plies of the analysed games, analysed or reused from an earlier game with the same first moves', ('source',), lambda: {(source,): count for source, count in REVIEWED_GAMES.stats.items()})
+monitoring.REGISTRY.observe('gamereview_cancelled_reviews', 'counter', 'Analyses cancelled because every client waiting for them went away or asked to stop', (), lambda: {(): CANCELLATION_STATS['reviews']})
+monitoring.REGISTRY.observe('gamereview_cancelled_searches', 'counter', 'Engine searches stopped while running or never started because of cancellations', ('state',), lambda: {('stopped',): CANCELLATION_STATS['searches stopped'], ('skipped',): CANCELLATION_STATS['searches skipped']})
+monitoring.REGISTRY.observe('gamereview_cancelled_engine_seconds', 'counter', 'Estimated engine seconds saved by cancellations', (), lambda: {(): CANCELLATION_STATS['engine seconds saved']})
+monitoring.REGISTRY.observe('gamereview_mate_searches', 'counter', 'Mate questions, by what answered them', ('solver',), lambda: {(solver,): count for solver, count in MATE_SEARCHES.items()})
+monitoring.REGISTRY.observe('gamereview_pipeline_busy_seconds', 'counter', 'Seconds the workers of each review pipeline stage spent on moves', ('stage',), partial(get_pipeline_counts, 'busy_seconds'))
+monitoring.REGISTRY.observe('gamereview_pipeline_moves', 'counter', 'Moves through each review pipeline stage', ('stage',), partial(get_pipeline_counts, 'processed'))
+monitoring.REGISTRY.observe('gamereview_pipeline_queued', 'gauge', 'Moves waiting for each review pipeline stage', ('stage',), partial(get_pipeline_counts, 'queued'))
@@ -0,0 +1,142 @@
+import bisect
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+# Counters and histograms kept in memory and written out in the Prometheus text format,
+# numbers that are already kept elsewhere are read when the metrics are collected.
+# Every process has its own, so each production worker reports the reviews it served.
+
+LATENCY_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+COUNT_BUCKETS = (1, 10, 25, 50, 100, 200, 400, 800, 1600)
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for value in labels.values())
+    return '{' + ','.join(f'{name}="{value}"' for name, value in zip(labels, escaped)) + '}'
+
+
+def format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def format_family(name, kind, help_text, samples):
+    # samples are (suffix, labels, value)
+    lines = [f'# HELP {name} {help_text}', f'# TYPE {name} {kind}']
+    lines += [f'{name}{suffix}{format_labels(labels)} {format_value(value)}' for suffix, labels, value in samples]
+    return lines
+
+
+class Counter:
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = labelnames
+        self.lock = threading.Lock()
+        self.values = dict()
+
+    def inc(self, *labelvalues, amount=1):
+        with self.lock:
+            self.values[labelvalues] = self.values.get(labelvalues, 0) + amount
+
+    def collect(self):
+        with self.lock:
+            values = sorted(self.values.items())
+        samples = [('_total', dict(zip(self.labelnames, labelvalues)), value) for labelvalues, value in values]
+        return format_family(self.name, 'counter', self.help_text, samples)
+
+
+class Histogram:
+
+    def __init__(self, name, help_text, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = labelnames
+        self.buckets = tuple(buckets)
+        self.lock = threading.Lock()
+        self.values = dict() # label values -> [bucket counts..., sum]
+
+    def observe(self, value, *labelvalues):
+        with self.lock:
+            counts = self.values.setdefault(labelvalues, [0] * (len(self.buckets) + 1) + [0.0])
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            counts[-1] += value
+
+    @contextmanager
+    def time(self, *labelvalues):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *labelvalues)
+
+    def collect(self):
+        with self.lock:
+            values = sorted((labelvalues, list(counts)) for labelvalues, counts in self.values.items())
+
+        samples = []
+        for labelvalues, counts in values:
+            labels = dict(zip(self.labelnames, labelvalues))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                samples.append(('_bucket', {**labels, 'le': format_value(bound)}, cumulative))
+            samples.append(('_sum', labels, counts[-1]))
+            samples.append(('_count', labels, cumulative))
+        return format_family(self.name, 'histogram', self.help_text, samples)
+
+
+class Observed:
+    # a gauge or counter kept elsewhere, function() returns {label values: value} when collected
+
+    def __init__(self, name, kind, help_text, labelnames, function):
+        self.name = name
+        self.kind = kind
+        self.help_text = help_text
+        self.labelnames = labelnames
+        self.function = function
+
+    def collect(self):
+        suffix = '_total' if self.kind == 'counter' else ''
+        samples = [(suffix, dict(zip(self.labelnames, labelvalues)), value) for labelvalues, value in sorted(self.function().items())]
+        return format_family(self.name, self.kind, self.help_text, samples)
+
+
+class Registry:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.collectors = []
+
+    def register(self, collector):
+        # anything with a collect() returning the lines of its families
+        with self.lock:
+            self.collectors.append(collector)
+        return collector
+
+    def counter(self, name, help_text, labelnames=()):
+        return self.register(Counter(name, help_text, labelnames))
+
+    def histogram(self, name, help_text, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, help_text, labelnames, buckets))
+
+    def observe(self, name, kind, help_text, labelnames, function):
+        return self.register(Observed(name, kind, help_text, labelnames, function))
+
+    def render(self):
+        with self.lock:
+            collectors = list(self.collectors)
+        lines = []
+        for collector in collectors:
+            lines += collector.collect()
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
@@ -0,0 +1,159 @@
+import argparse
+import bisect
+import csv
+import hashlib
+import io
+import mmap
+import struct
+
+import chess
+import chess.pgn
+import chess.polyglot
+
+# Compact binary opening index, built once from openings_master.csv and memory-mapped at runtime
+# so every worker process shares the same pages instead of parsing the CSV into a DataFrame.
+#
+# Layout (little endian, every section padded to 8 bytes):
+#   header          magic, number of sequences, positions and names, size of the name blob
+#   sequence keys   u64, sorted: hash of an opening's moves
+#   sequence names  u32: name id of each sequence key
+#   position keys   u64, sorted: zobrist hash of every position on the way to an opening
+#   position names  u32: name id of the opening reached at that position, NO_NAME for positions in between
+#   name offsets    u32 [names + 1] into the name blob
+#   name blob       utf-8
+
+MAGIC = b'GRBOOK01'
+HEADER = struct.Struct('<8sQQQQ')
+NO_NAME = 0xFFFFFFFF
+
+
+def sequence_key(moves):
+    digest = hashlib.blake2b(' '.join(move.uci() for move in moves).encode(), digest_size=8).digest()
+    return int.from_bytes(digest, 'little')
+
+
+def read_openings_csv(path):
+    with open(path, newline='', encoding='utf-8') as csv_file:
+        for row in csv.DictReader(csv_file):
+            yield row['pgn'], row['name']
+
+
+def padded(data: bytes):
+    return data + b'\0' * (-len(data) % 8)
+
+
+def build_opening_index(rows):
+    names = []
+    name_ids = dict()
+    sequences = dict()
+    positions = dict()
+
+    for pgn, name in rows:
+        game = chess.pgn.read_game(io.StringIO(pgn))
+        if (game is None) or (len(game.errors) > 0):
+            continue
+
+        board = chess.Board()
+        positions.setdefault(chess.polyglot.zobrist_hash(board), NO_NAME)
+        for move in game.mainline_moves():
+            board.push(move)
+            positions.setdefault(chess.polyglot.zobrist_hash(board), NO_NAME)
+
+        if name not in name_ids:
+            name_ids[name] = len(names)
+            names.append(name)
+
+        # the first row wins, like search_opening
+        sequences.setdefault(sequence_key(board.move_stack), name_ids[name])
+        key = chess.polyglot.zobrist_hash(board)
+        if positions[key] == NO_NAME:
+            positions[key] = name_ids[name]
+
+    encoded_names = [name.encode('utf-8') for name in names]
+    name_offsets = [0]
+    for encoded_name in encoded_names:
+        name_offsets.append(name_offsets[-1] + len(encoded_name))
+    name_blob = b''.join(encoded_names)
+
+    sequence_keys = sorted(sequences)
+    position_keys = sorted(positions)
+
+    return b''.join([
+        HEADER.pack(MAGIC, len(sequence_keys), len(position_keys), len(names), len(name_blob)),
+        padded(struct.pack(f'<{len(sequence_keys)}Q', *sequence_keys)),
+        padded(struct.pack(f'<{len(sequence_keys)}I', *[sequences[k] for k in sequence_keys])),
+        padded(struct.pack(f'<{len(position_keys)}Q', *position_keys)),
+        padded(struct.pack(f'<{len(position_keys)}I', *[positions[k] for k in position_keys])),
+        padded(struct.pack(f'<{len(name_offsets)}I', *name_offsets)),
+        name_blob,
+    ])
+
+
+class OpeningIndex:
+
+    def __init__(self, buffer):
+        self.buffer = buffer
+
+        magic, n_sequences, n_positions, n_names, blob_size = HEADER.unpack_from(buffer, 0)
+        if magic != MAGIC:
+            raise ValueError('not an opening index file')
+
+        view = memoryview(buffer)
+        offset = HEADER.size
+
+        def section(count, item_format, item_size):
+            nonlocal offset
+            size = count * item_size
+            data = view[offset:offset + size].cast(item_format)
+            offset += size + (-size % 8)
+            return data
+
+        self.sequence_keys = section(n_sequences, 'Q', 8)
+        self.sequence_names = section(n_sequences, 'I', 4)
+        self.position_keys = section(n_positions, 'Q', 8)
+        self.position_names = section(n_positions, 'I', 4)
+        self.name_offsets = section(n_names + 1, 'I', 4)
+        self.name_blob = view[offset:offset + blob_size]
+
+    def find(self, keys, key):
+        i = bisect.bisect_left(keys, key)
+        if (i < len(keys)) and (keys[i] == key):
+            return i
+        return None
+
+    def name(self, name_id):
+        return bytes(self.name_blob[self.name_offsets[name_id]:self.name_offsets[name_id + 1]]).decode('utf-8')
+
+    def lookup(self, board: chess.Board):
+        i = self.find(self.sequence_keys, sequence_key(board.move_stack))
+        if i is not None:
+            return self.name(self.sequence_names[i])
+
+        i = self.find(self.position_keys, chess.polyglot.zobrist_hash(board))
+        if (i is not None) and (self.position_names[i] != NO_NAME):
+            return self.name(self.position_names[i])
+
+        return None
+
+    def is_book_position(self, board: chess.Board):
+        return self.find(self.position_keys, chess.polyglot.zobrist_hash(board)) is not None
+
+
+def load_opening_index(path):
+    with open(path, 'rb') as index_file:
+        return OpeningIndex(mmap.mmap(index_file.fileno(), 0, access=mmap.ACCESS_READ))
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description="Build the binary opening index from the openings CSV")
+    parser.add_argument("csv", nargs="?", default="openings_master.csv")
+    parser.add_argument("output", nargs="?", default="openings_index.bin")
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = get_args()
+    data = build_opening_index(read_openings_csv(args.csv))
+    with open(args.output, 'wb') as index_file:
+        index_file.write(data)
+    print(f'wrote {len(data)} bytes to {args.output}')
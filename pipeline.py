@@ -0,0 +1,162 @@
+import contextvars
+import queue
+import threading
+import time
+
+# Items go through stages connected by bounded queues, every stage has its own worker threads
+# so a slow stage only holds back the items waiting for it. An ordered stage has a single worker
+# and sees the items in input order, whatever order the stage before finished them in.
+
+DONE = object()
+
+
+class StageStats:
+    # cumulative over every run that shares the stats
+
+    def __init__(self, workers=1):
+        self.lock = threading.Lock()
+        self.workers = workers
+        self.processed = 0
+        self.busy_seconds = 0.0
+        self.queued = 0
+        self.max_queued = 0
+
+    def enqueued(self):
+        with self.lock:
+            self.queued += 1
+            self.max_queued = max(self.max_queued, self.queued)
+
+    def dequeued(self):
+        with self.lock:
+            self.queued -= 1
+
+    def finished(self, seconds):
+        with self.lock:
+            self.processed += 1
+            self.busy_seconds += seconds
+
+    def snapshot(self):
+        with self.lock:
+            # items per second a single worker gets through, the slowest stage has the lowest rate times workers
+            rate = self.processed / self.busy_seconds if self.busy_seconds > 0 else 0.0
+            return {
+                'workers': self.workers,
+                'processed': self.processed,
+                'queued': self.queued,
+                'max_queued': self.max_queued,
+                'busy_seconds': self.busy_seconds,
+                'items_per_second': rate,
+            }
+
+
+class Stage:
+
+    def __init__(self, name, function, workers=1, queue_size=4, ordered=False):
+        if ordered and (workers != 1):
+            raise ValueError(f'ordered stage {name} must have a single worker')
+
+        self.name = name
+        self.function = function
+        self.workers = workers
+        self.queue_size = queue_size
+        self.ordered = ordered
+
+
+class Pipeline:
+
+    def __init__(self, stages, stats=None):
+        self.stages = stages
+        self.stats = stats if stats is not None else dict()
+        for stage in stages:
+            self.stats.setdefault(stage.name, StageStats(stage.workers))
+
+    def put(self, queues, i, item):
+        if i < len(self.stages):
+            self.stats[self.stages[i].name].enqueued()
+        queues[i].put(item)
+
+    def work(self, i, queues, results, errors, remaining, lock):
+        stage = self.stages[i]
+        stats = self.stats[stage.name]
+
+        pending = dict()
+        next_seq = 0
+
+        while True:
+            item = queues[i].get()
+            if item is DONE:
+                break
+            stats.dequeued()
+
+            if stage.ordered:
+                seq, value = item
+                pending[seq] = value
+                ready = []
+                while next_seq in pending:
+                    ready.append((next_seq, pending.pop(next_seq)))
+                    next_seq += 1
+            else:
+                ready = [item]
+
+            for seq, value in ready:
+                # after an error the remaining items are drained so nothing upstream blocks
+                if len(errors) > 0:
+                    continue
+
+                start = time.perf_counter()
+                try:
+                    output = stage.function(value)
+                except BaseException as error:
+                    errors.append(error)
+                    continue
+                stats.finished(time.perf_counter() - start)
+
+                if i + 1 < len(self.stages):
+                    self.put(queues, i + 1, (seq, output))
+                else:
+                    results[seq] = output
+
+        with lock:
+            remaining[i] -= 1
+            last_worker = remaining[i] == 0
+
+        if last_worker and (i + 1 < len(self.stages)):
+            for _ in range(self.stages[i + 1].workers):
+                queues[i + 1].put(DONE)
+
+    def run(self, items):
+        # returns the outputs of the last stage in input order
+        queues = [queue.Queue(maxsize=stage.queue_size) for stage in self.stages]
+        remaining = [stage.workers for stage in self.stages]
+        lock = threading.Lock()
+        results = dict()
+        errors = []
+
+        threads = []
+        for i, stage in enumerate(self.stages):
+            for _ in range(stage.workers):
+                # every worker sees the context variables of the caller
+                context = contextvars.copy_context()
+                thread = threading.Thread(target=context.run, args=(self.work, i, queues, results, errors, remaining, lock), name=f'pipeline-{stage.name}', daemon=True)
+                thread.start()
+                threads.append(thread)
+
+        try:
+            for seq, item in enumerate(items):
+                if len(errors) > 0:
+                    break
+                self.put(queues, 0, (seq, item))
+        finally:
+            for _ in range(self.stages[0].workers):
+                queues[0].put(DONE)
+
+            for thread in threads:
+                thread.join()
+
+        if len(errors) > 0:
+            raise errors[0]
+
+        return [results[seq] for seq in sorted(results)]
+
+    def snapshot(self):
+        return {stage.name: self.stats[stage.name].snapshot() for stage in self.stages}
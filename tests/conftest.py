@@ -0,0 +1,106 @@
+import os
+import struct
+import sys
+import time
+
+import chess
+import chess.engine
+import chess.polyglot
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import chess_review
+
+PIECE_VALUES = {chess.PAWN: 100, chess.KNIGHT: 300, chess.BISHOP: 300, chess.ROOK: 500, chess.QUEEN: 900, chess.KING: 0}
+
+GAME_PGN = "1. e4 e5 2. Nf3 Nc6 3. Bc4 Bc5 4. c3 Nf6 5. d4 exd4 6. cxd4 Bb4+ 7. Nc3 Nxe4 8. O-O Bxc3 9. d5 Bf6 10. Re1 Ne7 11. Rxe4 d6 12. Bg5 Bxg5 *"
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, 'timed out'
+        time.sleep(0.01)
+
+
+def write_polyglot_book(path, lines):
+    # one entry for every move of every line, sorted by position key as Polyglot readers expect
+    entries = set()
+    for line in lines:
+        board = chess.Board()
+        for san in line.split():
+            move = board.parse_san(san)
+            entries.add((chess.polyglot.zobrist_hash(board), move.to_square | (move.from_square << 6)))
+            board.push(move)
+    with open(path, 'wb') as book_file:
+        for key, move in sorted(entries):
+            book_file.write(struct.pack('>QHHI', key, move, 1, 0))
+
+
+def material(board):
+    # centipawns for the side to move
+    return sum(value * (len(board.pieces(piece_type, board.turn)) - len(board.pieces(piece_type, not board.turn))) for piece_type, value in PIECE_VALUES.items())
+
+
+class FakeEngine:
+    # one ply of material counting in place of Stockfish, every searched position is kept in order
+
+    def __init__(self):
+        self.searches = []
+        self.mates = []
+        self.limits = []
+
+    def search(self, board, mate, limit, game=None):
+        self.searches.append(board.fen())
+        self.mates.append(mate)
+        self.limits.append(limit)
+
+        if board.is_checkmate():
+            return {'score': chess.engine.PovScore(chess.engine.Mate(0), board.turn), 'pv': []}
+
+        best = None
+        for move in sorted(board.legal_moves, key=lambda move: move.uci()):
+            board.push(move)
+            if board.is_checkmate():
+                board.pop()
+                return {'score': chess.engine.PovScore(chess.engine.Mate(1), board.turn), 'pv': [move]}
+            value = -material(board)
+            board.pop()
+            if (best is None) or (value > best[0]):
+                best = (value, move)
+
+        if best is None:
+            return {'score': chess.engine.PovScore(chess.engine.Cp(0), board.turn), 'pv': []}
+        return {'score': chess.engine.PovScore(chess.engine.Cp(best[0]), board.turn), 'pv': [best[1]]}
+
+
+@pytest.fixture
+def engine(monkeypatch, tmp_path):
+    # reviews without Stockfish, the opening book or results cached by other tests
+    openings_csv = tmp_path / 'openings.csv'
+    openings_csv.write_text("eco,name,pgn\nC20,King's Pawn Game,1. e4 e5\nC50,Italian Game,1. e4 e5 2. Nf3 Nc6 3. Bc4\n")
+    monkeypatch.setattr(chess_review, 'OPENINGS_CSV', str(openings_csv))
+    monkeypatch.setattr(chess_review, 'OPENINGS_INDEX', str(tmp_path / 'missing.bin'))
+    monkeypatch.setattr(chess_review, 'progress_bar', lambda iterable: iterable)
+
+    fake_engine = FakeEngine()
+    monkeypatch.setattr(chess_review, 'run_search', fake_engine.search)
+
+    chess_review.get_opening_index.cache_clear()
+    chess_review.analyse_pgn.cache_clear()
+    chess_review.REVIEWED_GAMES.clear()
+    yield fake_engine
+    chess_review.get_opening_index.cache_clear()
+    chess_review.analyse_pgn.cache_clear()
+    chess_review.REVIEWED_GAMES.clear()
+
+
+@pytest.fixture
+def book(monkeypatch, tmp_path):
+    # the first six plies of GAME_PGN
+    path = str(tmp_path / 'book.bin')
+    write_polyglot_book(path, ['e4 e5 Nf3 Nc6 Bc4 Bc5'])
+    monkeypatch.setattr(chess_review, 'POLYGLOT_BOOK', path)
+    chess_review.get_opening_book.cache_clear()
+    yield path
+    chess_review.get_opening_book.cache_clear()
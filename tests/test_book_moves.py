@@ -0,0 +1,40 @@
+import io
+
+import chess
+import chess.pgn
+
+import chess_review
+from conftest import GAME_PGN
+
+BOOK_PLIES = 6
+
+
+def game_positions(pgn_data):
+    board = chess.Board()
+    positions = [board.fen()]
+    for move in chess.pgn.read_game(io.StringIO(pgn_data)).mainline_moves():
+        board.push(move)
+        positions.append(board.fen())
+    return positions
+
+
+def test_book_moves_are_not_searched(engine, book):
+    chess_review.pgn_game_review(GAME_PGN, False, 'depth', 0.25, 8)
+
+    positions = game_positions(GAME_PGN)
+    assert not set(positions[:BOOK_PLIES]) & set(engine.searches)
+    # the engine starts with the position where the game leaves the book
+    assert positions[BOOK_PLIES] in engine.searches
+
+
+def test_book_saves_searches(engine, book, monkeypatch):
+    chess_review.pgn_game_review(GAME_PGN, False, 'depth', 0.25, 8)
+    with_book = len(engine.searches)
+
+    monkeypatch.setattr(chess_review, 'POLYGLOT_BOOK', None)
+    chess_review.get_opening_book.cache_clear()
+    chess_review.analyse_pgn.cache_clear()
+    chess_review.REVIEWED_GAMES.clear()
+    chess_review.pgn_game_review(GAME_PGN, False, 'depth', 0.25, 8)
+
+    assert with_book < len(engine.searches) - with_book
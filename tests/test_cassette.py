@@ -0,0 +1,61 @@
+import pytest
+
+import chess_review
+from conftest import GAME_PGN
+
+
+def review(pgn_data):
+    chess_review.analyse_pgn.cache_clear()
+    chess_review.REVIEWED_GAMES.clear()
+    return chess_review.pgn_game_review(pgn_data, False, 'depth', 0.25, 8)
+
+
+def test_replay_gives_the_recorded_review_without_the_engine(engine, monkeypatch, tmp_path):
+    path = str(tmp_path / 'game.cassette.json.gz')
+    with chess_review.engine_cassette(path, 'record') as cassette:
+        recorded = review(GAME_PGN)
+    assert len(cassette.searches) == len(set(engine.searches))
+
+    def no_engine(*args):
+        raise AssertionError('replay searched with the engine')
+    monkeypatch.setattr(chess_review, 'run_search', no_engine)
+
+    with chess_review.engine_cassette(path, 'replay'):
+        replayed = review(GAME_PGN)
+
+    assert replayed == recorded
+
+
+def test_replay_of_an_unrecorded_search_fails(engine, tmp_path):
+    path = str(tmp_path / 'empty.cassette.json.gz')
+    with chess_review.engine_cassette(path, 'record'):
+        pass
+
+    with chess_review.engine_cassette(path, 'replay'):
+        with pytest.raises(LookupError):
+            review(GAME_PGN)
+
+
+def test_cassette_is_only_active_in_its_context(engine, tmp_path):
+    path = str(tmp_path / 'game.cassette.json.gz')
+    with chess_review.engine_cassette(path, 'record') as cassette:
+        assert chess_review.ACTIVE_CASSETTE.get() is cassette
+    assert chess_review.ACTIVE_CASSETTE.get() is None
+
+
+def test_budget_review_replays_whatever_time_its_searches_got(engine, monkeypatch, tmp_path):
+    path = str(tmp_path / 'budget.cassette.json.gz')
+    with chess_review.engine_cassette(path, 'record') as cassette:
+        recorded = chess_review.pgn_game_review(GAME_PGN, False, 'budget', 5, 8)
+    assert all('|budget=5.0' in key for key in cassette.searches)
+
+    def no_engine(*args):
+        raise AssertionError('replay searched with the engine')
+    monkeypatch.setattr(chess_review, 'run_search', no_engine)
+    chess_review.analyse_pgn.cache_clear()
+    chess_review.REVIEWED_GAMES.clear()
+
+    with chess_review.engine_cassette(path, 'replay'):
+        replayed = chess_review.pgn_game_review(GAME_PGN, False, 'budget', 5, 8)
+
+    assert replayed == recorded
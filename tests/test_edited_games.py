@@ -0,0 +1,43 @@
+import chess_review
+from conftest import GAME_PGN
+
+# the same game with its last two moves changed
+EDITED_PGN = GAME_PGN.replace('12. Bg5 Bxg5 *', '12. Qa4+ Bd7 *')
+
+
+def review(pgn_data, roast=False):
+    chess_review.analyse_pgn.cache_clear()
+    return chess_review.pgn_game_review(pgn_data, roast, 'depth', 0.25, 8)
+
+
+def test_edited_game_gives_the_review_of_a_fresh_analysis(engine):
+    fresh = review(EDITED_PGN)
+    chess_review.REVIEWED_GAMES.clear()
+
+    review(GAME_PGN)
+    edited = review(EDITED_PGN)
+
+    assert edited == fresh
+
+
+def test_edited_game_only_searches_the_plies_that_changed(engine):
+    review(EDITED_PGN)
+    fresh_searches = len(engine.searches)
+    chess_review.REVIEWED_GAMES.clear()
+
+    review(GAME_PGN)
+    before = len(engine.searches)
+    reused = chess_review.REVIEWED_GAMES.stats['reused']
+    review(EDITED_PGN)
+
+    assert len(engine.searches) - before < fresh_searches / 4
+    assert chess_review.REVIEWED_GAMES.stats['reused'] - reused == 22
+
+
+def test_other_limit_does_not_reuse_the_game(engine):
+    review(GAME_PGN)
+    reused = chess_review.REVIEWED_GAMES.stats['reused']
+    chess_review.analyse_pgn.cache_clear()
+    chess_review.pgn_game_review(EDITED_PGN, False, 'depth', 0.25, 9)
+
+    assert chess_review.REVIEWED_GAMES.stats['reused'] == reused
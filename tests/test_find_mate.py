@@ -0,0 +1,46 @@
+import chess
+
+import chess_review
+
+# white mates with Qxf7
+MATE_IN_ONE = "r1bqkb1r/pppp1ppp/2n2n2/4p2Q/2B1P3/8/PPPP1PPP/RNB1K1NR w KQkq - 4 4"
+QUIET = "rnbqkbnr/pppppppp/8/8/4P3/8/PPPP1PPP/RNBQKBNR b KQkq - 0 1"
+
+
+def answered_by(board):
+    before = chess_review.MATE_SEARCHES.copy()
+    mate = chess_review.find_mate(board)
+    tiers = chess_review.MATE_SEARCHES - before
+    assert sum(tiers.values()) == 1
+    return mate, next(iter(tiers))
+
+
+def test_short_mates_are_found_without_the_engine(engine):
+    mate, tier = answered_by(chess.Board(MATE_IN_ONE))
+
+    assert (mate.mate(), tier) == (1, 'mate in 1')
+    assert engine.searches == []
+
+
+def test_finished_games_are_settled_without_the_engine(engine):
+    board = chess.Board("7k/5Q2/6K1/8/8/8/8/8 b - - 0 1")
+
+    assert answered_by(board) == (None, 'finished')
+    assert engine.searches == []
+
+
+def test_other_positions_get_a_mate_limited_search(engine):
+    mate, tier = answered_by(chess.Board(QUIET))
+
+    assert (mate, tier) == (None, 'engine')
+    assert engine.mates == [chess_review.MATE_SEARCH_MOVES]
+
+
+def test_search_the_review_already_made_answers_the_question(engine):
+    board = chess.Board(QUIET)
+    with chess_review.prefetching([]) as prefetcher:
+        prefetcher.analyse(board)
+        mate, tier = answered_by(board)
+
+    assert (mate, tier) == (None, 'cached')
+    assert engine.mates == [None]
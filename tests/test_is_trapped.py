@@ -0,0 +1,60 @@
+import os
+import sys
+
+import chess
+
+import chess_review
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks'))
+from verify_is_trapped import corpus_positions, is_trapped_legacy, is_trapped_reference
+
+
+def test_knight_with_every_escape_covered_is_trapped():
+    board = chess.Board("4k3/5p1p/4p3/6p1/4p2N/7p/8/4K3 w - - 0 1")
+    assert chess_review.is_trapped(board, chess.H4, chess.BLACK)
+
+
+def test_knight_with_a_free_escape_is_not_trapped():
+    # without the pawn on h3 the knight gets out through g2
+    board = chess.Board("4k3/5p1p/4p3/6p1/4p2N/8/8/4K3 w - - 0 1")
+    assert not chess_review.is_trapped(board, chess.H4, chess.BLACK)
+
+
+def test_kings_and_own_pieces_are_never_trapped():
+    board = chess.Board("4k3/5p1p/4p3/6p1/4p2N/7p/8/4K3 w - - 0 1")
+    assert not chess_review.is_trapped(board, chess.E1, chess.BLACK)
+    assert not chess_review.is_trapped(board, chess.H4, chess.WHITE)
+
+
+def test_agrees_with_the_legacy_rules_on_every_piece():
+    # the legacy rules with every escape square and attacker counted, trapped pieces included
+    checked = 0
+    trapped = set()
+    for n, board in enumerate(corpus_positions(n_games=20, seed=0)):
+        safe_masks = {by: chess_review.get_safe_square_masks(board, by) for by in chess.COLORS}
+        for by in chess.COLORS:
+            for square in chess.scan_forward(board.occupied_co[not by]):
+                checked += 1
+                result = chess_review.is_trapped(board, square, by, safe_masks[by])
+                assert result == is_trapped_reference(board, square, by), (board.fen(), chess.square_name(square))
+                if result:
+                    trapped.add((n, square))
+
+    assert checked > 10000
+    assert len(trapped) > 0
+
+
+def test_knight_with_one_safe_escape_square_is_not_trapped():
+    # legacy bug: Ne3 is only attacked by the queen and saves the knight, but the legacy check
+    # lets the pawn-covered f4 and h4 that come after it overwrite that verdict
+    board = chess.Board("1r2kb2/p2b2r1/3p3n/R2PpPp1/1P1qP3/7p/4NPNP/1B2BR1K w - - 3 36")
+    assert is_trapped_legacy(board, chess.G2, chess.BLACK)
+    assert not chess_review.is_trapped(board, chess.G2, chess.BLACK)
+
+
+def test_escape_square_covered_by_an_equal_piece_stays_unsafe():
+    # legacy bug: the bishop on f8 covers g7, the only escape square of the bishop on h6, but the
+    # legacy check lets the rook on g8, a higher piece that also covers g7, overwrite that verdict
+    board = chess.Board("1r1k1br1/p5pp/b3Q2B/P5N1/1pP2p2/2Nnn3/1P1RK1B1/R7 w - - 2 28")
+    assert not is_trapped_legacy(board, chess.H6, chess.BLACK)
+    assert chess_review.is_trapped(board, chess.H6, chess.BLACK)
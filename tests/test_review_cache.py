@@ -0,0 +1,31 @@
+import chess_review
+from conftest import GAME_PGN
+
+
+def test_same_request_written_differently_is_analysed_once(engine):
+    chess_review.pgn_game_review(GAME_PGN, False, 'depth', 0.25, 8)
+    searches = len(engine.searches)
+
+    chess_review.pgn_game_review('[Event "Club night"]\n\n' + GAME_PGN, True, 'depth', '0.25', '8')
+
+    assert len(engine.searches) == searches
+    assert chess_review.analyse_pgn.cache_info().hits == 1
+
+
+def test_other_limit_is_analysed_again(engine):
+    chess_review.pgn_game_review(GAME_PGN, False, 'depth', 0.25, 8)
+    chess_review.REVIEWED_GAMES.clear()
+    searches = len(engine.searches)
+
+    chess_review.pgn_game_review(GAME_PGN, False, 'depth', 0.25, 9)
+
+    assert len(engine.searches) > searches
+
+
+def test_review_searches_with_its_own_limit(engine):
+    default_limit = dict(chess_review.STOCKFISH_CONFIG)
+
+    chess_review.pgn_game_review(GAME_PGN, False, 'time', 0.05, 8)
+
+    assert {tuple(limit.items()) for limit in engine.limits} == {(('time', 0.05),)}
+    assert chess_review.STOCKFISH_CONFIG == default_limit
@@ -0,0 +1,135 @@
+import multiprocessing
+import threading
+import time
+
+import pytest
+
+import chess_review
+from conftest import wait_for
+
+
+def run_review(scheduler, review_class, name, order, release):
+    with scheduler.admit(review_class):
+        order.append(name)
+        release.wait(5)
+
+
+def start_review(scheduler, review_class, name, order, release):
+    thread = threading.Thread(target=run_review, args=(scheduler, review_class, name, order, release))
+    thread.start()
+    return thread
+
+
+def test_interactive_reviews_overtake_waiting_batch_reviews():
+    scheduler = chess_review.ReviewScheduler(max_running=1, max_queued=4)
+    order = []
+    release = threading.Event()
+
+    threads = [start_review(scheduler, 'batch', 'first batch', order, release)]
+    wait_for(lambda: order == ['first batch'])
+    threads.append(start_review(scheduler, 'batch', 'second batch', order, release))
+    wait_for(lambda: len(scheduler.waiting) == 1)
+    threads.append(start_review(scheduler, 'interactive', 'interactive', order, release))
+    wait_for(lambda: len(scheduler.waiting) == 2)
+
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert order == ['first batch', 'interactive', 'second batch']
+
+
+def test_full_queue_is_refused_with_a_retry_time():
+    scheduler = chess_review.ReviewScheduler(max_running=1, max_queued=1)
+    order = []
+    release = threading.Event()
+
+    threads = [start_review(scheduler, 'batch', 'running', order, release)]
+    wait_for(lambda: order == ['running'])
+    threads.append(start_review(scheduler, 'batch', 'waiting', order, release))
+    wait_for(lambda: len(scheduler.waiting) == 1)
+
+    cancellation = chess_review.Cancellation()
+    token = chess_review.ACTIVE_CANCELLATION.set(cancellation)
+    try:
+        with pytest.raises(chess_review.ReviewQueueFull) as error:
+            with scheduler.admit('batch'):
+                pass
+    finally:
+        chess_review.ACTIVE_CANCELLATION.reset(token)
+        release.set()
+        for thread in threads:
+            thread.join(5)
+
+    assert error.value.retry_after >= 1
+    assert scheduler.stats['rejected batch'] == 1
+    # the refused review does not keep waking the scheduler
+    assert cancellation.callbacks == []
+
+
+def test_cancelled_review_leaves_the_queue():
+    scheduler = chess_review.ReviewScheduler(max_running=1, max_queued=4)
+    order = []
+    release = threading.Event()
+    cancellation = chess_review.Cancellation()
+    errors = []
+
+    def cancellable_review():
+        chess_review.ACTIVE_CANCELLATION.set(cancellation)
+        try:
+            with scheduler.admit('batch'):
+                order.append('cancelled')
+        except chess_review.ReviewCancelled as error:
+            errors.append(error)
+
+    running = start_review(scheduler, 'batch', 'running', order, release)
+    wait_for(lambda: order == ['running'])
+    waiting = threading.Thread(target=cancellable_review)
+    waiting.start()
+    wait_for(lambda: len(scheduler.waiting) == 1)
+
+    cancellation.cancel('client went away')
+    waiting.join(5)
+    release.set()
+    running.join(5)
+
+    assert len(errors) == 1
+    assert scheduler.waiting == []
+    assert order == ['running']
+    assert cancellation.callbacks == []
+
+
+def hold_review(scheduler, started, release):
+    with scheduler.admit('batch'):
+        started.set()
+        release.wait(5)
+
+
+def test_running_limit_is_shared_between_forked_workers():
+    context = multiprocessing.get_context('fork')
+    scheduler = chess_review.ReviewScheduler(max_running=1, max_queued=4)
+    scheduler.share(context)
+    started = context.Event()
+    release = context.Event()
+
+    worker = context.Process(target=hold_review, args=(scheduler, started, release))
+    worker.start()
+    try:
+        assert started.wait(5)
+        assert scheduler.running['batch'] == 1
+
+        order = []
+        finished = threading.Event()
+        finished.set()
+        thread = start_review(scheduler, 'interactive', 'other worker', order, finished)
+        wait_for(lambda: len(scheduler.waiting) == 1)
+        time.sleep(3 * chess_review.SHARED_POLL_SECONDS)
+        assert order == []
+
+        release.set()
+        wait_for(lambda: order == ['other worker'])
+    finally:
+        release.set()
+        worker.join(5)
+    thread.join(5)
+    assert scheduler.running.values() == [0, 0]
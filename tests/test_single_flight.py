@@ -0,0 +1,121 @@
+import threading
+
+import chess_review
+from conftest import wait_for
+
+
+class SlowCall:
+    # blocks until released, so other callers can join it while it runs
+
+    def __init__(self, result='analysis'):
+        self.result = result
+        self.calls = 0
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self.cancellation = None
+
+    def __call__(self):
+        self.calls += 1
+        self.cancellation = chess_review.ACTIVE_CANCELLATION.get()
+        self.started.set()
+        self.release.wait(5)
+        if isinstance(self.result, Exception):
+            raise self.result
+        return self.result
+
+
+def call_in_thread(flights, key, function, results, cancellation=None):
+    def run():
+        try:
+            results.append(flights.do(key, function, cancellation=cancellation))
+        except Exception as error:
+            results.append(error)
+    thread = threading.Thread(target=run)
+    thread.start()
+    return thread
+
+
+def test_concurrent_calls_with_the_same_key_run_once():
+    flights = chess_review.SingleFlight()
+    call = SlowCall()
+    results = []
+
+    leader = call_in_thread(flights, 'game', call, results)
+    call.started.wait(5)
+    follower = call_in_thread(flights, 'game', call, results)
+    wait_for(lambda: flights.stats['coalesced'] == 1)
+    call.release.set()
+    leader.join(5)
+    follower.join(5)
+
+    assert call.calls == 1
+    assert results == ['analysis', 'analysis']
+    assert flights.calls == {}
+
+
+def test_other_keys_are_not_coalesced():
+    flights = chess_review.SingleFlight()
+    call = SlowCall()
+    call.release.set()
+
+    assert flights.do('game', call) == flights.do('other game', call)
+    assert call.calls == 2
+    assert flights.stats['coalesced'] == 0
+
+
+def test_errors_reach_every_caller():
+    flights = chess_review.SingleFlight()
+    call = SlowCall(ValueError('could not read the PGN'))
+    results = []
+
+    leader = call_in_thread(flights, 'game', call, results)
+    call.started.wait(5)
+    follower = call_in_thread(flights, 'game', call, results)
+    wait_for(lambda: flights.stats['coalesced'] == 1)
+    call.release.set()
+    leader.join(5)
+    follower.join(5)
+
+    assert [type(result) for result in results] == [ValueError, ValueError]
+
+
+def test_call_keeps_running_while_a_caller_still_waits():
+    flights = chess_review.SingleFlight()
+    call = SlowCall()
+    results = []
+    leaving = chess_review.Cancellation()
+
+    leader = call_in_thread(flights, 'game', call, results, chess_review.Cancellation())
+    call.started.wait(5)
+    follower = call_in_thread(flights, 'game', call, results, leaving)
+    wait_for(lambda: flights.stats['coalesced'] == 1)
+
+    leaving.cancel('client went away')
+    follower.join(5)
+    assert not call.cancellation.is_cancelled()
+
+    call.release.set()
+    leader.join(5)
+    assert isinstance(results[0], chess_review.ReviewCancelled)
+    assert results[1] == 'analysis'
+
+
+def test_call_is_cancelled_once_every_caller_has_left():
+    flights = chess_review.SingleFlight()
+    call = SlowCall()
+    results = []
+    cancellations = [chess_review.Cancellation(), chess_review.Cancellation()]
+
+    leader = call_in_thread(flights, 'game', call, results, cancellations[0])
+    call.started.wait(5)
+    follower = call_in_thread(flights, 'game', call, results, cancellations[1])
+    wait_for(lambda: flights.stats['coalesced'] == 1)
+
+    cancellations[1].cancel('client went away')
+    follower.join(5)
+    cancellations[0].cancel('client went away')
+    # the searches of the call see the cancellation and stop
+    assert call.cancellation.is_cancelled()
+
+    call.release.set()
+    leader.join(5)
@@ -0,0 +1,83 @@
+import contextvars
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+# Nested spans of one review written as a Chrome trace, open the file in chrome://tracing or
+# https://ui.perfetto.dev to see the timeline of every thread. Spans cost nothing unless a
+# trace is active in the calling context.
+
+ACTIVE_TRACE = contextvars.ContextVar('ACTIVE_TRACE', default=None)
+NO_SPAN = nullcontext()
+
+
+class Trace:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.start = time.perf_counter()
+        self.events = []
+        self.threads = dict()
+
+    @contextmanager
+    def span(self, name, category, args):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            thread = threading.current_thread()
+            event = {
+                'name': name,
+                'cat': category,
+                'ph': 'X',
+                'ts': (start - self.start) * 1e6,
+                'dur': (end - start) * 1e6,
+                'pid': os.getpid(),
+                'tid': thread.ident,
+                'args': args,
+            }
+            with self.lock:
+                self.events.append(event)
+                self.threads[thread.ident] = thread.name
+
+    def to_json(self):
+        with self.lock:
+            thread_names = [
+                {'name': 'thread_name', 'ph': 'M', 'pid': os.getpid(), 'tid': ident, 'args': {'name': name}}
+                for ident, name in self.threads.items()
+            ]
+            return {'traceEvents': thread_names + sorted(self.events, key=lambda event: event['ts']), 'displayTimeUnit': 'ms'}
+
+    def save(self, path):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path, 'w') as trace_file:
+            json.dump(self.to_json(), trace_file, default=str)
+
+
+def span(name, category='review', **args):
+    # with span('search', fen=board.fen): ... a name or argument that costs time to build is passed
+    # as a function, it is only called when a trace is active
+    trace = ACTIVE_TRACE.get()
+    if trace is None:
+        return NO_SPAN
+    if callable(name):
+        name = name()
+    return trace.span(name, category, {key: value() if callable(value) else value for key, value in args.items()})
+
+
+@contextmanager
+def tracing(path=None):
+    # records the spans of the calling context and of the threads that copy it, saved to path at the end
+    trace = Trace()
+    token = ACTIVE_TRACE.set(trace)
+    try:
+        yield trace
+    finally:
+        ACTIVE_TRACE.reset(token)
+        if path is not None:
+            trace.save(path)
@@ -1,7 +1,15 @@
 from flask import Blueprint
 from flask import render_template
 from flask import request
+from flask import jsonify
+from flask import Response
+from contextlib import contextmanager
+import gzip
+import json
 import os
+import select
+import socket
+import threading
 import chess_review
 
 views = Blueprint(__name__, "views")
@@ -10,6 +18,53 @@ views = Blueprint(__name__, "views")
 def home():
     return render_template('index.html')
 
+@views.route("/health")
+def health():
+    return "ok"
+
+def get_review_config(values):
+    return {
+        "limit_type": values.get('limits', 'depth'),
+        "time_limit": values.get('time-limit', 0.25),
+        "depth_limit": values.get('depth-limit', 12),
+        "roast": ('roastmode' in values) and (values.get('roastmode') not in [False, 'false', '0', 'off'])
+    }
+
+def watch_connection(connection, cancellation, done):
+    # a closed connection reads as empty, the review of a client that went away is cancelled
+    while not done.wait(0.5):
+        try:
+            readable, _, _ = select.select([connection], [], [], 0)
+            closed = bool(readable) and (connection.recv(1, socket.MSG_PEEK) == b'')
+        except (OSError, ValueError):
+            closed = True
+        if closed:
+            cancellation.cancel('client disconnected')
+            return
+
+@contextmanager
+def cancellable_request(review_id=None):
+    # cancelled when the client disconnects or posts to /api/analysis/<review_id>/cancel
+    with chess_review.cancellable_review(review_id) as cancellation:
+        done = threading.Event()
+        connection = request.environ.get('werkzeug.socket')
+        if connection is not None:
+            threading.Thread(target=watch_connection, args=(connection, cancellation, done), daemon=True).start()
+        try:
+            yield cancellation
+        finally:
+            done.set()
+
+def review_cancelled(error):
+    # 499 as nginx logs it, the client closed the connection or asked to stop
+    return jsonify(error=f'review {error}'), 499
+
+def review_queue_full(error):
+    response = jsonify(error=str(error))
+    response.status_code = 503
+    response.headers['Retry-After'] = str(error.retry_after)
+    return response
+
 @views.route('/analysis', methods=['POST'])
 def analyse():
 
@@ -29,6 +84,14 @@ def analyse():
             "roast": 'roastmode' in request.form
         }
 
+    try:
+        with cancellable_request(request.form.get('review-id')) as cancellation:
+            review = chess_review.pgn_game_review(pgn_data=pgn_data, review_class='interactive', cancellation=cancellation, **config)
+    except chess_review.ReviewQueueFull as error:
+        return review_queue_full(error)
+    except chess_review.ReviewCancelled as error:
+        return review_cancelled(error)
+
     (
         san_moves, 
         fens, 
@@ -48,7 +111,7 @@ def analyse():
         black_elo_est,
         average_cpl_white,
         average_cpl_black
-     ) = chess_review.pgn_game_review(pgn_data=pgn_data, **config)
+     ) = review
 
     return render_template('analysis.html',
             move_list = san_moves,
@@ -66,4 +129,101 @@ def analyse():
             acc_pair = [round(white_acc), round(black_acc)],
             elo_pair = [round(white_elo_est), round(black_elo_est)],
             acpl_pair = [round(average_cpl_white), round(average_cpl_black)]
-        )
\ No newline at end of file
+        )
+
+def get_review_json(pgn_data, config, review_class='batch', cancellation=None):
+    (
+        san_moves,
+        fens,
+        scores,
+        classification_list,
+        review_list,
+        best_review_list,
+        san_best_moves,
+        uci_best_moves,
+        devs,
+        tens,
+        mobs,
+        conts,
+        white_acc,
+        black_acc,
+        white_elo_est,
+        black_elo_est,
+        average_cpl_white,
+        average_cpl_black
+     ) = chess_review.pgn_game_review(pgn_data=pgn_data, review_class=review_class, cancellation=cancellation, **config)
+
+    return {
+        "moves": [
+            {
+                "san": san,
+                "fen": fen,
+                "score": score,
+                "classification": classification,
+                "review": review,
+                "best_move": best_move,
+                "best_move_uci": "".join(best_move_uci),
+                "best_move_review": best_review,
+            }
+            for san, fen, score, classification, review, best_move, best_move_uci, best_review
+            in zip(san_moves, fens, scores, classification_list, review_list, san_best_moves, uci_best_moves, best_review_list)
+        ],
+        "metrics": {
+            "development": devs,
+            "tension": tens,
+            "mobility": mobs,
+            "control": conts,
+        },
+        "white": {"accuracy": white_acc, "elo": white_elo_est, "acpl": average_cpl_white},
+        "black": {"accuracy": black_acc, "elo": black_elo_est, "acpl": average_cpl_black},
+    }
+
+@views.route('/api/analysis', methods=['GET', 'POST'])
+def analyse_json():
+    # GET /views/api/analysis?pgn=...&limits=depth&depth-limit=12, or POST the same fields as a form or JSON
+    values = request.get_json(silent=True) or request.values
+    pgn_data = values.get('pgn')
+    if pgn_data is None:
+        return jsonify(error="missing pgn"), 400
+
+    config = get_review_config(values)
+    try:
+        normalized_request = chess_review.normalize_review_request(pgn_data, **config)
+    except ValueError as error:
+        return jsonify(error=str(error)), 400
+
+    # the review of a request never changes, so the tag is known before anything is computed,
+    # weak as the gzipped and the plain body carry the same tag
+    etag = chess_review.get_review_key(normalized_request)
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+        response.set_etag(etag, weak=True)
+        return response
+
+    # API reviews are always batch, only the page of the app is interactive
+    try:
+        with cancellable_request(values.get('review-id')) as cancellation:
+            review_json = get_review_json(pgn_data, config, cancellation=cancellation)
+    except chess_review.ReviewQueueFull as error:
+        return review_queue_full(error)
+    except chess_review.ReviewCancelled as error:
+        return review_cancelled(error)
+    body = json.dumps(review_json, separators=(',', ':')).encode('utf-8')
+
+    response = Response(content_type='application/json')
+    if 'gzip' in request.accept_encodings:
+        response.set_data(gzip.compress(body, compresslevel=6))
+        response.headers['Content-Encoding'] = 'gzip'
+    else:
+        response.set_data(body)
+    response.headers['Vary'] = 'Accept-Encoding'
+    response.headers['Cache-Control'] = 'no-cache' # revalidate with the ETag
+    response.set_etag(etag, weak=True)
+    return response
+
+@views.route('/api/analysis/<review_id>/cancel', methods=['POST'])
+def cancel_analysis(review_id):
+    # review_id is the review-id field the client sent with its review
+    if not chess_review.cancel_review(review_id):
+        return jsonify(error="no review running with this id"), 404
+    return jsonify(cancelled=review_id)